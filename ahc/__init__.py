@@ -1,4 +1,13 @@
+from .ephemeris import *
+from .resultcache import *
 from .sunmoon import *
 from .crescent import *
+from .ephemtable import *
+from .fastephem import *
+from .mapengine import *
+from .mapmask import *
+from .criteria import *
+from .packedmaps import *
+from .prayertimes import *
 from .plotting import *
 from .hilal import *
\ No newline at end of file
@@ -1,197 +1,292 @@
 import numpy as np
-import os, sys
-from astropy.io import fits 
+import os
+import shutil
+import argparse
 from datetime import timedelta
 
-sys.path.append('/Users/abdurrouf/Research/github_cook/AHC/ahc/')
-
 from ahc import sunmoon as sm
-from ahc import crescent as cs
-
-if len(sys.argv) != 2:
-	print ('# USAGE: python calcmaps_fits.py (1) Hijri year')
-	sys.exit()
-
-hijri_year = float(sys.argv[1])
-
-hijri_months = sm.list_hijri_months()
-
-factor = 1.0
-min_lat1, max_lat1, min_long1, max_long1 = -90, 90, -180, 180
-min_lat, max_lat, min_long, max_long = -60, 60, -180, 180
-
-nlat = int(factor*((max_lat1-min_lat1)+1))
-nlong = int(factor*((max_long1-min_long1)+1))
-grid_lat = np.linspace(min_lat1, max_lat1, nlat)
-grid_long = np.linspace(min_long1, max_long1, nlong)
-
-nmonths = 12
-
-# initiate FITS file production
-hdul = fits.HDUList()
-hdr = fits.Header()
-hdr['software'] = 'AHC'
-hdr['creator'] = 'Abdurrouf'
-hdr['hijri_yy'] = int(hijri_year)
-hdr['nlayers'] = 12
-hdr['layer0'] = 'moon_alt_d1'
-hdr['layer1'] = 'moon_arcv_d1'
-hdr['layer2'] = 'moon_elong_d1'
-hdr['layer3'] = 'moon_elong_geo_d1'
-hdr['layer4'] = 'moon_width_d1'
-hdr['layer5'] = 'moon_age_utc_seconds_d1' 
-
-hdr['layer6'] = 'moon_alt_d2'
-hdr['layer7'] = 'moon_arcv_d2'
-hdr['layer8'] = 'moon_elong_d2'
-hdr['layer9'] = 'moon_elong_geo_d2'
-hdr['layer10'] = 'moon_width_d2'
-hdr['layer11'] = 'moon_age_utc_seconds_d2'
-
-hdr['minlat'], hdr['maxlat'] = -90, 90
-hdr['minlong'], hdr['maxlong'] = -180, 180
-hdr['minlat1'], hdr['maxlat1'] = -60, 60
-hdr['minlong1'], hdr['maxlong1'] = -180, 180
-hdr['nlat'] = nlat
-hdr['nlong'] = nlong
-primary_hdu = fits.PrimaryHDU(header=hdr)
-hdul.append(primary_hdu)
-
-for mm in range(int(nmonths)):
+from ahc.mapengine import map_grid, moon_property_cube
+
+# USAGE: python -m ahc.calcmaps_fits --years 1446 1447 --factor 1.0 --workers 4 --out maps [--compress lossless]
+#
+# Every month is written to <out>/<year>_parts/<month>.fits as soon as it is computed. A run that stops
+# is resumed by running the same command again: the months already written are skipped, and the year
+# is assembled into <out>/<year>.fits once all of its months are there.
+#
+# With --compress the months of the year are written as tile compressed float32 images (CompImageHDU), either
+# lossless or quantized, and read_region() decompresses only the tiles covering a box of latitude and longitude.
+
+__all__ = ["FITS_LAYERS", "FITS_COMPRESSIONS", "month_hdu", "compress_hdu", "calc_year_fits", "read_region"]
+
+# Layers of the image of every month, in this order, and their names in the primary header.
+# The first 12 layers of a two-day moon_property_cube block come in the same order.
+FITS_LAYERS = ('alt', 'arcv', 'elong', 'elong_geo', 'width', 'age_utc', 'alt1', 'arcv1', 'elong1', 'elong_geo1', 'width1', 'age_utc1')
+FITS_LAYER_NAMES = ('moon_alt_d1', 'moon_arcv_d1', 'moon_elong_d1', 'moon_elong_geo_d1', 'moon_width_d1', 'moon_age_utc_seconds_d1',
+					'moon_alt_d2', 'moon_arcv_d2', 'moon_elong_d2', 'moon_elong_geo_d2', 'moon_width_d2', 'moon_age_utc_seconds_d2')
+
+# Box of the computed cells, the maps cover the whole globe
+MIN_LAT, MAX_LAT, MIN_LONG, MAX_LONG = -60, 60, -180, 180
+
+NMONTHS = 12
+
+# Output modes: float64 images as they are computed, float32 tile compressed without loss (GZIP of the
+# shuffled bytes), or float32 quantized to quantize_level levels of the noise of every tile and RICE compressed
+FITS_COMPRESSIONS = ('none', 'lossless', 'quantized')
+
+# Default side of the square tiles of the compressed images, in cells, every tile holds a single layer
+TILE_CELLS = 64
+QUANTIZE_LEVEL = 16.0
+
+
+def primary_header(hijri_year, factor=1.0, compress='none', tile=TILE_CELLS, quantize_level=QUANTIZE_LEVEL):
+	from astropy.io import fits
+	from ahc.criteria import VISIBILITY_RULES, visibility_criterion_layers
+
+	nlat, nlong = map_grid(factor=factor)[0].shape
+
+	hdr = fits.Header()
+	hdr['software'] = 'AHC'
+	hdr['creator'] = 'Abdurrouf'
+	hdr['hijri_yy'] = int(hijri_year)
+	hdr['nlayers'] = len(FITS_LAYERS)
+	for ii, name in enumerate(FITS_LAYER_NAMES):
+		hdr['layer%d' % ii] = name
+
+	hdr['minlat'], hdr['maxlat'] = -90, 90
+	hdr['minlong'], hdr['maxlong'] = -180, 180
+	hdr['minlat1'], hdr['maxlat1'] = MIN_LAT, MAX_LAT
+	hdr['minlong1'], hdr['maxlong1'] = MIN_LONG, MAX_LONG
+	hdr['nlat'] = nlat
+	hdr['nlong'] = nlong
+	hdr['factor'] = factor
+
+	# layers of every visibility criterion, as indices of the first day, add 6 for the next day
+	hdr['ncrit'] = len(VISIBILITY_RULES)
+	for ii, criterion in enumerate(VISIBILITY_RULES):
+		hdr['crit%d' % ii] = criterion
+		hdr['critl%d' % ii] = ','.join('%d' % FITS_LAYERS.index(name) for name in visibility_criterion_layers(criterion))
+
+	hdr['mapcomp'] = compress
+	if compress != 'none':
+		hdr['maptile'] = tile
+	if compress == 'quantized':
+		hdr['mapquant'] = quantize_level
+	return hdr
+
+
+def _grid_cards(hdr, factor):
+	# world coordinates of the cells (linear, in degree) so that a reader finds the pixels of a region
+	nlat, nlong = map_grid(factor=factor)[0].shape
+	dlat, dlong = 180.0/(nlat-1), 360.0/(nlong-1)
+	hdr['ctype1'], hdr['cunit1'] = 'LONG', 'deg'
+	hdr['crpix1'], hdr['crval1'], hdr['cdelt1'] = 1.0, -180.0 + 0.5*dlong, dlong
+	hdr['ctype2'], hdr['cunit2'] = 'LAT', 'deg'
+	hdr['crpix2'], hdr['crval2'], hdr['cdelt2'] = 1.0, -90.0 + 0.5*dlat, dlat
+	hdr['ctype3'] = 'LAYER'
+	hdr['crpix3'], hdr['crval3'], hdr['cdelt3'] = 1.0, 0.0, 1.0
+	return hdr
+
+
+def month_hdu(hijri_year, month, factor=1.0, workers=1):
+	""" Image HDU of the maps of a Hijri month: the FITS_LAYERS at sunset of the day of ijtima and of the next day. """
+	from astropy.io import fits
+
+	hijri_months = sm.list_hijri_months()
+
 	# get conjuction UTC time
-	ijtima_utc = sm.newmoon_hijri_month_utc(hijri_year, mm+1)
+	ijtima_utc = sm.newmoon_hijri_month_utc(hijri_year, month)
+	ijtima_utc_plus1 = ijtima_utc + timedelta(days=1)
 
 	hdr = fits.Header()
-	hdr['conj_yy'] = ijtima_utc.year 
+	hdr['conj_yy'] = ijtima_utc.year
 	hdr['conj_mm'] = ijtima_utc.month
-	hdr['conj_dd'] = ijtima_utc.day 
+	hdr['conj_dd'] = ijtima_utc.day
 	hdr['conj_h'] = ijtima_utc.hour
 	hdr['conj_m'] = ijtima_utc.minute
 	hdr['conj_s'] = ijtima_utc.second
 
 	hdr['calc_yy1'] = ijtima_utc.year
-	hdr['calc_mm1'] = ijtima_utc.month 
-	hdr['calc_dd1'] = ijtima_utc.day 
-
-	hdr['calc_yy2'] = ijtima_utc.year
-	hdr['calc_mm2'] = ijtima_utc.month 
-	hdr['calc_dd2'] = ijtima_utc.day + 1
-
-	# get maps
-	map_moon_alt = np.zeros((nlat,nlong))
-	map_moon_arcv = np.zeros((nlat,nlong))
-	map_moon_elong = np.zeros((nlat,nlong))
-	map_moon_elong_geo = np.zeros((nlat,nlong))
-	map_moon_width = np.zeros((nlat,nlong))
-	map_moon_age_utc_seconds = np.zeros((nlat,nlong))
-	#count = 0
-	for yy in range(0,nlat-1):
-		for xx in range(0,nlong-1):
-			if grid_lat[yy]>=min_lat and grid_lat[yy]<=max_lat and grid_long[xx]>=min_long and grid_long[xx]<=max_long:
-				lat1 = 0.5*(grid_lat[yy] + grid_lat[yy+1])
-				long1 = 0.5*(grid_long[xx] + grid_long[xx+1])
-				location = sm.set_location(lat1, long1, 0)
-				sunrise, sunset = sm.sunrise_sunset_utc(location, year=ijtima_utc.year, month=ijtima_utc.month, day=ijtima_utc.day)
-				if sunset is None:
-					moon_alt, moon_arcv, moon_elong, moon_elong_geo, moon_width, moon_age_utc_seconds = float('nan'), float('nan'), float('nan'), float('nan'), float('nan'), float('nan')
-				else:
-					moon_alt, moon_az, dist = sm.moon_position_time_utc(location, utc_datetime=sunset)
-					sun_alt, sun_az, dist = sm.sun_position_time_utc(location, utc_datetime=sunset)
-					moon_arcv = moon_alt - sun_alt
-					moon_elong = sm.moon_elongation_time_utc(location=location, utc_datetime=sunset)
-					moon_elong_geo = sm.moon_elongation_time_utc(utc_datetime=sunset)
-					illumination, moon_width, parallax, SD = sm.moon_illumination_width_utc(location=location, utc_datetime=sunset) 
-					moon_age_utc_seconds = sm.calc_timedelta_seconds(ijtima_utc, sunset)
-
-				map_moon_alt[yy][xx] = moon_alt
-				map_moon_arcv[yy][xx] = moon_arcv
-				map_moon_elong[yy][xx] = moon_elong
-				map_moon_elong_geo[yy][xx] = moon_elong_geo
-				map_moon_width[yy][xx] = moon_width
-				map_moon_age_utc_seconds[yy][xx] = moon_age_utc_seconds
-			else:
-				map_moon_alt[yy][xx] = float('nan')
-				map_moon_arcv[yy][xx] = float('nan')
-				map_moon_elong[yy][xx] = float('nan')
-				map_moon_elong_geo[yy][xx] = float('nan')
-				map_moon_width[yy][xx] = float('nan')
-				map_moon_age_utc_seconds[yy][xx] = float('nan')
-
-			#count = count + 1
-			#sys.stdout.write('\r')
-			#sys.stdout.write('progress: month:%d --> %d of %d (%d%%)' % (mm+1,count,nlat*nlong,count*100/nlong/nlat))
-			#sys.stdout.flush()
-
-	map_moon_alt1 = np.zeros((nlat,nlong))
-	map_moon_arcv1 = np.zeros((nlat,nlong))
-	map_moon_elong1 = np.zeros((nlat,nlong))
-	map_moon_elong_geo1 = np.zeros((nlat,nlong))
-	map_moon_width1 = np.zeros((nlat,nlong))
-	map_moon_age_utc_seconds1 = np.zeros((nlat,nlong))
-	#count = 0
-	for yy in range(0,nlat-1):
-		for xx in range(0,nlong-1):
-			if grid_lat[yy]>=min_lat and grid_lat[yy]<=max_lat and grid_long[xx]>=min_long and grid_long[xx]<=max_long:
-				lat1 = 0.5*(grid_lat[yy] + grid_lat[yy+1])
-				long1 = 0.5*(grid_long[xx] + grid_long[xx+1])
-				location = sm.set_location(lat1, long1, 0)
-
-				ijtima_utc_plus1 = ijtima_utc + timedelta(days=1)
-				sunrise, sunset = sm.sunrise_sunset_utc(location, year=ijtima_utc_plus1.year, month=ijtima_utc_plus1.month, day=ijtima_utc_plus1.day)   ##############
-
-				if sunset is None:
-					moon_alt, moon_arcv, moon_elong, moon_elong_geo, moon_width, moon_age_utc_seconds = float('nan'), float('nan'), float('nan'), float('nan'), float('nan'), float('nan')
-				else:
-					moon_alt, moon_az, dist = sm.moon_position_time_utc(location, utc_datetime=sunset)
-					sun_alt, sun_az, dist = sm.sun_position_time_utc(location, utc_datetime=sunset)
-					moon_arcv = moon_alt - sun_alt
-					moon_elong = sm.moon_elongation_time_utc(location=location, utc_datetime=sunset)
-					moon_elong_geo = sm.moon_elongation_time_utc(utc_datetime=sunset)
-					illumination, moon_width, parallax, SD = sm.moon_illumination_width_utc(location=location, utc_datetime=sunset)
-					moon_age_utc_seconds = sm.calc_timedelta_seconds(ijtima_utc, sunset)
-
-				map_moon_alt1[yy][xx] = moon_alt
-				map_moon_arcv1[yy][xx] = moon_arcv
-				map_moon_elong1[yy][xx] = moon_elong
-				map_moon_elong_geo1[yy][xx] = moon_elong_geo
-				map_moon_width1[yy][xx] = moon_width
-				map_moon_age_utc_seconds1[yy][xx] = moon_age_utc_seconds
-			else:
-				map_moon_alt1[yy][xx] = float('nan')
-				map_moon_arcv1[yy][xx] = float('nan')
-				map_moon_elong1[yy][xx] = float('nan')
-				map_moon_elong_geo1[yy][xx] = float('nan')
-				map_moon_width1[yy][xx] = float('nan')
-				map_moon_age_utc_seconds1[yy][xx] = float('nan')
-
-			#count = count + 1
-			#sys.stdout.write('\r')
-			#sys.stdout.write('progress: month:%d --> %d of %d (%d%%)' % (mm+1,count,nlat*nlong,count*100/nlong/nlat))
-			#sys.stdout.flush()
-
-	# merge maps
-	merge_map = np.zeros((12,nlat,nlong))
-	merge_map[0] = map_moon_alt
-	merge_map[1] = map_moon_arcv
-	merge_map[2] = map_moon_elong
-	merge_map[3] = map_moon_elong_geo
-	merge_map[4] = map_moon_width
-	merge_map[5] = map_moon_age_utc_seconds
-
-	merge_map[6] = map_moon_alt1
-	merge_map[7] = map_moon_arcv1
-	merge_map[8] = map_moon_elong1
-	merge_map[9] = map_moon_elong_geo1
-	merge_map[10] = map_moon_width1
-	merge_map[11] = map_moon_age_utc_seconds1
-
-	hdul.append(fits.ImageHDU(data=merge_map, header=hdr, name=hijri_months[mm]))
-
-	# end of for mm: nmonths
-
-name_out_fits = '%d.fits' % hijri_year
-hdul.writeto(name_out_fits, overwrite=True)
+	hdr['calc_mm1'] = ijtima_utc.month
+	hdr['calc_dd1'] = ijtima_utc.day
 
+	hdr['calc_yy2'] = ijtima_utc_plus1.year
+	hdr['calc_mm2'] = ijtima_utc_plus1.month
+	hdr['calc_dd2'] = ijtima_utc_plus1.day
 
+	hdr['factor'] = factor
+	_grid_cards(hdr, factor)
+
+	# both days in one pass, the grid is split into row bands over the worker processes
+	cube = moon_property_cube(ijtima_utc.year, ijtima_utc.month, ijtima_utc.day, ijtima_utc=ijtima_utc, min_lat=MIN_LAT, max_lat=MAX_LAT,
+							min_long=MIN_LONG, max_long=MAX_LONG, factor=factor, workers=workers, ndays=2)
+	cube.materialize()
+	merge_map = np.stack([cube[name] for name in FITS_LAYERS])
+	cube.close()
+
+	return fits.ImageHDU(data=merge_map, header=hdr, name=hijri_months[month-1])
+
+
+def compress_hdu(hdu, compress='lossless', tile=TILE_CELLS, quantize_level=QUANTIZE_LEVEL):
+	""" The maps of a month (see month_hdu) as a tile compressed float32 image.
 
+	:param compress:
+		One of FITS_COMPRESSIONS, 'none' returns hdu as is.
+
+	:param tile:
+		Side of the square tiles in cells. A reader of a region only decompresses the tiles it covers.
+
+	:param quantize_level:
+		For 'quantized', the number of levels per standard deviation of the noise of a tile, larger keeps
+		more digits. The quantization is dithered, zeros and NaN (cells not computed) are kept exactly.
+	"""
+	from astropy.io import fits
 
+	if compress not in FITS_COMPRESSIONS:
+		raise ValueError("Unknown compression %r, available are %s" % (compress, ', '.join(FITS_COMPRESSIONS)))
+	if compress == 'none':
+		return hdu
+
+	data = hdu.data.astype(np.float32)
+	tile_shape = (1, min(tile, data.shape[1]), min(tile, data.shape[2]))
+	if compress == 'lossless':
+		# floats are only compressed without loss by GZIP, with quantize_level=0
+		return fits.CompImageHDU(data=data, header=hdu.header, name=hdu.name, compression_type='GZIP_2',
+								tile_shape=tile_shape, quantize_level=0.0)
+	# quantize_method=2 is SUBTRACTIVE_DITHER_2, which leaves the zeros unquantized
+	return fits.CompImageHDU(data=data, header=hdu.header, name=hdu.name, compression_type='RICE_1', tile_shape=tile_shape,
+							quantize_level=quantize_level, quantize_method=2, dither_seed=1)
+
+
+def _write_fits(hdul, path):
+	# written aside and renamed, so a file that exists is always complete
+	tmp_path = path + '.tmp'
+	hdul.writeto(tmp_path, overwrite=True)
+	os.replace(tmp_path, path)
+
+
+def _read_month(path, factor):
+	# the month of a checkpoint, None when there is none or it was computed with another factor
+	from astropy.io import fits
+
+	if not os.path.exists(path):
+		return None
+	with fits.open(path) as hdul:
+		if hdul[1].header.get('factor') != factor:
+			return None
+		return fits.ImageHDU(data=hdul[1].data.copy(), header=hdul[1].header.copy(), name=hdul[1].name)
+
+
+def calc_year_fits(hijri_year, out='.', factor=1.0, workers=1, keep_parts=False, overwrite=False, compress='none', tile=TILE_CELLS,
+				quantize_level=QUANTIZE_LEVEL):
+	""" Write <out>/<hijri_year>.fits with the maps of the 12 months of a Hijri year, one checkpoint per month.
+
+	:param compress:
+		One of FITS_COMPRESSIONS, see compress_hdu(). The checkpoints of the months are kept as computed,
+		so a year can be written again with another compression without computing it again.
+
+	:param keep_parts:
+		Keep the files of the months once the year is assembled.
+
+	:param overwrite:
+		Compute the year again even when its file exists. The checkpoints of the months are still used.
+
+	:returns:
+		Path of the FITS file.
+	"""
+	from astropy.io import fits
+
+	if compress not in FITS_COMPRESSIONS:
+		raise ValueError("Unknown compression %r, available are %s" % (compress, ', '.join(FITS_COMPRESSIONS)))
+
+	hijri_year = int(hijri_year)
+	name_out_fits = os.path.join(out, '%d.fits' % hijri_year)
+	if os.path.exists(name_out_fits) and not overwrite:
+		print ('# %s exists, skipped' % name_out_fits)
+		return name_out_fits
+
+	parts_dir = os.path.join(out, '%d_parts' % hijri_year)
+	os.makedirs(parts_dir, exist_ok=True)
+
+	hdus = []
+	for mm in range(1, NMONTHS+1):
+		path = os.path.join(parts_dir, '%02d.fits' % mm)
+		hdu = _read_month(path, factor)
+		if hdu is not None:
+			print ('# %d month %d: done before, skipped' % (hijri_year, mm))
+		else:
+			hdu = month_hdu(hijri_year, mm, factor=factor, workers=workers)
+			_write_fits(fits.HDUList([fits.PrimaryHDU(), hdu]), path)
+			print ('# %d month %d: written to %s' % (hijri_year, mm, path))
+		hdus.append(hdu)
+
+	hdus = [compress_hdu(hdu, compress=compress, tile=tile, quantize_level=quantize_level) for hdu in hdus]
+	hdr = primary_header(hijri_year, factor=factor, compress=compress, tile=tile, quantize_level=quantize_level)
+	_write_fits(fits.HDUList([fits.PrimaryHDU(header=hdr)] + hdus), name_out_fits)
+	print ('# %d: %s' % (hijri_year, name_out_fits))
+
+	if not keep_parts:
+		shutil.rmtree(parts_dir, ignore_errors=True)
+	return name_out_fits
+
+
+def read_region(path, month, min_lat=-90.0, max_lat=90.0, min_long=-180.0, max_long=180.0, layers=FITS_LAYERS):
+	""" Layers of a month of a year file, on the cells whose centre is inside a box of latitude and longitude.
+	Only the tiles covering the box are read and decompressed.
+
+	:param month:
+		Hijri month, 1 to 12.
+
+	:returns:
+		Dictionary of maps by layer name (see FITS_LAYERS), and the latitude and longitude of the rows and columns.
+	"""
+	from astropy.io import fits
+
+	with fits.open(path) as hdul:
+		hdr = hdul[month].header
+		lat = hdr['crval2'] + (np.arange(hdr['naxis2']) + 1 - hdr['crpix2'])*hdr['cdelt2']
+		lon = hdr['crval1'] + (np.arange(hdr['naxis1']) + 1 - hdr['crpix1'])*hdr['cdelt1']
+		rows = np.flatnonzero((lat >= min_lat) & (lat <= max_lat))
+		cols = np.flatnonzero((lon >= min_long) & (lon <= max_long))
+		if len(rows) == 0 or len(cols) == 0:
+			raise ValueError("No cell of %s has its centre in the box" % path)
+		rows, cols = slice(rows[0], rows[-1]+1), slice(cols[0], cols[-1]+1)
+
+		maps = {}
+		for name in layers:
+			maps[name] = np.asarray(hdul[month].section[FITS_LAYERS.index(name), rows, cols], dtype=float)
+	return maps, lat[rows], lon[cols]
+
+
+def _hijri_years(values):
+	# "1446" or a range "1446-1450"
+	years = []
+	for value in values:
+		first, sep, last = value.partition('-')
+		years += list(range(int(first), int(last)+1)) if sep else [int(first)]
+	return years
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Maps of the Moon at sunset of the day of ijtima and of the next day, for every month of Hijri years, one FITS file per year.")
+	parser.add_argument("--years", nargs="+", required=True, help="Hijri years, e.g. 1446 1447 or 1446-1450")
+	parser.add_argument("--factor", type=float, default=1.0, help="Cells per degree (default 1.0)")
+	parser.add_argument("--workers", type=int, default=1, help="Number of worker processes for the maps (default 1)")
+	parser.add_argument("--out", default=".", help="Folder of the FITS files (default: current folder)")
+	parser.add_argument("--keep-parts", action="store_true", help="Keep the file of every month once the year is written")
+	parser.add_argument("--overwrite", action="store_true", help="Compute the years whose FITS file already exists again")
+	parser.add_argument("--compress", choices=FITS_COMPRESSIONS, default='none',
+						help="Tile compressed float32 images, without loss or quantized (default none: float64 images)")
+	parser.add_argument("--tile", type=int, default=TILE_CELLS, help="Side of the compressed tiles in cells (default %d)" % TILE_CELLS)
+	parser.add_argument("--quantize-level", type=float, default=QUANTIZE_LEVEL,
+						help="Levels per noise standard deviation of a tile for --compress quantized (default %g)" % QUANTIZE_LEVEL)
+	args = parser.parse_args(argv)
+
+	os.makedirs(args.out, exist_ok=True)
+	for hijri_year in _hijri_years(args.years):
+		calc_year_fits(hijri_year, out=args.out, factor=args.factor, workers=args.workers, keep_parts=args.keep_parts, overwrite=args.overwrite,
+					compress=args.compress, tile=args.tile, quantize_level=args.quantize_level)
+
+
+# the guard keeps worker processes started with 'spawn' from re-running the script
+if __name__ == '__main__':
+	main()
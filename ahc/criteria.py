@@ -0,0 +1,134 @@
+import numpy as np
+import operator
+
+__all__ = ["VISIBILITY_RULES", "VISIBILITY_QUANTITIES", "visibility_criterion_layers", "evaluate_visibility_criteria", "visibility_margins"]
+
+
+def _odeh_V(width, arcv):
+	width1 = width*60.0
+	return arcv - (-0.1018*np.power(width1,3) + 0.7319*np.power(width1,2) - 6.3226*width1 + 7.1651)
+
+
+# Quantities of the rules that are not map layers: the map layers they are computed from and the function
+VISIBILITY_QUANTITIES = {'age_hours': (('age_utc',), lambda age_utc: age_utc/3600.0),
+						'V_odeh': (('width', 'arcv'), _odeh_V)}
+
+# Visibility criteria as data. The zones of a criterion are tried in order and a cell falls in the first zone
+# whose limits (quantity, comparison, threshold) are all met, otherwise in the default zone. Cells where the
+# 'valid' quantity is NaN (no sunset, or not computed) are NaN. The zone names label calc_visibility_margin().
+VISIBILITY_RULES = {
+	"MABIMS": {'zones': [('visible', 0, [('alt', '>', 3.0), ('elong_geo', '>', 6.4), ('age_hours', '>', 0.0)])],
+				'default': 1, 'valid': 'alt'},
+	"Odeh": {'zones': [('A', 1, [('V_odeh', '>=', 5.65)]), ('B', 2, [('V_odeh', '>=', 2.0)]), ('C', 3, [('V_odeh', '>=', -0.96)])],
+				'default': 4, 'valid': 'V_odeh'},
+	"Wujudul Hilal": {'zones': [('visible', 0, [('alt', '>=', -0.2575), ('age_hours', '>', 0.0)])],
+				'default': 1, 'valid': 'alt'},
+	"Turkey": {'zones': [('visible', 0, [('alt', '>', 5.0), ('elong', '>', 8.0), ('age_hours', '>', 0.0)])],
+				'default': 1, 'valid': 'alt'},
+	"Danjon": {'zones': [('visible', 0, [('alt', '>', 0.0), ('elong', '>', 7.0), ('age_hours', '>', 0.0)])],
+				'default': 1, 'valid': 'alt'},
+	"Ijtima Qobla Ghurub": {'zones': [('visible', 0, [('age_hours', '>', 0.0)])],
+				'default': 1, 'valid': 'age_utc'},
+}
+
+_COMPARISONS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+
+# Number of map rows evaluated together, small enough for the layers of a block to stay in the CPU cache
+CRITERIA_BLOCK_ROWS = 32
+
+
+def _rule(criterion):
+	if criterion not in VISIBILITY_RULES:
+		raise ValueError("Unknown visibility criterion %r, available criteria are %s" % (criterion, ', '.join(VISIBILITY_RULES)))
+	return VISIBILITY_RULES[criterion]
+
+
+def _quantities(criterion):
+	rule = _rule(criterion)
+	names = [rule['valid']] + [limit[0] for zone in rule['zones'] for limit in zone[2]]
+	return list(dict.fromkeys(names))
+
+
+def visibility_criterion_layers(criterion):
+	""" Map layers a criterion is computed from, e.g. ('alt', 'elong_geo', 'age_utc') for MABIMS. """
+	layers = []
+	for name in _quantities(criterion):
+		layers += VISIBILITY_QUANTITIES[name][0] if name in VISIBILITY_QUANTITIES else [name]
+	return tuple(dict.fromkeys(layers))
+
+
+def evaluate_visibility_criteria(map_moon_properties, criteria=None, suffix=''):
+	""" Zone maps of several visibility criteria in one pass over the map layers.
+
+	The rules of VISIBILITY_RULES are compiled together: every layer is read, every quantity computed and
+	every limit compared once for all criteria, block of rows by block of rows, e.g. the age limit is
+	shared by five criteria. A new criterion is a new entry of VISIBILITY_RULES (and of VISIBILITY_QUANTITIES
+	when it needs a derived quantity such as Yallop's q).
+
+	:param map_moon_properties:
+		Dictionary of map layers, see mapengine.calc_map_moon_properties(); suffix '1' takes the layers of the next day.
+
+	:param criteria:
+		Names of the criteria, all of VISIBILITY_RULES by default.
+
+	:returns:
+		Dictionary of zone maps by criterion, with the shape of the layers.
+	"""
+	criteria = list(VISIBILITY_RULES) if criteria is None else list(criteria)
+	rules = [_rule(criterion) for criterion in criteria]
+	quantities = list(dict.fromkeys(name for criterion in criteria for name in _quantities(criterion)))
+	layers = list(dict.fromkeys(layer for criterion in criteria for layer in visibility_criterion_layers(criterion)))
+	limits = list(dict.fromkeys(limit for rule in rules for zone in rule['zones'] for limit in zone[2]))
+
+	shape = np.shape(map_moon_properties[layers[0]+suffix])
+	maps = {}
+	for criterion in criteria:
+		maps[criterion] = np.zeros(shape)
+
+	for row in range(0, shape[0], CRITERIA_BLOCK_ROWS):
+		rows = slice(row, row+CRITERIA_BLOCK_ROWS)
+		values = {}
+		for name in layers:
+			values[name] = np.asarray(map_moon_properties[name+suffix][rows], dtype=float)
+		for name in quantities:
+			if name in VISIBILITY_QUANTITIES:
+				args, function = VISIBILITY_QUANTITIES[name]
+				values[name] = function(*[values[arg] for arg in args])
+		met = {}
+		for limit in limits:
+			met[limit] = _COMPARISONS[limit[1]](values[limit[0]], limit[2])
+
+		for criterion, rule in zip(criteria, rules):
+			conditions = [np.logical_and.reduce([met[limit] for limit in zone[2]]) for zone in rule['zones']]
+			zones = np.select(conditions, [zone[1] for zone in rule['zones']], default=rule['default']).astype(float)
+			zones[np.isnan(values[rule['valid']])] = float('nan')
+			maps[criterion][rows] = zones
+
+	return maps
+
+
+def visibility_margins(criterion, map_moon_properties, suffix=''):
+	""" How far every cell is past the limits of each zone of a criterion: the smallest of (quantity - threshold)
+	over the limits of the zone, with the sign reversed for '<' limits. It is positive inside the zone and
+	crosses zero on its boundary.
+
+	:returns:
+		Dictionary of margins by zone name, for every zone but the default one.
+	"""
+	rule = _rule(criterion)
+	values = {}
+	for name in _quantities(criterion):
+		if name in VISIBILITY_QUANTITIES:
+			args, function = VISIBILITY_QUANTITIES[name]
+			values[name] = function(*[np.asarray(map_moon_properties[arg+suffix], dtype=float) for arg in args])
+		else:
+			values[name] = np.asarray(map_moon_properties[name+suffix], dtype=float)
+
+	margins = {}
+	for name, value, limits in rule['zones']:
+		margin = None
+		for quantity, comparison, threshold in limits:
+			distance = values[quantity] - threshold if comparison in ('>', '>=') else threshold - values[quantity]
+			margin = distance if margin is None else np.minimum(margin, distance)
+		margins[name] = margin
+	return margins
@@ -0,0 +1,142 @@
+import os
+from skyfield import api
+
+__all__ = ["database_path", "latest_bsp", "get_timescale", "get_ephemeris", "ephemeris_name", "preload", "kernel_version",
+			"reduced_kernel_name", "build_reduced_kernel"]
+
+# the database folder sits next to the ahc package, whatever the current working directory is
+DATABASE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'database')
+
+global _timescale, _ephemeris, _ephemeris_name
+_timescale = None
+_ephemeris = None
+_ephemeris_name = None
+
+
+def database_path(*names):
+	return os.path.join(DATABASE_DIR, *names)
+
+
+# A reduced kernel holds only the segments of the Sun, the Earth-Moon barycentre, the Earth and the Moon
+# over a span of years, see build_reduced_kernel(). It is named after its source, e.g. de440_reduced.bsp.
+# The Jupiter and Saturn barycentres are kept too: skyfield's apparent() needs them for light deflection.
+REDUCED_SUFFIX = '_reduced'
+REDUCED_TARGETS = (10, 3, 399, 301, 5, 6)
+REDUCED_YEARS = (1800, 2300)
+
+
+def kernel_version(name):
+	""" Version of a kernel file name, e.g. 'de440', the same for a full kernel and its reduced copy. """
+	base = name[:-len('.bsp')]
+	return base[:-len(REDUCED_SUFFIX)] if base.endswith(REDUCED_SUFFIX) else base
+
+
+def reduced_kernel_name(name):
+	return kernel_version(name) + REDUCED_SUFFIX + '.bsp'
+
+
+def latest_bsp(reduced=True):
+	""" Newest .bsp file of the database folder. Its reduced copy is preferred when there is one, unless reduced is False. """
+	bsp_files = [f for f in os.listdir(DATABASE_DIR) if f.endswith('.bsp')] if os.path.isdir(DATABASE_DIR) else []
+	if not reduced:
+		bsp_files = [f for f in bsp_files if not f.endswith(REDUCED_SUFFIX + '.bsp')]
+	if not bsp_files:
+		return 'de421.bsp'  # Fallback to de421.bsp if none found
+	# newest version first, and for the same version the reduced copy
+	return max(bsp_files, key=lambda f: (kernel_version(f), f.endswith(REDUCED_SUFFIX + '.bsp')))
+
+
+def build_reduced_kernel(name=None, start_year=REDUCED_YEARS[0], end_year=REDUCED_YEARS[1]):
+	""" Write the reduced copy of a full kernel (the newest one by default) next to it, see REDUCED_SUFFIX.
+
+	Only the segments of REDUCED_TARGETS are kept, cut to the years start_year to end_year (clipped to
+	what the kernel covers). For DE440 this is a few tens of MB instead of more than 100 MB. get_ephemeris()
+	picks it up from then on, so times outside of the years fail until the reduced kernel is deleted.
+	The years have to include the new moon of the reference Hijri month (sunmoon.REF_HIJRI_DATE), from
+	which every Hijri month is counted.
+
+	:returns:
+		Path of the reduced kernel.
+	"""
+	from jplephem.spk import SPK
+	from jplephem.excerpter import write_excerpt
+	from .sunmoon import REF_HIJRI_DATE
+
+	if not start_year <= REF_HIJRI_DATE[0] <= end_year:
+		raise ValueError("The years %d to %d of a reduced kernel must include %d, the year of the reference Hijri month"
+						% (start_year, end_year, REF_HIJRI_DATE[0]))
+
+	if name is None:
+		name = latest_bsp(reduced=False)
+	path = database_path(reduced_kernel_name(name))
+
+	spk = SPK.open(database_path(name))
+	try:
+		summaries = [(summary_name, values) for summary_name, values in spk.daf.summaries() if int(values[2]) in REDUCED_TARGETS]
+		segments = [segment for segment in spk.segments if segment.target in REDUCED_TARGETS]
+		if set(segment.target for segment in segments) != set(REDUCED_TARGETS):
+			raise ValueError("%s does not hold every segment of REDUCED_TARGETS" % name)
+
+		# Julian dates of 1 January of the first year and 31 December of the last one, inside the span covered by
+		# every target (DE441 splits each target in two segments)
+		start_jd = max(min(segment.start_jd for segment in segments if segment.target == target) for target in REDUCED_TARGETS)
+		end_jd = min(max(segment.end_jd for segment in segments if segment.target == target) for target in REDUCED_TARGETS)
+		start_jd = max(start_jd, get_timescale().utc(start_year, 1, 1).tt)
+		end_jd = min(end_jd, get_timescale().utc(end_year, 12, 31).tt)
+
+		path_tmp = path + '.tmp'
+		with open(path_tmp, 'w+b') as f:
+			write_excerpt(spk, f, start_jd, end_jd, summaries)
+		os.replace(path_tmp, path)
+	finally:
+		spk.close()
+
+	return path
+
+
+def get_timescale():
+	""" Process-wide skyfield Timescale, created on first use. """
+	global _timescale
+	if _timescale is None:
+		_timescale = api.load.timescale()
+	return _timescale
+
+
+def get_ephemeris():
+	""" Process-wide SpiceKernel of the newest .bsp file in the database folder, opened on first use. """
+	global _ephemeris, _ephemeris_name
+	if _ephemeris is None:
+		name = latest_bsp()
+		_ephemeris = api.load_file(database_path(name))
+		_ephemeris_name = name
+	return _ephemeris
+
+
+def ephemeris_name():
+	""" File name of the kernel handed out by get_ephemeris(). """
+	get_ephemeris()
+	return _ephemeris_name
+
+
+def preload():
+	""" Open the timescale and the kernel now instead of on first use, e.g. when a server or a worker process starts. """
+	return get_timescale(), get_ephemeris()
+
+
+class _lazy:
+	# stands in for the shared object at module level and only loads it when it is first used
+	def __init__(self, factory):
+		self._factory = factory
+
+	def __getattr__(self, name):
+		return getattr(self._factory(), name)
+
+	def __getitem__(self, key):
+		return self._factory()[key]
+
+	def __repr__(self):
+		return repr(self._factory())
+
+
+ts = _lazy(get_timescale)
+ephem = _lazy(get_ephemeris)
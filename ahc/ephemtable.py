@@ -0,0 +1,133 @@
+import numpy as np
+from skyfield.toposlib import iers2010
+from skyfield.nutationlib import iau2000b_radians
+
+__all__ = ["sun_moon_table", "angle_between_degrees", "horizon_coordinates"]
+
+# Ephemeris data is shared by the whole package and loaded on first use
+from .ephemeris import ts, ephem
+
+# Sampling interval of the table. With 4-point Lagrange interpolation the interpolation error of the
+# geocentric Moon at this step is below a millimetre, so the error budget is set by the approximations
+# documented in sun_moon_table.
+TABLE_STEP_HOURS = 1.0
+
+# Largest difference in altitude, azimuth and elongation between the table and the direct kernel path
+# (Sun and Moon, any site, checked with sun_moon_table.check()); see sun_moon_table for where it comes from.
+TABLE_ERROR_BOUND_ARCSEC = 1.0
+
+
+def _lagrange4(values, x):
+	# cubic Lagrange interpolation on the unit spaced samples values[0..n-1] at the fractional indices x
+	i = np.clip(np.floor(x).astype(int) - 1, 0, len(values) - 4)
+	u = x - (i + 1)
+	w0 = -u*(u - 1.0)*(u - 2.0)/6.0
+	w1 = (u + 1.0)*(u - 1.0)*(u - 2.0)/2.0
+	w2 = -(u + 1.0)*u*(u - 2.0)/2.0
+	w3 = (u + 1.0)*u*(u - 1.0)/6.0
+	shape = (-1,) + (1,)*(values.ndim - 1)
+	return (w0.reshape(shape)*values[i] + w1.reshape(shape)*values[i+1] + w2.reshape(shape)*values[i+2] + w3.reshape(shape)*values[i+3])
+
+
+def angle_between_degrees(a, b):
+	""" Angle between the rows of two arrays of vectors, with the same formula as skyfield's separation_from(). """
+	a = a/np.linalg.norm(a, axis=-1, keepdims=True)
+	b = b/np.linalg.norm(b, axis=-1, keepdims=True)
+	return np.degrees(2.0*np.arctan2(np.linalg.norm(a - b, axis=-1), np.linalg.norm(a + b, axis=-1)))
+
+
+class sun_moon_table:
+	""" Geocentric apparent Sun and Moon and the Earth orientation sampled over a TT window.
+
+	The kernel is evaluated only at the samples, every TABLE_STEP_HOURS. Any instant of the window is then
+	interpolated with 4-point Lagrange polynomials, and the position seen from a site is the geocentric
+	apparent position minus the site vector, rotated to the horizon with the interpolated precession-
+	nutation matrix and sidereal time. Everything is plain NumPy over arrays of instants and sites.
+
+	Compared with observing from the site directly this leaves out the diurnal aberration (at most
+	0.32 arcsec) and the difference in light time and deflection between the geocentre and the site
+	(a few hundredths of an arcsecond for the Moon), and uses the IAU 2000B nutation of the risings and
+	settings search. The resulting error is below TABLE_ERROR_BOUND_ARCSEC.
+	"""
+
+	def __init__(self, jd_start, jd_end, step_hours=TABLE_STEP_HOURS):
+		self.step = step_hours/24.0
+		# two extra samples on each side so that the 4-point stencil is centred everywhere in the window
+		n = int(np.ceil((jd_end - jd_start)/self.step)) + 1
+		self.jd = jd_start + self.step*np.arange(-2, n + 2)
+		self.jd_start, self.jd_end = jd_start, jd_end
+
+		t = ts.tt_jd(self.jd)
+		t._nutation_angles_radians = iau2000b_radians(t)
+		geocenter = ephem['Earth'].at(t)
+		self.sun = geocenter.observe(ephem['Sun']).apparent().position.km.T
+		self.moon = geocenter.observe(ephem['Moon']).apparent().position.km.T
+		self.M = np.moveaxis(t.M, -1, 0)
+		# sidereal time unwrapped in radians, so that it can be interpolated as a smooth function
+		self.gast = np.unwrap(t.gast*np.pi/12.0)
+
+	def _index(self, jd):
+		jd = np.asarray(jd, dtype=float)
+		if jd.size and (np.nanmin(jd) < self.jd_start or np.nanmax(jd) > self.jd_end):
+			raise ValueError("Instants outside of the table window [%.6f, %.6f]" % (self.jd_start, self.jd_end))
+		return (jd - self.jd[0])/self.step
+
+	def geocentric(self, body, jd):
+		""" Geocentric apparent GCRS position in km of 'Sun' or 'Moon' at the TT Julian dates jd, shape (n,3). """
+		values = self.sun if body == 'Sun' else self.moon
+		return _lagrange4(values, self._index(np.ravel(jd)))
+
+	def earth_rotation(self, jd):
+		""" Precession-nutation matrices (n,3,3) and Greenwich apparent sidereal time in radians (n) at jd. """
+		x = self._index(np.ravel(jd))
+		return _lagrange4(self.M, x), _lagrange4(self.gast, x)
+
+	def topocentric(self, body, jd, site_itrs_km, rotation=None):
+		""" Position of the body in km from sites given by their ITRS vectors (n,3), in the terrestrial frame (n,3). """
+		M, gast = self.earth_rotation(jd) if rotation is None else rotation
+		tod = np.einsum('nij,nj->ni', M, self.geocentric(body, jd))
+		c, s = np.cos(gast), np.sin(gast)
+		# from the true equator and equinox of date to the terrestrial frame, a rotation by -gast around z
+		return np.stack([c*tod[:,0] + s*tod[:,1], -s*tod[:,0] + c*tod[:,1], tod[:,2]], axis=1) - site_itrs_km
+
+	def altaz(self, body, jd, lat, lon, elevation=0.0, rotation=None):
+		""" Altitude without refraction and azimuth in degree, distance in km and terrestrial vectors of the body from the sites. """
+		lat, lon = np.ravel(lat), np.ravel(lon)
+		site = np.atleast_2d(iers2010.latlon(lat, lon, elevation_m=elevation).itrs_xyz.km.T)
+		v = self.topocentric(body, jd, site, rotation=rotation)
+		alt, az, distance = horizon_coordinates(v, lat, lon)
+		return alt, az, distance, v
+
+	def check(self, lat, lon, elevation=0.0, samples=200):
+		""" Largest differences in arcsec of altitude, azimuth and elongation from the kernel, at random instants and sites among lat, lon. """
+		rng = np.random.default_rng(0)
+		jd = rng.uniform(self.jd_start, self.jd_end, samples)
+		idx = rng.integers(0, len(np.ravel(lat)), samples)
+		lat, lon = np.ravel(lat)[idx], np.ravel(lon)[idx]
+
+		t = ts.tt_jd(jd)
+		t._nutation_angles_radians = iau2000b_radians(t)
+		observer = (ephem['Earth'] + iers2010.latlon(lat, lon, elevation)).at(t)
+
+		errors = {}
+		direct, table = {}, {}
+		for body in ('Sun', 'Moon'):
+			direct[body] = observer.observe(ephem[body]).apparent()
+			alt, az, distance = direct[body].altaz()
+			alt1, az1, distance1, table[body] = self.altaz(body, jd, lat, lon, elevation)
+			errors[body+' altitude'] = np.max(np.abs(alt1 - alt.degrees))*3600.0
+			errors[body+' azimuth'] = np.max(np.abs(((az1 - az.degrees + 180.0) % 360.0 - 180.0)*np.cos(alt.radians)))*3600.0
+		elong = direct['Sun'].separation_from(direct['Moon']).degrees
+		errors['elongation'] = np.max(np.abs(angle_between_degrees(table['Sun'], table['Moon']) - elong))*3600.0
+		return errors
+
+
+def horizon_coordinates(v, lat, lon):
+	""" Altitude and azimuth in degree and length of terrestrial vectors v (n,3) at geodetic lat, lon (degree). """
+	phi, lam = np.radians(lat), np.radians(lon)
+	up = v[:,0]*np.cos(phi)*np.cos(lam) + v[:,1]*np.cos(phi)*np.sin(lam) + v[:,2]*np.sin(phi)
+	north = -v[:,0]*np.sin(phi)*np.cos(lam) - v[:,1]*np.sin(phi)*np.sin(lam) + v[:,2]*np.cos(phi)
+	east = -v[:,0]*np.sin(lam) + v[:,1]*np.cos(lam)
+	alt = np.degrees(np.arctan2(up, np.hypot(north, east)))
+	az = np.degrees(np.arctan2(east, north)) % 360.0
+	return alt, az, np.sqrt(up**2 + north**2 + east**2)
@@ -0,0 +1,234 @@
+import numpy as np
+
+from .ephemtable import sun_moon_table, TABLE_STEP_HOURS
+
+__all__ = ["fast_sun_moon", "precision_engine", "PRECISIONS", "sun_apparent_ecliptic", "moon_apparent_ecliptic", "fast_precision_report", "print_fast_precision_report"]
+
+# Ephemeris data is shared by the whole package and loaded on first use
+from .ephemeris import ts
+
+# "kernel" evaluates the JPL kernel, "fast" the truncated analytic series of fast_sun_moon
+PRECISIONS = ("kernel", "fast")
+
+AU_KM = 149597870.7
+ARCSEC = 1.0/3600.0
+
+# Periodic terms of the Moon, largest terms of Meeus, Astronomical Algorithms, tables 47.A and 47.B:
+# multiples of D, M, M', F and the coefficients of longitude (1e-6 deg), distance (1e-3 km) / latitude (1e-6 deg)
+MOON_LR_TERMS = np.array([
+	(0, 0, 1, 0, 6288774, -20905355), (2, 0, -1, 0, 1274027, -3699111), (2, 0, 0, 0, 658314, -2955968),
+	(0, 0, 2, 0, 213618, -569925), (0, 1, 0, 0, -185116, 48888), (0, 0, 0, 2, -114332, -3149),
+	(2, 0, -2, 0, 58793, 246158), (2, -1, -1, 0, 57066, -152138), (2, 0, 1, 0, 53322, -170733),
+	(2, -1, 0, 0, 45758, -204586), (0, 1, -1, 0, -40923, -129620), (1, 0, 0, 0, -34720, 108743),
+	(0, 1, 1, 0, -30383, 104755), (2, 0, 0, -2, 15327, 10321), (0, 0, 1, 2, -12528, 0),
+	(0, 0, 1, -2, 10980, 79661), (4, 0, -1, 0, 10675, -34782), (0, 0, 3, 0, 10034, -23210),
+	(4, 0, -2, 0, 8548, -21636), (2, 1, -1, 0, -7888, 24208), (2, 1, 0, 0, -6766, 30824),
+	(1, 0, -1, 0, -5163, -8379), (1, 1, 0, 0, 4987, -16675), (2, -1, 1, 0, 4036, -12831),
+	(2, 0, 2, 0, 3994, -10445), (4, 0, 0, 0, 3861, -11650), (2, 0, -3, 0, 3665, 14403),
+	(0, 1, -2, 0, -2689, -7003), (2, 0, -1, 2, -2602, 0), (2, -1, -2, 0, 2390, 10056),
+	(1, 0, 1, 0, -2348, 6322), (2, -2, 0, 0, 2236, -9884), (0, 1, 2, 0, -2120, 5751),
+	(0, 2, 0, 0, -2069, 0), (2, -2, -1, 0, 2048, -4950), (2, 0, 1, -2, -1773, 4130),
+	(2, 0, 0, 2, -1595, 0), (4, -1, -1, 0, 1215, -3958), (0, 0, 2, 2, -1110, 0),
+	(3, 0, -1, 0, -892, 3258), (2, 1, 1, 0, -810, 2616), (4, -1, -2, 0, 759, -1897),
+	(0, 2, -1, 0, -713, -2117), (2, 2, -1, 0, -700, 2354), (2, 1, -2, 0, 691, 0),
+	(2, -1, 0, -2, 596, 0), (4, 0, 1, 0, 549, -1423), (0, 0, 4, 0, 537, -1117),
+	(4, -1, 0, 0, 520, -1571), (1, 0, -2, 0, -487, -1739), (2, 1, 0, -2, -399, 0),
+	(0, 0, 2, -2, -381, -4421), (2, 0, -1, -2, 0, 8752),
+], dtype=float)
+
+MOON_B_TERMS = np.array([
+	(0, 0, 0, 1, 5128122), (0, 0, 1, 1, 280602), (0, 0, 1, -1, 277693), (2, 0, 0, -1, 173237),
+	(2, 0, -1, 1, 55413), (2, 0, -1, -1, 46271), (2, 0, 0, 1, 32573), (0, 0, 2, 1, 17198),
+	(2, 0, 1, -1, 9266), (0, 0, 2, -1, 8822), (2, -1, 0, -1, 8216), (2, 0, -2, -1, 4324),
+	(2, 0, 1, 1, 4200), (2, 1, 0, -1, -3359), (2, -1, -1, 1, 2463), (2, -1, 0, 1, 2211),
+	(2, -1, -1, -1, 2065), (0, 1, -1, -1, -1870), (4, 0, -1, -1, 1828), (0, 1, 0, 1, -1794),
+	(0, 0, 0, 3, -1749), (0, 1, -1, 1, -1565), (1, 0, 0, 1, -1491), (0, 1, 1, 1, -1475),
+	(0, 1, 1, -1, -1410), (0, 1, 0, -1, -1344), (1, 0, 0, -1, -1335), (0, 0, 3, 1, 1107),
+	(4, 0, 0, -1, 1021), (4, 0, -1, 1, 833),
+], dtype=float)
+
+
+def _centuries(jd_tt):
+	return (np.asarray(jd_tt, dtype=float) - 2451545.0)/36525.0
+
+
+def _nutation(T):
+	# low precision nutation and true obliquity (Meeus chapter 22), in degree
+	omega = np.radians(125.04452 - 1934.136261*T)
+	L = np.radians(280.4665 + 36000.7698*T)
+	Lm = np.radians(218.3165 + 481267.8813*T)
+	dpsi = (-17.20*np.sin(omega) - 1.32*np.sin(2*L) - 0.23*np.sin(2*Lm) + 0.21*np.sin(2*omega))*ARCSEC
+	deps = (9.20*np.cos(omega) + 0.57*np.cos(2*L) + 0.10*np.cos(2*Lm) - 0.09*np.cos(2*omega))*ARCSEC
+	eps0 = 23.0 + 26.0/60.0 + (21.448 - 46.8150*T - 0.00059*T**2 + 0.001813*T**3)/3600.0
+	return dpsi, eps0 + deps
+
+
+def _ecliptic_to_equatorial(longitude, latitude, distance, eps):
+	# rectangular equatorial coordinates of date from ecliptic longitude, latitude (degree) and distance
+	lam, beta, eps = np.radians(longitude), np.radians(latitude), np.radians(eps)
+	x = np.cos(beta)*np.cos(lam)
+	y = np.cos(beta)*np.sin(lam)
+	z = np.sin(beta)
+	return distance[:,None]*np.stack([x, y*np.cos(eps) - z*np.sin(eps), y*np.sin(eps) + z*np.cos(eps)], axis=1)
+
+
+def sun_apparent_ecliptic(jd_tt):
+	""" Apparent geocentric ecliptic longitude, latitude (degree) and distance (km) of the Sun, Meeus chapter 25. """
+	T = _centuries(jd_tt)
+	L0 = 280.46646 + 36000.76983*T + 0.0003032*T**2
+	M = np.radians(357.52911 + 35999.05029*T - 0.0001537*T**2)
+	e = 0.016708634 - 0.000042037*T - 0.0000001267*T**2
+	C = (1.914602 - 0.004817*T - 0.000014*T**2)*np.sin(M) + (0.019993 - 0.000101*T)*np.sin(2*M) + 0.000289*np.sin(3*M)
+	R = 1.000001018*(1 - e**2)/(1 + e*np.cos(M + np.radians(C)))
+	dpsi, eps = _nutation(T)
+	# nutation and annual aberration
+	longitude = L0 + C + dpsi - 20.4898*ARCSEC/R
+	return longitude, np.zeros_like(longitude), R*AU_KM
+
+
+def moon_apparent_ecliptic(jd_tt):
+	""" Apparent geocentric ecliptic longitude, latitude (degree) and distance (km) of the Moon, truncated Meeus chapter 47. """
+	T = _centuries(jd_tt)
+	Lm = 218.3164477 + 481267.88123421*T - 0.0015786*T**2 + T**3/538841.0 - T**4/65194000.0
+	D = 297.8501921 + 445267.1114034*T - 0.0018819*T**2 + T**3/545868.0 - T**4/113065000.0
+	M = 357.5291092 + 35999.0502909*T - 0.0001536*T**2 + T**3/24490000.0
+	Mm = 134.9633964 + 477198.8675055*T + 0.0087414*T**2 + T**3/69699.0 - T**4/14712000.0
+	F = 93.2720950 + 483202.0175233*T - 0.0036539*T**2 - T**3/3526000.0 + T**4/863310000.0
+	A1 = np.radians(119.75 + 131.849*T)
+	A2 = np.radians(53.09 + 479264.290*T)
+	A3 = np.radians(313.45 + 481266.484*T)
+	E = 1 - 0.002516*T - 0.0000074*T**2
+
+	arguments = np.radians(np.stack([D, M, Mm, F], axis=-1))
+	lr = MOON_LR_TERMS
+	angle = arguments @ lr[:,:4].T
+	eccentricity = E[...,None]**np.abs(lr[:,1])
+	sum_l = (eccentricity*lr[:,4]*np.sin(angle)).sum(axis=-1)
+	sum_r = (eccentricity*lr[:,5]*np.cos(angle)).sum(axis=-1)
+	b = MOON_B_TERMS
+	angle = arguments @ b[:,:4].T
+	sum_b = (E[...,None]**np.abs(b[:,1])*b[:,4]*np.sin(angle)).sum(axis=-1)
+
+	Lm_rad, Mm_rad, F_rad = np.radians(Lm), np.radians(Mm), np.radians(F)
+	sum_l += 3958*np.sin(A1) + 1962*np.sin(Lm_rad - F_rad) + 318*np.sin(A2)
+	sum_b += (-2235*np.sin(Lm_rad) + 382*np.sin(A3) + 175*np.sin(A1 - F_rad) + 175*np.sin(A1 + F_rad)
+				+ 127*np.sin(Lm_rad - Mm_rad) - 115*np.sin(Lm_rad + Mm_rad))
+
+	dpsi, eps = _nutation(T)
+	return Lm + sum_l/1e6 + dpsi, sum_b/1e6, 385000.56 + sum_r/1000.0
+
+
+class fast_sun_moon(sun_moon_table):
+	""" Low precision Sun and Moon from truncated analytic series, a drop-in for sun_moon_table.
+
+	The Sun follows Meeus chapter 25 and the Moon the largest terms of chapter 47, with low precision
+	nutation; positions are given in the true equator and equinox of date, so the precession-nutation
+	matrix is the identity. Everything is NumPy over arrays of instants and no kernel is read (only the
+	timescale, for UT1). Typical errors are a few tens of arcseconds, see fast_precision_report().
+
+	Without a window the series are evaluated at every instant asked for. With a window they are sampled
+	like the kernel in sun_moon_table and interpolated, which is cheaper for the many cells of a map.
+	"""
+
+	def __init__(self, jd_start=None, jd_end=None, step_hours=TABLE_STEP_HOURS):
+		self.sampled = jd_start is not None
+		if not self.sampled:
+			self.jd_start, self.jd_end = -np.inf, np.inf
+			return
+
+		self.step = step_hours/24.0
+		n = int(np.ceil((jd_end - jd_start)/self.step)) + 1
+		self.jd = jd_start + self.step*np.arange(-2, n + 2)
+		self.jd_start, self.jd_end = jd_start, jd_end
+		self.sun = self._series('Sun', self.jd)
+		self.moon = self._series('Moon', self.jd)
+		self.M, gast = self._rotation(self.jd)
+		self.gast = np.unwrap(gast)
+
+	def _series(self, body, jd):
+		longitude, latitude, distance = sun_apparent_ecliptic(jd) if body == 'Sun' else moon_apparent_ecliptic(jd)
+		dpsi, eps = _nutation(_centuries(jd))
+		return _ecliptic_to_equatorial(longitude, latitude, distance, eps)
+
+	def _rotation(self, jd):
+		T = _centuries(jd)
+		jd_ut1 = ts.tt_jd(jd).ut1
+		# mean sidereal time (Meeus 12.4) plus the equation of the equinoxes
+		gmst = 280.46061837 + 360.98564736629*(jd_ut1 - 2451545.0) + 0.000387933*T**2 - T**3/38710000.0
+		dpsi, eps = _nutation(T)
+		gast = np.radians(gmst + dpsi*np.cos(np.radians(eps)))
+		return np.broadcast_to(np.identity(3), (len(jd), 3, 3)), gast
+
+	def geocentric(self, body, jd):
+		if self.sampled:
+			return sun_moon_table.geocentric(self, body, jd)
+		return self._series(body, np.ravel(np.asarray(jd, dtype=float)))
+
+	def earth_rotation(self, jd):
+		if self.sampled:
+			return sun_moon_table.earth_rotation(self, jd)
+		return self._rotation(np.ravel(np.asarray(jd, dtype=float)))
+
+
+def precision_engine(precision="kernel", jd_start=None, jd_end=None):
+	""" Source of the Sun and the Moon for a precision: None for "kernel" (the kernel is observed directly), a
+	fast_sun_moon for "fast", sampled over [jd_start, jd_end] when they are given. """
+	if precision not in PRECISIONS:
+		raise ValueError("Unknown precision '%s', use one of %s" % (precision, ', '.join(PRECISIONS)))
+	return fast_sun_moon(jd_start, jd_end) if precision == "fast" else None
+
+
+def fast_precision_report(year=2025, months=12, sites=200):
+	""" Largest differences between the "fast" and the "kernel" precision.
+
+	Positions are compared at random instants of the first two days of every month and random sites between
+	-60 and 70 degree of latitude, through the sampled engine the maps use. Event times are compared on the
+	first day of every month: sunsets of the map sites (sunset_map_utc) and prayer times of ten of them
+	(prayer_times_tt).
+
+	:returns:
+		Dictionary of maximum errors: arcsec for altitude, azimuth and elongation, seconds for event times.
+	"""
+	from .mapengine import sunset_map_utc, map_table
+	from .prayertimes import prayer_times_tt, prayer_names
+	from .sunmoon import get_observer
+
+	rng = np.random.default_rng(1)
+	lat, lon = rng.uniform(-60, 70, sites), rng.uniform(-180, 180, sites)
+
+	report = {}
+	for month in range(1, months + 1):
+		table = map_table(year, month, 1, precision="fast")
+		for name, error in table.check(lat, lon, samples=sites).items():
+			report[name] = max(report.get(name, 0.0), error)
+
+		kernel = sunset_map_utc(lat, lon, year, month, 1)
+		fast = sunset_map_utc(lat, lon, year, month, 1, table=table)
+		both = np.isfinite(kernel) & np.isfinite(fast)
+		report['sunset (s)'] = max(report.get('sunset (s)', 0.0), np.max(np.abs(kernel[both] - fast[both]))*86400.0)
+
+		for ii in range(0, sites, sites//10):
+			location = get_observer(float(lat[ii]), float(lon[ii]), 0.0)
+			jd_noon = ts.utc(year, month, 1, 12).tt - lon[ii]/360.0
+			kernel = prayer_times_tt(location, jd_noon)
+			fast = prayer_times_tt(location, jd_noon, precision="fast")
+			for name in prayer_names():
+				both = np.isfinite(kernel[name]) & np.isfinite(fast[name])
+				if both.any():
+					error = np.max(np.abs(kernel[name][both] - fast[name][both]))*86400.0
+					report[name+' (s)'] = max(report.get(name+' (s)', 0.0), error)
+
+	return report
+
+
+def print_fast_precision_report(year=2025, months=12, sites=200):
+	report = fast_precision_report(year=year, months=months, sites=sites)
+	print('Largest differences of precision="fast" from the kernel in %d' % year)
+	for name, error in report.items():
+		unit = '' if name.endswith('(s)') else ' arcsec'
+		print('  %-22s %10.2f%s' % (name, error, unit))
+	return report
+
+
+if __name__ == '__main__':
+	print_fast_precision_report()
@@ -4,16 +4,25 @@ from skyfield import almanac
 from datetime import datetime
 from datetime import timedelta
 from calendar import monthrange
+from functools import cached_property
 from skyfield.units import Angle
 
-ts = api.load.timescale()
+from .ephemeris import ts
 
 from .sunmoon import *
 from .crescent import *
 from .plotting import *
+from .mapengine import map_table, sunset_map_utc, moon_properties_map_utc, moon_property_cube, refine_map, trace_curves, curves_geojson
+from .criteria import VISIBILITY_RULES, visibility_criterion_layers, evaluate_visibility_criteria, visibility_margins
+from .packedmaps import pack_visibility_maps, packed_layout
 
 __all__ = ["hilal", "list_hilal_visibility_criteria", "calc_map_odeh", "calc_map_mabims", "calc_map_wujudul_hilal", 
-			"calc_map_turkey", "calc_map_danjon", "calc_map_IQG"]
+			"calc_map_turkey", "calc_map_danjon", "calc_map_IQG", "calc_map_visibility", "calc_maps_visibility", "calc_refined_visibility_map",
+			"calc_visibility_margin", "calc_visibility_curves", "visibility_curves_geojson"]
+
+
+# Map layers every criterion is computed from, see criteria.VISIBILITY_RULES
+VISIBILITY_CRITERIA_LAYERS = {criterion: visibility_criterion_layers(criterion) for criterion in VISIBILITY_RULES}
 
 
 def list_hilal_visibility_criteria(print_list=False):
@@ -25,67 +34,23 @@ def list_hilal_visibility_criteria(print_list=False):
 	return hilal_criteria
 
 
-def calc_map_odeh(map_moon_width, map_moon_arcv):
-	map_moon_width1 = map_moon_width*60.0
-	map_V_odeh = map_moon_arcv - (-0.1018*np.power(map_moon_width1,3) + 0.7319*np.power(map_moon_width1,2) - 6.3226*map_moon_width1 + 7.1651)
-	dimy, dimx = map_V_odeh.shape[0], map_V_odeh.shape[1]
-
-	map_data = np.zeros((dimy,dimx)) + float('nan')
-
-	# zone A
-	rows, cols = np.where(map_V_odeh>=5.65)
-	map_data[rows,cols] = 1
-
-	# zone B
-	rows, cols = np.where((map_V_odeh>=2) & (map_V_odeh<5.65))
-	map_data[rows,cols] = 2
+# The zone maps of the criteria are evaluated from the rules of criteria.VISIBILITY_RULES
 
-	# zone C
-	rows, cols = np.where((map_V_odeh>=-0.96) & (map_V_odeh<2.0))
-	map_data[rows,cols] = 3
-
-	# zone D
-	rows, cols = np.where(map_V_odeh<-0.96)
-	map_data[rows,cols] = 4
-
-	return map_data
+def calc_map_odeh(map_moon_width, map_moon_arcv):
+	return evaluate_visibility_criteria({'width': map_moon_width, 'arcv': map_moon_arcv}, ["Odeh"])["Odeh"]
 
 
 def calc_map_mabims(map_moon_elong_geo, map_moon_alt, map_moon_age_utc):
-	dimy, dimx = map_moon_alt.shape[0], map_moon_alt.shape[1]
-	map_data = np.zeros((dimy,dimx)) + 1
-
-	rows, cols = np.where(np.isnan(map_moon_alt)==True)
-	map_data[rows,cols] = float('nan')
-
-	rows1, cols1 = np.where((map_moon_alt>3.0) & (map_moon_elong_geo>6.4) & (map_moon_age_utc>0.0))
-	map_data[rows1,cols1] = 0 
-
-	return map_data
+	return evaluate_visibility_criteria({'elong_geo': map_moon_elong_geo, 'alt': map_moon_alt, 'age_utc': map_moon_age_utc}, ["MABIMS"])["MABIMS"]
 
 
 def calc_map_wujudul_hilal(map_moon_alt, map_moon_age_utc):
-	dimy, dimx = map_moon_alt.shape[0], map_moon_alt.shape[1]
-	map_data = np.zeros((dimy,dimx)) + 1
-
-	rows, cols = np.where(np.isnan(map_moon_alt)==True)
-	map_data[rows,cols] = float('nan')
-
-	rows1, cols1 = np.where((map_moon_alt>=-0.2575) & (map_moon_age_utc>0.0))
-	map_data[rows1,cols1] = 0
-
-	return map_data
+	return evaluate_visibility_criteria({'alt': map_moon_alt, 'age_utc': map_moon_age_utc}, ["Wujudul Hilal"])["Wujudul Hilal"]
 
 
 def calc_map_turkey(map_moon_elong, map_moon_alt, map_moon_age_utc, ijtima_utc):
 	dimy, dimx = map_moon_alt.shape[0], map_moon_alt.shape[1]
-	map_data = np.zeros((dimy,dimx)) + 1
-
-	rows, cols = np.where(np.isnan(map_moon_alt)==True)
-	map_data[rows,cols] = float('nan')
-
-	rows1, cols1 = np.where((map_moon_alt>5.0) & (map_moon_elong>8.0) & (map_moon_age_utc>0.0))
-	map_data[rows1,cols1] = 0
+	map_data = evaluate_visibility_criteria({'elong': map_moon_elong, 'alt': map_moon_alt, 'age_utc': map_moon_age_utc}, ["Turkey"])["Turkey"]
 
 	# locate area where local sunset occur before midnight UTC
 	map_utc_midnight = np.zeros((dimy,dimx)) + float('nan')
@@ -117,139 +82,272 @@ def calc_map_turkey(map_moon_elong, map_moon_alt, map_moon_age_utc, ijtima_utc):
 
 
 def calc_map_danjon(map_moon_elong, map_moon_alt, map_moon_age_utc):
-	dimy, dimx = map_moon_alt.shape[0], map_moon_alt.shape[1]
-	map_data = np.zeros((dimy,dimx)) + 1
+	return evaluate_visibility_criteria({'elong': map_moon_elong, 'alt': map_moon_alt, 'age_utc': map_moon_age_utc}, ["Danjon"])["Danjon"]
+
+def calc_map_IQG(map_moon_age_utc):
+	return evaluate_visibility_criteria({'age_utc': map_moon_age_utc}, ["Ijtima Qobla Ghurub"])["Ijtima Qobla Ghurub"]
 
-	rows, cols = np.where(np.isnan(map_moon_alt)==True)
-	map_data[rows,cols] = float('nan')
 
-	rows1, cols1 = np.where((map_moon_alt>0.0) & (map_moon_elong>7.0) & (map_moon_age_utc>0.0))
-	map_data[rows1,cols1] = 0
 
-	return map_data
+def _criterion_name(criterion):
+	# criteria are given by name or by their number in list_hilal_visibility_criteria()
+	hilal_criteria = list_hilal_visibility_criteria()
+	if criterion in hilal_criteria:
+		return criterion
+	if isinstance(criterion, int) and 1 <= criterion <= len(hilal_criteria):
+		return hilal_criteria[criterion-1]
+	raise ValueError("Unknown visibility criterion %r, see list_hilal_visibility_criteria()" % (criterion,))
 
-def calc_map_IQG(map_moon_age_utc):
-	dimy, dimx = map_moon_age_utc.shape[0], map_moon_age_utc.shape[1]
-	map_data = np.zeros((dimy,dimx)) + 1
 
-	rows, cols = np.where(np.isnan(map_moon_age_utc)==True)
-	map_data[rows,cols] = float('nan')
+def calc_map_visibility(criterion, map_moon_properties, ijtima_utc, suffix=''):
+	""" Visibility map of a criterion (name or number) from the map layers, suffix '1' for the layers of the next day. """
+	criterion = _criterion_name(criterion)
+	return evaluate_visibility_criteria(map_moon_properties, [criterion], suffix=suffix)[criterion]
+
+
+def calc_maps_visibility(map_moon_properties, criteria=None, suffix=''):
+	""" Visibility maps of several criteria (names or numbers, all by default) in one pass over the map layers,
+	see criteria.evaluate_visibility_criteria(). Returns a dictionary of maps by criterion name. """
+	criteria = list_hilal_visibility_criteria() if criteria is None else [_criterion_name(criterion) for criterion in criteria]
+	return evaluate_visibility_criteria(map_moon_properties, criteria, suffix=suffix)
+
+
+def calc_refined_visibility_map(criterion, ijtima_utc, delta_day=0, min_lat=-60.0, max_lat=70.0, min_long=-180.0, max_long=180.0, step=0.25, coarse_step=4.0,
+								precision="kernel"):
+	""" Visibility map of a criterion at a fine step, computed only around the boundaries between its zones.
+
+	The criterion is evaluated every coarse_step degree and the squares whose zones disagree are split
+	down to step, see mapengine.refine_map(). Every evaluation solves the sunset and the Moon layers the
+	criterion needs for those sites only.
+
+	:returns:
+		Map of the criterion on the global grid with the given step (from -90 to 90 and -180 to 180 degree,
+		so it can be given to the plot_visibility_map functions) and the number of sites computed.
+	"""
+	criterion = _criterion_name(criterion)
+	date = ijtima_utc + timedelta(days=delta_day)
+	table = map_table(date.year, date.month, date.day, precision=precision)
+
+	def classify(lat, lon):
+		map_tt = sunset_map_utc(lat, lon, date.year, date.month, date.day, table=table)
+		map_moon_properties = moon_properties_map_utc(lat, lon, map_tt, ijtima_utc, layers=VISIBILITY_CRITERIA_LAYERS[criterion], table=table)
+		for name in map_moon_properties:
+			map_moon_properties[name] = map_moon_properties[name][None,:]
+		return calc_map_visibility(criterion, map_moon_properties, ijtima_utc)[0]
+
+	return refine_map(classify, min_lat=min_lat, max_lat=max_lat, min_long=min_long, max_long=max_long, step=step, coarse_step=coarse_step)
+
 
-	rows1, cols1 = np.where(map_moon_age_utc>0.0)
-	map_data[rows1,cols1] = 0
+def calc_visibility_margin(criterion, map_moon_properties, suffix=''):
+	""" Margin of a criterion (name or number): how far every cell is past each limit of the criterion.
 
-	return map_data
+	The margin is positive where the limit is passed and crosses zero on the curve of the visibility map,
+	e.g. min(alt - 3, elong_geo - 6.4, age) for MABIMS. The age counts in hours. Suffix '1' takes the
+	layers of the next day.
 
+	:returns:
+		Dictionary of margins by limit: 'visible', or the zones 'A', 'B' and 'C' for Odeh (V - 5.65, V - 2, V + 0.96),
+		see criteria.visibility_margins().
+	"""
+	return visibility_margins(_criterion_name(criterion), map_moon_properties, suffix=suffix)
+
+
+def calc_visibility_curves(criterion, ijtima_utc, delta_day=0, min_lat=-60.0, max_lat=70.0, min_long=-180.0, max_long=180.0, row_step=0.5, sample_step=4.0,
+							tolerance_degrees=0.01, precision="kernel"):
+	""" Curves separating the zones of a visibility criterion, traced directly instead of from a full map.
+
+	Along every latitude row the longitude where calc_visibility_margin() crosses zero is solved, see
+	mapengine.trace_curves(); only the sites of the samples and of the root search are computed.
+
+	:returns:
+		Dictionary of lists of polylines (arrays of longitude, latitude) by limit, as in calc_visibility_margin().
+	"""
+	criterion = _criterion_name(criterion)
+	date = ijtima_utc + timedelta(days=delta_day)
+	table = map_table(date.year, date.month, date.day, precision=precision)
+
+	def margin(level):
+		def evaluate(lat, lon):
+			map_tt = sunset_map_utc(lat, lon, date.year, date.month, date.day, table=table)
+			map_moon_properties = moon_properties_map_utc(lat, lon, map_tt, ijtima_utc, layers=VISIBILITY_CRITERIA_LAYERS[criterion], table=table)
+			return calc_visibility_margin(criterion, map_moon_properties)[level]
+		return evaluate
+
+	levels = ['A', 'B', 'C'] if criterion == "Odeh" else ['visible']
+	curves = {}
+	for level in levels:
+		curves[level] = trace_curves(margin(level), min_lat=min_lat, max_lat=max_lat, min_long=min_long, max_long=max_long, row_step=row_step,
+									sample_step=sample_step, tolerance_degrees=tolerance_degrees)
+	return curves
+
+
+def visibility_curves_geojson(curves, criterion, ijtima_utc, delta_day=0):
+	""" GeoJSON FeatureCollection (a dictionary, for json.dump) of the curves of calc_visibility_curves(). """
+	date = ijtima_utc + timedelta(days=delta_day)
+	return curves_geojson(curves, properties={'criterion': _criterion_name(criterion), 'date': date.strftime('%Y-%m-%d'),
+											'ijtima_utc': ijtima_utc.isoformat()})
 
 
 class hilal:
 
-	def __init__(self, hijri_year, hijri_month, calculate_maps=False, plus_1day=True, min_lat=-60.0, max_lat=70.0, min_long=-180.0, max_long=180.0, factor=0.5):
+	def __init__(self, hijri_year, hijri_month, calculate_maps=False, plus_1day=True, min_lat=-60.0, max_lat=70.0, min_long=-180.0, max_long=180.0, factor=0.5, workers=1,
+					mask=None):
 
 		self.hijri_year = hijri_year
 		self.hijri_month = hijri_month
 		self.plus_1day = plus_1day
 		self.calculate_maps = calculate_maps
+		self.map_options = dict(min_lat=min_lat, max_lat=max_lat, min_long=min_long, max_long=max_long, factor=factor, workers=workers, mask=mask)
 
-		global ijtima_utc
-		ijtima_utc = newmoon_hijri_month_utc(hijri_year, hijri_month)
+		self.ijtima_utc = newmoon_hijri_month_utc(hijri_year, hijri_month)
 
-		if calculate_maps == True:
-			global map_moon_properties
-			map_moon_properties = get_map_moon_properties_atsunset(ijtima_utc.year, ijtima_utc.month, ijtima_utc.day, ijtima_utc, plus_1day=plus_1day, 
-													min_lat=min_lat, max_lat=max_lat, min_long=min_long, max_long=max_long, factor=factor)
+	@cached_property
+	def map_moon_properties(self):
+		""" Map layers at sunset of the day of ijtima and, with plus_1day, of the next day ('alt1', 'arcv1', ...).
+		Nothing is computed until a layer is used, and each layer once, see mapengine.moon_property_cube. """
+		return moon_property_cube(self.ijtima_utc.year, self.ijtima_utc.month, self.ijtima_utc.day, ijtima_utc=self.ijtima_utc, 
+								ndays=2 if self.plus_1day == True else 1, **self.map_options)
+
+	def _map_layers(self, names):
+		# the layers a plot or a criterion needs are computed together, for both days, in one pass
+		self.map_moon_properties.materialize(names)
+		return self.map_moon_properties
 
 	def map_moon_altitude(self):
 		if self.calculate_maps == True:
-			plot_map_moon_alt(map_moon_properties['alt'], self.hijri_year, self.hijri_month, ijtima_utc.year, ijtima_utc.month, ijtima_utc.day)
+			map_moon_properties = self._map_layers(['alt'])
+			plot_map_moon_alt(map_moon_properties['alt'], self.hijri_year, self.hijri_month, self.ijtima_utc.year, self.ijtima_utc.month, self.ijtima_utc.day)
 			if self.plus_1day == True:
-				ijtima_utc_plus1 = ijtima_utc + timedelta(days=1)
+				ijtima_utc_plus1 = self.ijtima_utc + timedelta(days=1)
 				plot_map_moon_alt(map_moon_properties['alt1'], self.hijri_year, self.hijri_month, ijtima_utc_plus1.year, ijtima_utc_plus1.month, ijtima_utc_plus1.day)
 
 	def map_moon_sun_altitude_difference(self):
 		if self.calculate_maps == True:
-			plot_map_moon_arcv(map_moon_properties['arcv'], self.hijri_year, self.hijri_month, ijtima_utc.year, ijtima_utc.month, ijtima_utc.day)
+			map_moon_properties = self._map_layers(['arcv'])
+			plot_map_moon_arcv(map_moon_properties['arcv'], self.hijri_year, self.hijri_month, self.ijtima_utc.year, self.ijtima_utc.month, self.ijtima_utc.day)
 			if self.plus_1day == True:
-				ijtima_utc_plus1 = ijtima_utc + timedelta(days=1)
+				ijtima_utc_plus1 = self.ijtima_utc + timedelta(days=1)
 				plot_map_moon_arcv(map_moon_properties['arcv1'], self.hijri_year, self.hijri_month, ijtima_utc_plus1.year, ijtima_utc_plus1.month, ijtima_utc_plus1.day)
 
 	def map_moon_elongation(self):
 		if self.calculate_maps == True:
-			plot_map_moon_elong(map_moon_properties['elong'], self.hijri_year, self.hijri_month, ijtima_utc.year, ijtima_utc.month, ijtima_utc.day)
+			map_moon_properties = self._map_layers(['elong'])
+			plot_map_moon_elong(map_moon_properties['elong'], self.hijri_year, self.hijri_month, self.ijtima_utc.year, self.ijtima_utc.month, self.ijtima_utc.day)
 			if self.plus_1day == True:
-				ijtima_utc_plus1 = ijtima_utc + timedelta(days=1)
+				ijtima_utc_plus1 = self.ijtima_utc + timedelta(days=1)
 				plot_map_moon_elong(map_moon_properties['elong1'], self.hijri_year, self.hijri_month, ijtima_utc_plus1.year, ijtima_utc_plus1.month, ijtima_utc_plus1.day)
 
 	def map_moon_geocentric_elongation(self):
 		if self.calculate_maps == True:
-			plot_map_moon_elong_geo(map_moon_properties['elong_geo'], self.hijri_year, self.hijri_month, ijtima_utc.year, ijtima_utc.month, ijtima_utc.day)
+			map_moon_properties = self._map_layers(['elong_geo'])
+			plot_map_moon_elong_geo(map_moon_properties['elong_geo'], self.hijri_year, self.hijri_month, self.ijtima_utc.year, self.ijtima_utc.month, self.ijtima_utc.day)
 			if self.plus_1day == True:
-				ijtima_utc_plus1 = ijtima_utc + timedelta(days=1)
+				ijtima_utc_plus1 = self.ijtima_utc + timedelta(days=1)
 				plot_map_moon_elong_geo(map_moon_properties['elong_geo1'], self.hijri_year, self.hijri_month, ijtima_utc_plus1.year, ijtima_utc_plus1.month, ijtima_utc_plus1.day)
 
 	def map_moon_width(self):
 		if self.calculate_maps == True:
-			plot_map_moon_width(map_moon_properties['width'], self.hijri_year, self.hijri_month, ijtima_utc.year, ijtima_utc.month, ijtima_utc.day)
+			map_moon_properties = self._map_layers(['width'])
+			plot_map_moon_width(map_moon_properties['width'], self.hijri_year, self.hijri_month, self.ijtima_utc.year, self.ijtima_utc.month, self.ijtima_utc.day)
 			if self.plus_1day == True:
-				ijtima_utc_plus1 = ijtima_utc + timedelta(days=1)
+				ijtima_utc_plus1 = self.ijtima_utc + timedelta(days=1)
 				plot_map_moon_width(map_moon_properties['width1'], self.hijri_year, self.hijri_month, ijtima_utc_plus1.year, ijtima_utc_plus1.month, ijtima_utc_plus1.day)
 
 	def map_moon_age_utc_localsunset(self):
 		if self.calculate_maps == True:
-			plot_map_moon_age_utc_localsunset(map_moon_properties['age_utc'], self.hijri_year, self.hijri_month, ijtima_utc.year, ijtima_utc.month, ijtima_utc.day)
+			map_moon_properties = self._map_layers(['age_utc'])
+			plot_map_moon_age_utc_localsunset(map_moon_properties['age_utc'], self.hijri_year, self.hijri_month, self.ijtima_utc.year, self.ijtima_utc.month, self.ijtima_utc.day)
 			if self.plus_1day == True:
-				ijtima_utc_plus1 = ijtima_utc + timedelta(days=1)
+				ijtima_utc_plus1 = self.ijtima_utc + timedelta(days=1)
 				plot_map_moon_age_utc_localsunset(map_moon_properties['age_utc1'], self.hijri_year, self.hijri_month, ijtima_utc_plus1.year, ijtima_utc_plus1.month, ijtima_utc_plus1.day)
 
-	def map_hilal_visibility(self, criterion):
+	def visibility_maps(self, criteria=None, delta_day=0, packed=False):
+		""" Visibility maps of all criteria (or the given ones) on the day of ijtima (delta_day=0) or the next, in one pass, see calc_maps_visibility().
+		With packed=True they come as one raster of a few bits per cell and the bit layout of the criteria it holds,
+		for packedmaps.unpack_visibility_maps() and save_packed_visibility(). """
+		if self.calculate_maps == True:
+			criteria = list_hilal_visibility_criteria() if criteria is None else [_criterion_name(criterion) for criterion in criteria]
+			map_moon_properties = self._map_layers(sorted(set(name for criterion in criteria for name in VISIBILITY_CRITERIA_LAYERS[criterion])))
+			maps = calc_maps_visibility(map_moon_properties, criteria=criteria, suffix='' if delta_day == 0 else '1')
+			return (pack_visibility_maps(maps), packed_layout(maps)) if packed == True else maps
+
+	def visibility_curves(self, criterion, delta_day=0, geojson=False, row_step=0.5, sample_step=4.0):
+		""" Curves of the visibility map of a criterion on the day of ijtima (delta_day=0) or the next, see calc_visibility_curves(). """
+		# traced over the box of the maps of this instance, not over the default one
+		bounds = {key: self.map_options[key] for key in ('min_lat', 'max_lat', 'min_long', 'max_long')}
+		curves = calc_visibility_curves(criterion, self.ijtima_utc, delta_day=delta_day, row_step=row_step, sample_step=sample_step, **bounds)
+		if geojson == True:
+			return visibility_curves_geojson(curves, criterion, self.ijtima_utc, delta_day=delta_day)
+		return curves
+
+	def map_hilal_visibility(self, criterion, curves=False):
+		# with curves the limits of the criterion are traced and drawn on the map, see calc_visibility_curves()
+		curves_of_day = lambda delta_day: self.visibility_curves(criterion, delta_day=delta_day) if curves == True else None
 		if self.calculate_maps == True:
+			# only the layers of this criterion are computed
+			map_moon_properties = self._map_layers(VISIBILITY_CRITERIA_LAYERS[_criterion_name(criterion)])
 			if criterion=='MABIMS' or criterion==1:
 				map_data = calc_map_mabims(map_moon_properties['elong_geo'], map_moon_properties['alt'],map_moon_properties['age_utc'])
-				plot_visibility_map_mabims(map_data, self.hijri_year, self.hijri_month, ijtima_utc.year, ijtima_utc.month, ijtima_utc.day)
+				plot_visibility_map_mabims(map_data, self.hijri_year, self.hijri_month, self.ijtima_utc.year, self.ijtima_utc.month, self.ijtima_utc.day, curves=curves_of_day(0))
 				if self.plus_1day == True:
 					map_data = calc_map_mabims(map_moon_properties['elong_geo1'], map_moon_properties['alt1'],map_moon_properties['age_utc1'])
-					ijtima_utc_plus1 = ijtima_utc + timedelta(days=1)
-					plot_visibility_map_mabims(map_data, self.hijri_year, self.hijri_month, ijtima_utc_plus1.year, ijtima_utc_plus1.month, ijtima_utc_plus1.day)
+					ijtima_utc_plus1 = self.ijtima_utc + timedelta(days=1)
+					plot_visibility_map_mabims(map_data, self.hijri_year, self.hijri_month, ijtima_utc_plus1.year, ijtima_utc_plus1.month, ijtima_utc_plus1.day, curves=curves_of_day(1))
 
 			elif criterion=='Odeh' or criterion==2:
 				map_data = calc_map_odeh(map_moon_properties['width'], map_moon_properties['arcv'])
-				plot_visibility_map_odeh(map_data, self.hijri_year, self.hijri_month, ijtima_utc.year, ijtima_utc.month, ijtima_utc.day)
+				plot_visibility_map_odeh(map_data, self.hijri_year, self.hijri_month, self.ijtima_utc.year, self.ijtima_utc.month, self.ijtima_utc.day, curves=curves_of_day(0))
 				if self.plus_1day == True:
 					map_data = calc_map_odeh(map_moon_properties['width1'], map_moon_properties['arcv1'])
-					ijtima_utc_plus1 = ijtima_utc + timedelta(days=1)
-					plot_visibility_map_odeh(map_data, self.hijri_year, self.hijri_month, ijtima_utc_plus1.year, ijtima_utc_plus1.month, ijtima_utc_plus1.day)
+					ijtima_utc_plus1 = self.ijtima_utc + timedelta(days=1)
+					plot_visibility_map_odeh(map_data, self.hijri_year, self.hijri_month, ijtima_utc_plus1.year, ijtima_utc_plus1.month, ijtima_utc_plus1.day, curves=curves_of_day(1))
 
 			elif criterion=='Wujudul Hilal' or criterion==3:
 				map_data = calc_map_wujudul_hilal(map_moon_properties['alt'],map_moon_properties['age_utc'])
-				plot_visibility_map_wujudul_hilal(map_data, self.hijri_year, self.hijri_month, ijtima_utc.year, ijtima_utc.month, ijtima_utc.day)
+				plot_visibility_map_wujudul_hilal(map_data, self.hijri_year, self.hijri_month, self.ijtima_utc.year, self.ijtima_utc.month, self.ijtima_utc.day, curves=curves_of_day(0))
 				if self.plus_1day == True:
 					map_data = calc_map_wujudul_hilal(map_moon_properties['alt1'],map_moon_properties['age_utc1'])
-					ijtima_utc_plus1 = ijtima_utc + timedelta(days=1)
-					plot_visibility_map_wujudul_hilal(map_data, self.hijri_year, self.hijri_month, ijtima_utc_plus1.year, ijtima_utc_plus1.month, ijtima_utc_plus1.day)
+					ijtima_utc_plus1 = self.ijtima_utc + timedelta(days=1)
+					plot_visibility_map_wujudul_hilal(map_data, self.hijri_year, self.hijri_month, ijtima_utc_plus1.year, ijtima_utc_plus1.month, ijtima_utc_plus1.day, curves=curves_of_day(1))
 
 			elif criterion=='Turkey' or criterion==4:
-				map_data, map_utc_midnight, fajr_utc_NZ = calc_map_turkey(map_moon_properties['elong'], map_moon_properties['alt'], map_moon_properties['age_utc'], ijtima_utc)
-				plot_visibility_map_turkey(map_data, self.hijri_year, self.hijri_month, ijtima_utc.year, ijtima_utc.month, ijtima_utc.day, map_utc_midnight, fajr_utc_NZ, ijtima_utc)
+				map_data, map_utc_midnight, fajr_utc_NZ = calc_map_turkey(map_moon_properties['elong'], map_moon_properties['alt'], map_moon_properties['age_utc'], self.ijtima_utc)
+				plot_visibility_map_turkey(map_data, self.hijri_year, self.hijri_month, self.ijtima_utc.year, self.ijtima_utc.month, self.ijtima_utc.day, map_utc_midnight, fajr_utc_NZ, self.ijtima_utc, curves=curves_of_day(0))
 				#if self.plus_1day == True:
-				#	ijtima_utc_plus1 = ijtima_utc + timedelta(days=1)
-				#	map_data, map_utc_midnight, fajr_utc_NZ = calc_map_turkey(map_moon_properties['elong1'], map_moon_properties['alt1'], map_moon_properties['age_utc1'], ijtima_utc)
-				#	plot_visibility_map_turkey(map_data, self.hijri_year, self.hijri_month, ijtima_utc_plus1.year, ijtima_utc_plus1.month, ijtima_utc_plus1.day, map_utc_midnight, fajr_utc_NZ, ijtima_utc)
+				#	ijtima_utc_plus1 = self.ijtima_utc + timedelta(days=1)
+				#	map_data, map_utc_midnight, fajr_utc_NZ = calc_map_turkey(map_moon_properties['elong1'], map_moon_properties['alt1'], map_moon_properties['age_utc1'], self.ijtima_utc)
+				#	plot_visibility_map_turkey(map_data, self.hijri_year, self.hijri_month, ijtima_utc_plus1.year, ijtima_utc_plus1.month, ijtima_utc_plus1.day, map_utc_midnight, fajr_utc_NZ, self.ijtima_utc)
 
 			elif criterion=='Danjon' or criterion==5:
 				map_data = calc_map_danjon(map_moon_properties['elong'], map_moon_properties['alt'],map_moon_properties['age_utc'])
-				plot_visibility_map_danjon(map_data, self.hijri_year, self.hijri_month, ijtima_utc.year, ijtima_utc.month, ijtima_utc.day)
+				plot_visibility_map_danjon(map_data, self.hijri_year, self.hijri_month, self.ijtima_utc.year, self.ijtima_utc.month, self.ijtima_utc.day, curves=curves_of_day(0))
 				if self.plus_1day == True:
 					map_data = calc_map_danjon(map_moon_properties['elong1'], map_moon_properties['alt1'],map_moon_properties['age_utc1'])
-					ijtima_utc_plus1 = ijtima_utc + timedelta(days=1)
-					plot_visibility_map_danjon(map_data, self.hijri_year, self.hijri_month, ijtima_utc_plus1.year, ijtima_utc_plus1.month, ijtima_utc_plus1.day)
+					ijtima_utc_plus1 = self.ijtima_utc + timedelta(days=1)
+					plot_visibility_map_danjon(map_data, self.hijri_year, self.hijri_month, ijtima_utc_plus1.year, ijtima_utc_plus1.month, ijtima_utc_plus1.day, curves=curves_of_day(1))
 
 			elif criterion=="Ijtima Qobla Ghurub" or criterion==6:
 				map_data = calc_map_IQG(map_moon_properties['age_utc'])
-				plot_visibility_map_IQG(map_data, self.hijri_year, self.hijri_month, ijtima_utc.year, ijtima_utc.month, ijtima_utc.day)
+				plot_visibility_map_IQG(map_data, self.hijri_year, self.hijri_month, self.ijtima_utc.year, self.ijtima_utc.month, self.ijtima_utc.day, curves=curves_of_day(0))
 				if self.plus_1day == True:
 					map_data = calc_map_IQG(map_moon_properties['age_utc1'])
-					ijtima_utc_plus1 = ijtima_utc + timedelta(days=1)
-					plot_visibility_map_IQG(map_data, self.hijri_year, self.hijri_month, ijtima_utc_plus1.year, ijtima_utc_plus1.month, ijtima_utc_plus1.day)
+					ijtima_utc_plus1 = self.ijtima_utc + timedelta(days=1)
+					plot_visibility_map_IQG(map_data, self.hijri_year, self.hijri_month, ijtima_utc_plus1.year, ijtima_utc_plus1.month, ijtima_utc_plus1.day, curves=curves_of_day(1))
+
+	def map_hilal_visibility_refined(self, criterion, step=0.25, coarse_step=4.0, min_lat=-60.0, max_lat=70.0, min_long=-180.0, max_long=180.0):
+		""" Same as map_hilal_visibility() at a fine step, refined around the zone boundaries, see calc_refined_visibility_map(). """
+		criterion = _criterion_name(criterion)
+		plots = {"MABIMS": plot_visibility_map_mabims, "Odeh": plot_visibility_map_odeh, "Wujudul Hilal": plot_visibility_map_wujudul_hilal,
+				"Danjon": plot_visibility_map_danjon, "Ijtima Qobla Ghurub": plot_visibility_map_IQG}
+		if criterion not in plots:
+			# the map of Turkey also shows where the sunset comes before midnight UTC, which needs every cell
+			raise ValueError("The %s criterion has no refined map, use map_hilal_visibility()" % criterion)
+
+		for delta_day in range(2 if self.plus_1day == True else 1):
+			map_data, nsites = calc_refined_visibility_map(criterion, self.ijtima_utc, delta_day=delta_day, min_lat=min_lat, max_lat=max_lat, 
+														min_long=min_long, max_long=max_long, step=step, coarse_step=coarse_step)
+			date = self.ijtima_utc + timedelta(days=delta_day)
+			plots[criterion](map_data, self.hijri_year, self.hijri_month, date.year, date.month, date.day)
 
 	def calculate_hilal_data(self, latitude, longitude, elevation, time_zone_str, loc_name=None, 
 					delta_day=0, temperature_C=10.0, pressure_mbar=1030.0, sun_radius_degrees=0.2665, moon_radius_degrees=0.2575):
@@ -0,0 +1,787 @@
+import numpy as np
+from skyfield.toposlib import iers2010
+from skyfield.nutationlib import iau2000b_radians
+from skyfield.timelib import julian_day
+from skyfield.earthlib import refract
+from datetime import datetime
+from functools import cached_property
+from datetime import timedelta
+import os
+import shutil
+import weakref
+import tempfile
+
+from .sunmoon import *
+from .sunmoon import MOON_EARTH_RADIUS_RATIO
+from .ephemtable import sun_moon_table, angle_between_degrees, horizon_coordinates
+from .fastephem import precision_engine
+
+__all__ = ["map_grid", "map_table", "sunset_map_utc", "moon_properties_map_utc", "moon_property_cube", "calc_map_moon_properties", "refine_map",
+			"trace_curves", "curves_geojson"]
+
+# Ephemeris data is shared by the whole package and loaded on first use
+from .ephemeris import ts, ephem, preload
+
+# Earth's rotation rate relative to the mean Sun, in degree per day
+EARTH_ROTATION_DEG_PER_DAY = 360.9856235
+
+# Number of map rows evaluated together. The bands do not depend on the number of workers, so the
+# serial and the parallel results are identical (skyfield's refraction iterates over the whole batch).
+MAP_BAND_ROWS = 8
+
+
+def map_grid(min_lat=-60.0, max_lat=70.0, min_long=-180.0, max_long=180.0, factor=0.5):
+	""" Build the global map grid used by the crescent maps.
+
+	Returns the latitude and longitude of every cell centre as 2-D arrays of shape (nlat,nlong)
+	together with a boolean mask of the cells that have to be computed. As in the original
+	per-pixel loops, the last row and column are never computed and cells whose lower-left
+	corner falls outside of the min/max box are left out.
+	"""
+	min_lat1, max_lat1, min_long1, max_long1 = -90, 90, -180, 180
+
+	nlat = int(factor*((max_lat1-min_lat1)+1))
+	nlong = int(factor*((max_long1-min_long1)+1))
+	grid_lat = np.linspace(min_lat1, max_lat1, nlat)
+	grid_long = np.linspace(min_long1, max_long1, nlong)
+
+	map_lat = np.zeros((nlat,nlong))
+	map_long = np.zeros((nlat,nlong))
+	map_lat[:-1,:] = 0.5*(grid_lat[:-1] + grid_lat[1:])[:,None]
+	map_long[:,:-1] = 0.5*(grid_long[:-1] + grid_long[1:])[None,:]
+
+	map_inside = np.zeros((nlat,nlong), dtype=bool)
+	map_inside[:-1,:-1] = ((grid_lat[:-1]>=min_lat) & (grid_lat[:-1]<=max_lat))[:,None] & ((grid_long[:-1]>=min_long) & (grid_long[:-1]<=max_long))[None,:]
+
+	return map_lat, map_long, map_inside
+
+
+def _horizon_degrees(elevation, temperature_C, pressure_mbar):
+	earth_radius_m = 6378136.6
+	h = -np.degrees(np.arccos(earth_radius_m/(earth_radius_m + elevation)))
+	return h - refraction_horizon_degree(temperature_C, pressure_mbar)
+
+
+def _sun_altitude_and_rate(lat, lon, elevation, t):
+	# apparent topocentric altitude without refraction, exactly as almanac.risings_and_settings() evaluates it
+	t._nutation_angles_radians = iau2000b_radians(t)
+	sun_pos = (ephem['Earth'] + iers2010.latlon(lat, lon, elevation)).at(t).observe(ephem['Sun']).apparent()
+	alt = sun_pos.altaz()[0].radians
+	ra, dec, distance = sun_pos.radec(epoch='date')
+	hour_angle = np.radians((t.gast - ra.hours)*15.0 + lon)
+	rate = -EARTH_ROTATION_DEG_PER_DAY*np.cos(np.radians(lat))*np.cos(dec.radians)*np.sin(hour_angle)/np.cos(alt)
+	return np.degrees(alt), rate, dec.radians
+
+
+def _sun_altitude_and_rate_table(table, lat, lon, site, jd):
+	# same as _sun_altitude_and_rate() with the Sun interpolated from the table
+	v = table.topocentric('Sun', jd, site)
+	alt, az, distance = horizon_coordinates(v, lat, lon)
+	dec = np.arcsin(v[:,2]/distance)
+	hour_angle = np.radians(lon) - np.arctan2(v[:,1], v[:,0])
+	rate = -EARTH_ROTATION_DEG_PER_DAY*np.cos(np.radians(lat))*np.cos(dec)*np.sin(hour_angle)/np.cos(np.radians(alt))
+	return alt, rate, dec
+
+
+def map_table(year, month, day, precision="kernel", ndays=1):
+	""" Sun and Moon table covering every sunset of the given date over the globe, with a margin for the iterations.
+
+	With ndays > 1 the table also covers the sunsets of the following ndays-1 days.
+	With precision="fast" the analytic series of fastephem.fast_sun_moon stand in for the table and no kernel is read.
+	"""
+	jd_day = ts.utc(year, month, day).tt
+	engine = precision_engine(precision, jd_day - 0.5, jd_day + 1.0 + ndays)
+	if engine is not None:
+		return engine
+	return sun_moon_table(jd_day - 0.5, jd_day + 1.0 + ndays)
+
+
+def _utc_seconds(t):
+	year, month, day, hour, minute, second = t.utc
+	return julian_day(year.astype(int), month.astype(int), day.astype(int))*86400.0 + hour*3600.0 + minute*60.0 + second
+
+
+def sunset_map_utc(map_lat, map_long, year, month, day, elevation=0.0, temperature_C=10.0, pressure_mbar=1030.0, radius_degrees=0.2665,
+					tolerance_seconds=0.001, max_iterations=12, table=None, ndays=1):
+	""" Solve the sunset instant of every cell of a map in one batch.
+
+	All cells are iterated together with Newton steps on the topocentric altitude of the Sun, so every
+	iteration is a single vectorized skyfield evaluation. The selection of which sunset belongs to the
+	requested date follows sunrise_sunset_utc().
+
+	:param table:
+		A sun_moon_table covering the date, see map_table(). The Sun is then interpolated from it instead
+		of being evaluated from the kernel at every iteration.
+
+	:param ndays:
+		Number of consecutive days, starting at the given date, the table must cover them, see map_table().
+		Each following day starts from the sunsets of the day before and needs fewer iterations.
+
+	:returns:
+		Array with the shape of map_lat holding the sunset time as TT Julian date, NaN where the Sun does not set.
+		With ndays > 1 a first axis of length ndays runs over the days.
+	"""
+	map_lat = np.asarray(map_lat, dtype=float)
+	map_long = np.asarray(map_long, dtype=float)
+	ncells = map_lat.size
+	lat, lon = np.tile(map_lat.ravel(), ndays), np.tile(map_long.ravel(), ndays)
+	offset = np.repeat(np.arange(ndays), ncells)
+
+	target = _horizon_degrees(elevation, temperature_C, pressure_mbar) - radius_degrees
+
+	# start from the hour angle of the setting Sun around local mean noon
+	jd_day = ts.utc(year, month, day).tt
+	jd_noon = jd_day + offset + 0.5 - lon/360.0
+	if table is None:
+		t = ts.tt_jd(jd_noon)
+		ra, dec_noon, distance = (ephem['Earth']).at(t).observe(ephem['Sun']).apparent().radec(epoch='date')
+		hour_angle_noon = ((t.gast - ra.hours)*15.0 + lon + 180.0) % 360.0 - 180.0
+		dec_noon = dec_noon.radians
+	else:
+		# geocentric Sun in the terrestrial frame, its longitude gives the hour angle
+		v = table.topocentric('Sun', jd_noon, np.zeros((len(lon), 3)))
+		hour_angle_noon = (lon - np.degrees(np.arctan2(v[:,1], v[:,0])) + 180.0) % 360.0 - 180.0
+		dec_noon = np.arcsin(v[:,2]/np.linalg.norm(v, axis=1))
+		site = iers2010.latlon(lat, lon, elevation_m=elevation).itrs_xyz.km.T
+	cos_h0 = (np.sin(np.radians(target)) - np.sin(np.radians(lat))*np.sin(dec_noon))/(np.cos(np.radians(lat))*np.cos(dec_noon))
+	has_sunset = np.abs(cos_h0) < 1.0
+	h0 = np.degrees(np.arccos(np.clip(cos_h0, -1.0, 1.0)))
+	guess = jd_noon + (h0 - hour_angle_noon)/EARTH_ROTATION_DEG_PER_DAY
+	jd = guess.copy()
+
+	for k in range(ndays):
+		active = np.flatnonzero(has_sunset & (offset == k))
+		if k > 0:
+			# the sunset of the day before, moved by how much the guess moves in a day: within a second or
+			# so of the root instead of about a minute, which saves Newton steps on every following day
+			seeded = active[np.isfinite(jd[active - ncells])]
+			jd[seeded] = jd[seeded - ncells] + guess[seeded] - guess[seeded - ncells]
+
+		# iterate all cells of the day together until every one of them has converged
+		for ii in range(max_iterations):
+			if len(active) == 0:
+				break
+			if table is None:
+				alt, rate, dec = _sun_altitude_and_rate(lat[active], lon[active], elevation, ts.tt_jd(jd[active]))
+			else:
+				jd[active] = np.clip(jd[active], table.jd_start, table.jd_end)
+				alt, rate, dec = _sun_altitude_and_rate_table(table, lat[active], lon[active], site[active], jd[active])
+			step = (alt - target)/rate
+			jd[active] = jd[active] - step
+			active = active[np.abs(step)*86400.0 > tolerance_seconds]
+
+		jd[~has_sunset & (offset == k)] = float('nan')
+		jd[active] = float('nan')   # never converged
+
+	# keep only the sunset that sunrise_sunset_utc() would report for this date
+	valid = np.flatnonzero(np.isfinite(jd))
+	if len(valid) > 0:
+		year1, month1, day1, hour1, minute1, second1 = ts.tt_jd(jd[valid]).utc
+		days = np.array([(datetime(year,month,day,0,0,0) + timedelta(days=k)).day for k in range(ndays + 1)])
+		before_midnight = (hour1*60.0)+minute1+(second1/60.0) + lon[valid]*4 < 0.0
+		expected_day = np.where(before_midnight, days[offset[valid] + 1], days[offset[valid]])
+		jd[valid[day1 != expected_day]] = float('nan')
+
+	if ndays == 1:
+		return jd.reshape(map_lat.shape)
+	return jd.reshape((ndays,) + map_lat.shape)
+
+
+MAP_LAYERS = ('alt', 'arcv', 'elong', 'elong_geo', 'width', 'age_utc')
+
+# Layers of the memory-mapped block shared with the worker processes, see moon_property_cube and _shared_index()
+SHARED_LAYERS = MAP_LAYERS + ('sunset',)
+
+
+def _layer_name(name, day):
+	# layers of the following days carry the day number, e.g. 'alt1' is the altitude at the sunset of the next day
+	return name if day == 0 else '%s%d' % (name, day)
+
+
+def _shared_index(name, day, ndays):
+	# the map layers come first, day after day, then the sunsets: a two-day block starts with the 12 layers of calcmaps_fits
+	if name == 'sunset':
+		return ndays*len(MAP_LAYERS) + day
+	return day*len(MAP_LAYERS) + MAP_LAYERS.index(name)
+
+
+class _moon_geometry:
+	""" Sun and Moon geometry of a set of cells, every quantity is computed on first use and shared by the layers. """
+
+	def __init__(self, map_lat, map_long, map_tt, ijtima_utc=None, elevation=0.0, temperature_C=10.0, pressure_mbar=1030.0, parallax_method="ephemeris",
+					table=None):
+		self.map_tt = np.asarray(map_tt, dtype=float)
+		self.idx = np.flatnonzero(np.isfinite(self.map_tt))
+		self.lat = np.asarray(map_lat, dtype=float).ravel()[self.idx]
+		self.lon = np.asarray(map_long, dtype=float).ravel()[self.idx]
+		self.ijtima_utc = ijtima_utc
+		self.elevation = elevation
+		self.temperature_C = temperature_C
+		self.pressure_mbar = pressure_mbar
+		self.parallax_method = parallax_method
+		self.table = table
+
+	@cached_property
+	def t(self):
+		return ts.tt_jd(self.map_tt.ravel()[self.idx])
+
+	@cached_property
+	def jd(self):
+		return self.map_tt.ravel()[self.idx]
+
+	@cached_property
+	def topocentric(self):
+		if self.table is None:
+			observer = (ephem['Earth'] + iers2010.latlon(self.lat, self.lon, self.elevation)).at(self.t)
+			return observer.observe(ephem['Moon']).apparent(), observer.observe(ephem['Sun']).apparent()
+		# terrestrial vectors interpolated from the table, see ephemtable.sun_moon_table
+		site = iers2010.latlon(self.lat, self.lon, elevation_m=self.elevation).itrs_xyz.km.T
+		rotation = self.table.earth_rotation(self.jd)
+		return self.table.topocentric('Moon', self.jd, site, rotation), self.table.topocentric('Sun', self.jd, site, rotation)
+
+	@cached_property
+	def geocentric(self):
+		if self.table is None:
+			geocenter = ephem['Earth'].at(self.t)
+			return geocenter.observe(ephem['Moon']).apparent(), geocenter.observe(ephem['Sun']).apparent()
+		return self.table.geocentric('Moon', self.jd), self.table.geocentric('Sun', self.jd)
+
+	def _altitude(self, position):
+		if self.table is None:
+			return position.altaz(temperature_C=self.temperature_C, pressure_mbar=self.pressure_mbar)[0].degrees
+		return refract(horizon_coordinates(position, self.lat, self.lon)[0], self.temperature_C, self.pressure_mbar)
+
+	def _separation(self, a, b):
+		if self.table is None:
+			return a.separation_from(b).degrees
+		return angle_between_degrees(a, b)
+
+	@cached_property
+	def moon_alt(self):
+		m, s = self.topocentric
+		return self._altitude(m)
+
+	@cached_property
+	def sun_alt(self):
+		m, s = self.topocentric
+		return self._altitude(s)
+
+	@cached_property
+	def elong(self):
+		m, s = self.topocentric
+		return self._separation(s, m)
+
+	@cached_property
+	def elong_geo(self):
+		m, s = self.geocentric
+		return self._separation(s, m)
+
+	@cached_property
+	def parallax(self):
+		# horizontal parallax from the geocentric Moon that elong_geo observes anyway
+		m, s = self.geocentric
+		distance_km = m.distance().km if self.table is None else np.linalg.norm(m, axis=1)
+		return moon_parallax(self.t, parallax_method=self.parallax_method, distance_km=distance_km)
+
+	@cached_property
+	def width(self):
+		SD = MOON_EARTH_RADIUS_RATIO*self.parallax*60.0    # in arcmin
+		return SD*(1.0 - np.cos(self.elong*np.pi/180.0))/60.0   # in degree
+
+	@cached_property
+	def age_utc(self):
+		if self.ijtima_utc is None:
+			raise ValueError("The moon age needs the conjunction time, ijtima_utc")
+		ijtima = self.ijtima_utc
+		ijtima_seconds = julian_day(ijtima.year, ijtima.month, ijtima.day)*86400.0 + ijtima.hour*3600.0 + ijtima.minute*60.0 + ijtima.second + ijtima.microsecond*1e-6
+		return np.floor(np.round(_utc_seconds(self.t) - ijtima_seconds, 6))
+
+	def layer(self, name):
+		map_layer = np.zeros(self.map_tt.shape) + float('nan')
+		if len(self.idx) > 0:
+			if name == 'arcv':
+				values = self.moon_alt - self.sun_alt
+			elif name == 'alt':
+				values = self.moon_alt
+			elif name in MAP_LAYERS:
+				values = getattr(self, name)
+			else:
+				raise KeyError("Unknown map layer '%s', available layers are %s" % (name, ', '.join(MAP_LAYERS)))
+			map_layer.ravel()[self.idx] = values
+		return map_layer
+
+
+def moon_properties_map_utc(map_lat, map_long, map_tt, ijtima_utc, elevation=0.0, temperature_C=10.0, pressure_mbar=1030.0, layers=MAP_LAYERS,
+							parallax_method="ephemeris", table=None):
+	""" Evaluate the Moon layers of a map at the given instant of every cell.
+
+	:param map_tt:
+		Array of TT Julian dates, NaN for cells that must be skipped.
+
+	:param table:
+		Optional sun_moon_table covering map_tt, the Sun and the Moon are then interpolated from it.
+
+	:returns:
+		Dictionary with the 'alt', 'arcv', 'elong', 'elong_geo', 'width' and 'age_utc' layers.
+	"""
+	geometry = _moon_geometry(map_lat, map_long, map_tt, ijtima_utc=ijtima_utc, elevation=elevation, temperature_C=temperature_C, pressure_mbar=pressure_mbar,
+							parallax_method=parallax_method, table=table)
+
+	map_moon_properties = {}
+	for name in layers:
+		map_moon_properties[name] = geometry.layer(name)
+
+	return map_moon_properties
+
+
+def _init_worker():
+	# every worker process opens the timescale and the kernel once, at startup
+	preload()
+
+
+def _band_sunset(year, month, day, map_lat, map_long, map_inside, table=None, ndays=1):
+	# sunsets of every day of the band, shape (ndays,nrows,nlong), solved in one call of sunset_map_utc()
+	map_tt = np.zeros((ndays,) + map_lat.shape) + float('nan')
+	if map_inside.any():
+		map_tt[:,map_inside] = sunset_map_utc(map_lat[map_inside], map_long[map_inside], year, month, day, table=table, ndays=ndays).reshape(ndays, -1)
+	return map_tt
+
+
+def _calc_band(year, month, day, ijtima_utc, map_lat, map_long, map_inside, layers=MAP_LAYERS, parallax_method="ephemeris", table=None, ndays=1):
+	map_tt = _band_sunset(year, month, day, map_lat, map_long, map_inside, table=table, ndays=ndays)
+	map_moon_properties = moon_properties_map_utc(np.broadcast_to(map_lat, map_tt.shape), np.broadcast_to(map_long, map_tt.shape), map_tt, ijtima_utc,
+												layers=layers, parallax_method=parallax_method, table=table)
+	map_moon_properties['sunset'] = map_tt
+	return map_moon_properties
+
+
+def _calc_band_into(path, names, rows, *args):
+	# same as _calc_band() but the band is written straight into the memory-mapped block of the cube instead of being sent back
+	map_moon_properties = _calc_band(*args)
+	block = np.load(path, mmap_mode='r+')
+	ndays = len(map_moon_properties['sunset'])
+	for name in names:
+		for day in range(ndays):
+			block[_shared_index(name, day, ndays), rows] = map_moon_properties[name][day]
+	block.flush()
+	del block
+
+
+class moon_property_cube:
+	""" Moon properties at local sunset over the map grid, materialized lazily layer by layer.
+
+	The sunset of every cell and the topocentric Sun and Moon positions are computed once, the first
+	time a layer needs them, and are shared by every other layer. Layers are accessed like a dictionary,
+	e.g. cube['alt'], and are kept once computed.
+
+	With ndays > 1 the sunsets of the following days are solved together with those of the given
+	date and every layer is evaluated for all days at once; the layers of day k are named with the day
+	number, e.g. cube['alt1'] for the next day.
+
+	mask restricts the computation to a region, see mapmask.map_mask(): a boolean raster of the grid
+	or a region such as "land" or "MABIMS". Cells outside of it are NaN, like the cells outside of the box.
+
+	With workers > 1 the layers live in one memory-mapped .npy block of shape (ndays*len(SHARED_LAYERS),nlat,nlong),
+	ordered as in _shared_index(), in shared_dir (a temporary folder by default, removed with the cube or by close()). Every worker writes
+	its band into it directly, so nothing is sent back to the parent, and the layers handed out as well
+	as cube.block are views of the file, without a copy.
+	"""
+
+	def __init__(self, year, month, day, ijtima_utc=None, min_lat=-60.0, max_lat=70.0, min_long=-180.0, max_long=180.0, factor=0.5, workers=1,
+					parallax_method="ephemeris", interpolate=True, precision="kernel", shared_dir=None, ndays=1, mask=None):
+		self.year, self.month, self.day = year, month, day
+		self.ndays = ndays
+		self.ijtima_utc = ijtima_utc
+		self.workers = workers
+		self.parallax_method = parallax_method
+		# one table of the Sun and the Moon serves every band and every day, see ephemtable.sun_moon_table
+		self.table = map_table(year, month, day, precision=precision, ndays=ndays) if interpolate or precision != "kernel" else None
+		self.map_lat, self.map_long, self.map_inside = map_grid(min_lat=min_lat, max_lat=max_lat, min_long=min_long, max_long=max_long, factor=factor)
+		if mask is not None:
+			from .mapmask import map_mask
+			self.map_inside = self.map_inside & map_mask(mask, factor=factor)
+
+		self._bands = [slice(row, row+MAP_BAND_ROWS) for row in range(0, self.map_lat.shape[0], MAP_BAND_ROWS)]
+		self._geometry = None
+		self._layers = {}
+		self.shared_dir = shared_dir
+		self.block = None
+		self._finalizer = None
+
+	@property
+	def shape(self):
+		return self.map_lat.shape
+
+	def keys(self):
+		return [_layer_name(name, day) for day in range(self.ndays) for name in MAP_LAYERS]
+
+	def __contains__(self, name):
+		return name in self.keys()
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def __getitem__(self, name):
+		if name not in self._layers:
+			self.materialize([name])
+		return self._layers[name]
+
+	@property
+	def sunset(self):
+		""" Sunset time of every cell as TT Julian date, NaN where there is no sunset or the cell is not computed.
+		The sunsets of the following days are cube.sunsets(day).
+		"""
+		return self.sunsets(0)
+
+	def sunsets(self, day):
+		if 'sunset' not in self._layers:
+			self._store('sunset', self._assemble([geometry.map_tt for geometry in self._band_geometries()], fill_value=float('nan')))
+		return self._layers[_layer_name('sunset', day)]
+
+	def _band_geometries(self):
+		if self._geometry is None:
+			self._geometry = []
+			for rows in self._bands:
+				map_tt = _band_sunset(self.year, self.month, self.day, self.map_lat[rows], self.map_long[rows], self.map_inside[rows], table=self.table,
+									ndays=self.ndays)
+				self._geometry.append(_moon_geometry(np.broadcast_to(self.map_lat[rows], map_tt.shape), np.broadcast_to(self.map_long[rows], map_tt.shape), map_tt, 
+													ijtima_utc=self.ijtima_utc, parallax_method=self.parallax_method, table=self.table))
+		return self._geometry
+
+	def _assemble(self, band_layers, fill_value=0.0):
+		# bands are (ndays,nrows,nlong)
+		return self._fill_edges(np.concatenate(band_layers, axis=1), fill_value)
+
+	def _fill_edges(self, map_layer, fill_value=0.0):
+		# cells of the last row/column are never computed, cells outside of the box are NaN
+		map_layer[...,-1,:] = fill_value
+		map_layer[...,:,-1] = fill_value
+		return map_layer
+
+	def _store(self, name, map_layers):
+		for day in range(self.ndays):
+			self._layers[_layer_name(name, day)] = map_layers[day]
+
+	def _shared_block(self):
+		# one memory-mapped block for every layer, see the class docstring
+		if self.block is None:
+			if self.shared_dir is None:
+				self.shared_dir = tempfile.mkdtemp(prefix='ahc_cube_')
+				self._finalizer = weakref.finalize(self, shutil.rmtree, self.shared_dir, ignore_errors=True)
+			os.makedirs(self.shared_dir, exist_ok=True)
+			path = os.path.join(self.shared_dir, 'cube_%04d%02d%02d.npy' % (self.year, self.month, self.day))
+			self.block = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=(self.ndays*len(SHARED_LAYERS),) + self.shape)
+		return self.block.filename
+
+	def close(self):
+		""" Remove the temporary folder of the shared layers now instead of when the cube goes away. """
+		self._layers = {}
+		self.block = None
+		if self._finalizer is not None:
+			self._finalizer()
+
+	def materialize(self, layers=MAP_LAYERS):
+		""" Compute the given layers (all of them by default) in one pass over the grid, for every day of the cube. """
+		base_names = {_layer_name(name, day): name for day in range(self.ndays) for name in MAP_LAYERS}
+		for name in layers:
+			if name not in base_names:
+				raise KeyError("Unknown map layer '%s', available layers are %s" % (name, ', '.join(base_names)))
+		# a layer is always computed for all days together
+		layers = list(dict.fromkeys(base_names[name] for name in layers if name not in self._layers))
+		if len(layers) == 0:
+			return self
+
+		if self.workers is None or self.workers <= 1:
+			for name in layers:
+				self._store(name, self._assemble([geometry.layer(name) for geometry in self._band_geometries()]))
+		else:
+			from concurrent.futures import ProcessPoolExecutor
+
+			# the geometry cannot be shared across processes, so every band computes all requested layers at once
+			# and writes them into the shared layers
+			names = layers + ([] if 'sunset' in self._layers else ['sunset'])
+			path = self._shared_block()
+			# bands without a cell to compute, e.g. open sea under a mask, are not sent to the workers
+			bands = [rows for rows in self._bands if self.map_inside[rows].any()]
+			for rows in self._bands:
+				if not self.map_inside[rows].any():
+					self.block[:,rows] = float('nan')
+			nbands = len(bands)
+			args = ([path]*nbands, [names]*nbands, bands, [self.year]*nbands, [self.month]*nbands, [self.day]*nbands, [self.ijtima_utc]*nbands, 
+					[self.map_lat[rows] for rows in bands], [self.map_long[rows] for rows in bands], 
+					[self.map_inside[rows] for rows in bands], [layers]*nbands, [self.parallax_method]*nbands, [self.table]*nbands, [self.ndays]*nbands)
+			with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker) as executor:
+				list(executor.map(_calc_band_into, *args))
+			for name in names:
+				self._store(name, [self._fill_edges(self.block[_shared_index(name, day, self.ndays)], fill_value=float('nan') if name == 'sunset' else 0.0)
+									for day in range(self.ndays)])
+
+		return self
+
+	def to_dict(self):
+		""" Every layer in a dictionary. Layers of the memory-mapped block are copied out of it, so the
+		dictionary stays valid once the cube is closed or gone. """
+		self.materialize()
+		map_moon_properties = {}
+		for name in self.keys():
+			map_moon_properties[name] = self._layers[name] if self.block is None else np.array(self._layers[name])
+		return map_moon_properties
+
+
+def calc_map_moon_properties(year, month, day, ijtima_utc, min_lat=-60.0, max_lat=70.0, min_long=-180.0, max_long=180.0, factor=0.5, workers=1,
+							parallax_method="ephemeris", interpolate=True, precision="kernel", shared_dir=None, ndays=1, mask=None):
+	""" Moon properties at local sunset for every cell of the map, computed with the vectorized sunset solver.
+
+	:param workers:
+		Number of worker processes. With workers > 1 the row bands of the grid are computed in a
+		process pool; the result is identical to the serial one. The workers write into memory-mapped
+		layers, see moon_property_cube, kept in shared_dir when it is given.
+
+	:param parallax_method:
+		"ephemeris" (default) or "pymeeus" for the horizontal parallax of the width layer, see moon_parallax().
+
+	:param interpolate:
+		Interpolate the Sun and the Moon from a table sampled once for the date (default) instead of
+		evaluating the kernel for every cell, see ephemtable.sun_moon_table for the error bound.
+
+	:param precision:
+		"kernel" (default) or "fast" for the low precision analytic series of fastephem.fast_sun_moon,
+		good enough to pre-screen visibility over many years; see fastephem.fast_precision_report().
+
+	:param ndays:
+		Number of consecutive days starting at the given date, all computed in one pass; the layers of
+		day k > 0 get the day number appended, e.g. 'alt1'.
+
+	:param mask:
+		Only compute the cells of a region, e.g. mask="land" or "MABIMS", a list of countries, a polygon or a
+		boolean raster of the grid, see mapmask.map_mask(). The other cells are NaN.
+	"""
+	cube = moon_property_cube(year, month, day, ijtima_utc=ijtima_utc, min_lat=min_lat, max_lat=max_lat, min_long=min_long, max_long=max_long, 
+							factor=factor, workers=workers, parallax_method=parallax_method, interpolate=interpolate,
+							precision=precision, shared_dir=shared_dir, ndays=ndays, mask=mask)
+	map_moon_properties = cube.to_dict()
+	cube.close()
+	return map_moon_properties
+
+
+def _same_value(a, b):
+	# equality of classes where NaN (no sunset, outside of the map) is a class of its own
+	return (a == b) | (np.isnan(a) & np.isnan(b))
+
+
+def refine_map(classify, min_lat=-60.0, max_lat=70.0, min_long=-180.0, max_long=180.0, step=0.25, coarse_step=4.0):
+	""" Map of a classification (e.g. a visibility criterion) refined only where the class changes.
+
+	The nodes of the global grid with the given step are first classified every coarse_step degree
+	(rounded down to a power of two times step). Every square whose corners, or the nodes already known on
+	its edges, disagree is split in four and its new nodes are classified, down to step. The other squares
+	take the class of their corners. The result is the same as classifying every node, as long as no region
+	of a class fits inside a coarse square without touching its edges, at a fraction of the cost.
+
+	:param classify:
+		Function of arrays of latitudes and longitudes (degree) returning the class of every site as floats,
+		NaN included.
+
+	:returns:
+		Class of every node of the global grid of shape (180/step+1, 360/step+1), from -90 to 90 degree of
+		latitude and -180 to 180 of longitude, NaN outside of the min/max box, and the number of nodes classified.
+	"""
+	nlat, nlong = int(round(180.0/step)), int(round(360.0/step))
+	stride = 1
+	while stride*2*step <= coarse_step:
+		stride *= 2
+
+	# node indices of the box, widened to whole coarse squares
+	i0, i1 = int(np.floor((min_lat + 90.0)/step)), int(np.ceil((max_lat + 90.0)/step))
+	j0, j1 = int(np.floor((min_long + 180.0)/step)), int(np.ceil((max_long + 180.0)/step))
+	i0, j0 = i0 - i0 % stride, j0 - j0 % stride
+	i1, j1 = i0 + stride*int(np.ceil((i1 - i0)/stride)), j0 + stride*int(np.ceil((j1 - j0)/stride))
+
+	values = np.full((i1 - i0 + 1, j1 - j0 + 1), float('nan'))
+	known = np.zeros(values.shape, dtype=bool)
+
+	def evaluate(ii, jj):
+		# classify the nodes (ii, jj) of the working grid that are not known yet
+		new = ~known[ii, jj]
+		ii, jj = ii[new], jj[new]
+		if len(ii) > 0:
+			lat = np.clip(-90.0 + (i0 + ii)*step, -90.0, 90.0)
+			lon = np.clip(-180.0 + (j0 + jj)*step, -180.0, 180.0)
+			values[ii, jj] = classify(lat, lon)
+			known[ii, jj] = True
+		return len(ii)
+
+	ci, cj = np.meshgrid(np.arange(0, i1 - i0 + 1, stride), np.arange(0, j1 - j0 + 1, stride), indexing='ij')
+	nevaluated = evaluate(ci.ravel(), cj.ravel())
+	ci, cj = np.meshgrid(np.arange(0, i1 - i0, stride), np.arange(0, j1 - j0, stride), indexing='ij')
+	ci, cj = ci.ravel(), cj.ravel()
+	uniform = []
+
+	while True:
+		corner = values[ci, cj]
+		mixed = ~(_same_value(corner, values[ci+stride, cj]) & _same_value(corner, values[ci, cj+stride]) & _same_value(corner, values[ci+stride, cj+stride]))
+
+		if stride > 1:
+			half = stride//2
+			# split the mixed squares, and again any square that a split shows to have a different node on its edges
+			while True:
+				ii, jj = ci[mixed], cj[mixed]
+				nevaluated += evaluate(np.concatenate([ii+half, ii, ii+half, ii+stride, ii+half]), np.concatenate([jj, jj+half, jj+half, jj+half, jj+stride]))
+				edges = [(ci+half, cj), (ci, cj+half), (ci+stride, cj+half), (ci+half, cj+stride)]
+				disagree = np.zeros(len(ci), dtype=bool)
+				for ii, jj in edges:
+					disagree |= known[ii, jj] & ~_same_value(values[ii, jj], corner)
+				if not (disagree & ~mixed).any():
+					break
+				mixed |= disagree
+
+		uniform.extend(zip(ci[~mixed], cj[~mixed], [stride]*int((~mixed).sum()), corner[~mixed]))
+		if stride == 1:
+			break
+		ci, cj = ci[mixed], cj[mixed]
+		ci = np.concatenate([ci, ci+half, ci, ci+half])
+		cj = np.concatenate([cj, cj, cj+half, cj+half])
+		stride = half
+
+	# the squares that were not split take the class of their corners, where their nodes were not classified
+	filled = known.copy()
+	for i, j, size, value in uniform:
+		block = values[i:i+size+1, j:j+size+1]
+		block[~filled[i:i+size+1, j:j+size+1]] = value
+		filled[i:i+size+1, j:j+size+1] = True
+
+	# back to the global grid, NaN outside of the box as in map_grid()
+	map_data = np.full((nlat + 1, nlong + 1), float('nan'))
+	lat = -90.0 + np.arange(nlat + 1)*step
+	lon = -180.0 + np.arange(nlong + 1)*step
+	inside = ((lat >= min_lat) & (lat <= max_lat))[:,None] & ((lon >= min_long) & (lon <= max_long))[None,:]
+	rows = np.arange(nlat + 1) - i0
+	cols = np.arange(nlong + 1) - j0
+	rows_in = (rows >= 0) & (rows < values.shape[0])
+	cols_in = (cols >= 0) & (cols < values.shape[1])
+	map_data[np.ix_(rows_in, cols_in)] = values[np.ix_(rows[rows_in], cols[cols_in])]
+	map_data[~inside] = float('nan')
+
+	return map_data, nevaluated
+
+
+def _link_crossings(lat, lon, direction, row_step, max_jump, min_lat, max_lat):
+	# chain the crossings of consecutive rows into polylines: every crossing continues the nearest line of the
+	# previous row crossing in the same direction, otherwise it starts a new line
+	lines, open_lines = [], []
+	for row_lat in np.unique(lat):
+		row = np.flatnonzero(lat == row_lat)
+		still_open = []
+		for k in row[np.argsort(lon[row])]:
+			candidates = [line for line in open_lines if line['direction'] == direction[k] and line not in still_open
+							and abs(line['points'][-1][1] - row_lat) <= 1.5*row_step and abs(line['points'][-1][0] - lon[k]) <= max_jump]
+			if candidates:
+				line = min(candidates, key=lambda line: abs(line['points'][-1][0] - lon[k]))
+			else:
+				line = {'direction': direction[k], 'points': []}
+				lines.append(line)
+			line['points'].append((lon[k], row_lat))
+			still_open.append(line)
+		open_lines = still_open
+
+	# a curve that turns back in latitude shows up as two lines of opposite directions ending on the same row,
+	# which is not the first or last row of the map where the lines are only cut
+	joined = True
+	while joined:
+		joined = False
+		for a in lines:
+			for b in lines:
+				if a is b or a['direction'] == b['direction']:
+					continue
+				for a_end, b_end in ((-1, -1), (0, 0)):
+					pa, pb = a['points'][a_end], b['points'][b_end]
+					if abs(pa[1] - pb[1]) <= 0.5*row_step and abs(pa[0] - pb[0]) <= max_jump and min_lat + 0.5*row_step < pa[1] < max_lat - 0.5*row_step:
+						a['points'] = a['points'] + b['points'][::-1] if a_end == -1 else b['points'][::-1] + a['points']
+						a['direction'] = 0
+						lines.remove(b)
+						joined = True
+						break
+				if joined:
+					break
+			if joined:
+				break
+
+	return [np.array(line['points']) for line in lines]
+
+
+def trace_curves(margin, min_lat=-60.0, max_lat=70.0, min_long=-180.0, max_long=180.0, row_step=0.5, sample_step=4.0, tolerance_degrees=0.01,
+				max_iterations=40, max_jump_degrees=60.0):
+	""" Curves along which margin(lat, lon) changes sign, e.g. the limit of a visibility criterion.
+
+	Every latitude row (every row_step degree) is sampled every sample_step degree of longitude, and every
+	sign change between two samples is solved for its longitude with the Illinois variant of regula falsi,
+	all rows together, as in prayertimes.sun_altitude_crossing_tt(). Samples where the margin is NaN (e.g.
+	no sunset) are not crossed. Two crossings closer than sample_step in a row may be missed. The crossings
+	of consecutive rows are chained into lines when they are less than max_jump_degrees of longitude
+	apart; curves running nearly east-west move a long way from one row to the next.
+
+	:param margin:
+		Function of arrays of latitudes and longitudes (degree) returning an array, positive on one side
+		of the curve and negative on the other.
+
+	:returns:
+		List of polylines, each an array of (longitude, latitude) points in degree.
+	"""
+	lat = np.arange(min_lat, max_lat + 0.5*row_step, row_step)
+	lon = np.linspace(min_long, max_long, int(np.ceil((max_long - min_long)/sample_step)) + 1)
+	grid_lat, grid_long = np.meshgrid(lat, lon, indexing='ij')
+	values = np.asarray(margin(grid_lat.ravel(), grid_long.ravel()), dtype=float).reshape(grid_lat.shape)
+
+	# brackets between consecutive samples with a change of sign
+	fa, fb = values[:,:-1], values[:,1:]
+	rows, cols = np.nonzero(np.isfinite(fa) & np.isfinite(fb) & ((fa > 0) != (fb > 0)))
+	if len(rows) == 0:
+		return []
+	row_lat = lat[rows]
+	a, b = lon[cols].copy(), lon[cols+1].copy()
+	fa, fb = fa[rows, cols].copy(), fb[rows, cols].copy()
+	direction = np.where(fb > fa, 1, -1)
+	crossing = np.full(len(a), float('nan'))
+
+	active = np.arange(len(a))
+	for ii in range(max_iterations):
+		if len(active) == 0:
+			break
+		a1, b1, fa1, fb1 = a[active], b[active], fa[active], fb[active]
+		c = (a1*fb1 - b1*fa1)/(fb1 - fa1)
+		fc = np.asarray(margin(row_lat[active], c), dtype=float)
+
+		# Illinois step, the new point replaces the end point on its side and the value of the kept end point is halved
+		same_side = (fc > 0) == (fa1 > 0)
+		a[active] = np.where(same_side, c, a1)
+		fa[active] = np.where(same_side, fc, 0.5*fa1)
+		b[active] = np.where(same_side, b1, c)
+		fb[active] = np.where(same_side, 0.5*fb1, fc)
+
+		done = (np.abs(b[active] - a[active]) <= tolerance_degrees) | (fc == 0) | ~np.isfinite(fc)
+		crossing[active[done]] = np.where(np.isfinite(fc[done]), c[done], float('nan'))
+		active = active[~done]
+
+	found = np.isfinite(crossing)
+	return _link_crossings(row_lat[found], crossing[found], direction[found], row_step, max_jump_degrees, lat[0], lat[-1])
+
+
+def curves_geojson(curves, properties=None):
+	""" GeoJSON FeatureCollection (a dictionary, for json.dump) of the polylines of trace_curves().
+
+	:param curves:
+		List of polylines, or dictionary of lists of polylines whose keys go into the 'level' property.
+	"""
+	if not isinstance(curves, dict):
+		curves = {None: curves}
+
+	features = []
+	for level, polylines in curves.items():
+		for polyline in polylines:
+			feature_properties = dict(properties or {})
+			if level is not None:
+				feature_properties['level'] = level
+			features.append({'type': 'Feature', 'properties': feature_properties,
+							'geometry': {'type': 'LineString', 'coordinates': [[float(x), float(y)] for x, y in polyline]}})
+
+	return {'type': 'FeatureCollection', 'features': features}
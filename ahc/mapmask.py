@@ -0,0 +1,106 @@
+import numpy as np
+
+from .mapengine import map_grid
+
+__all__ = ["MABIMS_COUNTRIES", "region_geometry", "region_mask", "map_mask"]
+
+# Member countries of MABIMS, region="MABIMS"
+MABIMS_COUNTRIES = ('Brunei', 'Indonesia', 'Malaysia', 'Singapore')
+
+# Natural Earth countries, read on first use, and the rasters already computed, keyed by region, factor and buffer
+global _countries
+_countries = None
+_masks = {}
+
+
+def _natural_earth_countries():
+	# the same dataset as the maps of plotting.py, see setup.py
+	global _countries
+	if _countries is None:
+		import geopandas
+		_countries = geopandas.read_file(geopandas.datasets.get_path('naturalearth_lowres'))
+		_countries.columns = [name.lower() for name in _countries.columns]
+	return _countries
+
+
+def region_geometry(region="land"):
+	""" Shapely geometry of a region, longitude and latitude in degree.
+
+	:param region:
+		"land" for the land of the whole world, "MABIMS" for the MABIMS member countries, a country
+		name or ISO 3166 alpha-3 code (e.g. "Malaysia" or "MYS") or a list of them, a list of
+		(longitude, latitude) vertices of a polygon, or a shapely geometry which is returned as is.
+	"""
+	import shapely
+
+	if isinstance(region, shapely.Geometry):
+		return region
+	if isinstance(region, str):
+		if region.lower() == 'land':
+			return shapely.union_all(_natural_earth_countries().geometry.values)
+		if region.upper() == 'MABIMS':
+			# Singapore is too small for the 1:110m Natural Earth countries, its cells are those of Johor
+			region = [name for name in MABIMS_COUNTRIES if name != 'Singapore']
+		else:
+			region = [region]
+
+	if not all(isinstance(name, str) for name in region):
+		return shapely.Polygon(region)
+
+	countries = _natural_earth_countries()
+	names = [name.lower() for name in region]
+	selected = countries['name'].str.lower().isin(names) | countries['iso_a3'].str.lower().isin(names)
+	known = set(countries['name'].str.lower()[selected]) | set(countries['iso_a3'].str.lower()[selected])
+	unknown = [name for name in region if name.lower() not in known]
+	if len(unknown) > 0:
+		raise ValueError("Unknown countries %s, see the 'name' and 'iso_a3' columns of the Natural Earth countries" % ', '.join(unknown))
+	return shapely.union_all(countries.geometry[selected].values)
+
+
+def region_mask(region="land", factor=0.5, buffer_degrees=0.0):
+	""" Boolean raster of the map grid (see mapengine.map_grid) that is True for every cell touching the region.
+
+	A cell is kept when any part of it overlaps the region, so coasts and small islands are not lost
+	at coarse resolutions. buffer_degrees widens the region, e.g. to keep the sea off a coast.
+	Rasters of named regions are kept for the rest of the session.
+
+	:param region:
+		See region_geometry().
+	"""
+	import shapely
+
+	key = None
+	if isinstance(region, str) or (isinstance(region, (list, tuple)) and all(isinstance(name, str) for name in region)):
+		key = (region if isinstance(region, str) else tuple(region), factor, buffer_degrees)
+		if key in _masks:
+			return _masks[key].copy()
+
+	geometry = region_geometry(region)
+	if buffer_degrees > 0.0:
+		geometry = geometry.buffer(buffer_degrees)
+	shapely.prepare(geometry)
+
+	map_lat, map_long, map_inside = map_grid(factor=factor)
+	half_lat = 0.5*(map_lat[1,0] - map_lat[0,0])
+	half_long = 0.5*(map_long[0,1] - map_long[0,0])
+	lat, lon = map_lat[:-1,:-1], map_long[:-1,:-1]
+
+	mask = np.zeros(map_lat.shape, dtype=bool)
+	mask[:-1,:-1] = shapely.intersects(geometry, shapely.box(lon - half_long, lat - half_lat, lon + half_long, lat + half_lat))
+
+	if key is not None:
+		_masks[key] = mask.copy()
+	return mask
+
+
+def map_mask(mask, factor=0.5):
+	""" The mask= argument of the map functions as a raster: None stays None, a boolean array of the
+	grid shape is used as is, anything else is a region, see region_mask(). """
+	if mask is None:
+		return None
+	if isinstance(mask, np.ndarray) and mask.dtype == bool:
+		shape = map_grid(factor=factor)[0].shape
+		if mask.shape != shape:
+			raise ValueError("The mask has shape %s, the map grid with factor=%g has shape %s" % (mask.shape, factor, shape))
+		return mask
+	return region_mask(mask, factor=factor)
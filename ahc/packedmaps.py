@@ -0,0 +1,196 @@
+import numpy as np
+
+from .criteria import VISIBILITY_RULES
+
+__all__ = ["visibility_bit_layout", "packed_layout", "pack_visibility_maps", "unpack_visibility_maps", "save_packed_visibility", "load_packed_visibility"]
+
+# Bit of the packed rasters that is set where the cell is computed (the zone maps are not NaN)
+VALID_BIT = 0
+
+
+def visibility_bit_layout(criteria=None):
+	""" Bits of every criterion in the packed rasters, after the validity bit.
+
+	A criterion stores the index of its zone among its sorted zone values, on as many bits as needed:
+	one for the visible/not visible criteria, two for the zones 1 to 4 of Odeh, so that all the
+	criteria of VISIBILITY_RULES fit in one uint8.
+
+	:param criteria:
+		Names of the criteria, in this order, all of VISIBILITY_RULES by default.
+
+	:returns:
+		List of (criterion, shift, width, zone values).
+	"""
+	criteria = list(VISIBILITY_RULES) if criteria is None else list(criteria)
+	layout = []
+	shift = VALID_BIT + 1
+	for criterion in criteria:
+		rule = VISIBILITY_RULES[criterion]
+		zones = tuple(sorted(set([zone[1] for zone in rule['zones']] + [rule['default']])))
+		width = max(1, int(np.ceil(np.log2(len(zones)))))
+		layout.append((criterion, shift, width, zones))
+		shift += width
+	return layout
+
+
+def packed_layout(criteria, layout=None):
+	""" The entries of layout (visibility_bit_layout() by default) of the criteria that were packed, with their
+	bits unchanged. This is the layout to unpack and save a raster of pack_visibility_maps() with when it holds
+	only some of the criteria: the bits of the others are zero and would unpack to their first zone.
+
+	:param criteria:
+		Names of the packed criteria, or the dictionary of maps that was packed.
+	"""
+	layout = visibility_bit_layout() if layout is None else layout
+	return [layout_item for layout_item in layout if layout_item[0] in criteria]
+
+
+def _packed_dtype(layout):
+	nbits = max([shift + width for criterion, shift, width, zones in layout] + [VALID_BIT + 1])
+	for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+		if nbits <= 8*np.dtype(dtype).itemsize:
+			return dtype
+	raise ValueError("The criteria need %d bits, more than 64" % nbits)
+
+
+def pack_visibility_maps(maps, layout=None):
+	""" Pack the zone maps of several criteria into one unsigned integer raster, see visibility_bit_layout().
+
+	:param maps:
+		Dictionary of zone maps by criterion, e.g. from hilal.calc_maps_visibility(), of any shape (e.g. a
+		stack of days). The maps must be NaN on the same cells, which get the validity bit unset.
+
+	:param layout:
+		Bit layout, visibility_bit_layout() of all the criteria by default, so that every criterion has the
+		same bits whichever maps are packed. The bits of the criteria of layout missing from maps are left
+		at zero, unpack and save the raster with packed_layout(maps).
+	"""
+	layout = visibility_bit_layout() if layout is None else layout
+	dtype = _packed_dtype(layout)
+	unknown = [criterion for criterion in maps if criterion not in [layout_item[0] for layout_item in layout]]
+	if len(unknown) > 0:
+		raise ValueError("The criteria %s have no bits in the layout" % ', '.join(unknown))
+
+	valid = None
+	packed = None
+	for criterion, shift, width, zones in layout:
+		if criterion not in maps:
+			continue
+		map_data = np.asarray(maps[criterion], dtype=float)
+		finite = np.isfinite(map_data)
+		if valid is None:
+			valid = finite
+			packed = np.zeros(map_data.shape, dtype=dtype)
+		elif not np.array_equal(finite, valid):
+			raise ValueError("The map of %s is NaN on other cells than the other criteria, one validity bit cannot hold them" % criterion)
+		zone_values = np.asarray(zones, dtype=float)
+		codes = np.searchsorted(zone_values, map_data[finite])
+		if np.any(zone_values[np.minimum(codes, len(zones)-1)] != map_data[finite]):
+			raise ValueError("The map of %s has values other than its zones %s" % (criterion, ', '.join('%g' % zone for zone in zones)))
+		packed[finite] |= (codes.astype(dtype) << dtype(shift))
+	if packed is None:
+		raise ValueError("No map of a criterion of the layout to pack")
+	packed[valid] |= dtype(1 << VALID_BIT)
+	return packed
+
+
+def unpack_visibility_maps(packed, layout=None, criteria=None):
+	""" Zone maps from a packed raster, as float arrays with NaN on the cells not computed, like the calc_map
+	functions of hilal.py.
+
+	:param layout:
+		Layout of the criteria held by the raster, e.g. packed_layout(maps) or the layout of load_packed_visibility(),
+		visibility_bit_layout() of all the criteria by default as in pack_visibility_maps().
+
+	:param criteria:
+		Criteria to unpack among those of layout, all of them by default.
+	"""
+	layout = visibility_bit_layout() if layout is None else layout
+	if criteria is not None:
+		unknown = [criterion for criterion in criteria if criterion not in [layout_item[0] for layout_item in layout]]
+		if len(unknown) > 0:
+			raise ValueError("The criteria %s have no bits in the layout" % ', '.join(unknown))
+		layout = [layout_item for layout_item in layout if layout_item[0] in criteria]
+	packed = np.asarray(packed)
+	valid = (packed >> VALID_BIT) & 1 == 1
+
+	maps = {}
+	for criterion, shift, width, zones in layout:
+		codes = (packed >> shift) & ((1 << width) - 1)
+		map_data = np.asarray(zones, dtype=float)[np.minimum(codes, len(zones)-1)]
+		map_data[~valid] = float('nan')
+		maps[criterion] = map_data
+	return maps
+
+
+def save_packed_visibility(path, packed, layout=None, header=None):
+	""" Write a packed raster with its bit layout, as .npz (compressed) or as FITS (.fits, .fit, .fts), so the
+	file can be unpacked without this package's rules. layout holds the criteria of the raster, e.g.
+	packed_layout(maps) when only some were packed: the file keeps the bits of every criterion of
+	visibility_bit_layout() with a flag telling whether it was packed. header is an optional dictionary of
+	extra values, e.g. the date, kept as FITS header cards or as entries of the .npz. """
+	layout = visibility_bit_layout() if layout is None else layout
+	header = {} if header is None else header
+	full_layout = visibility_bit_layout()
+	if all(layout_item in full_layout for layout_item in layout):
+		present = [layout_item in layout for layout_item in full_layout]
+		layout = full_layout
+	else:
+		# a layout of its own, e.g. visibility_bit_layout(['Odeh']), only holds packed criteria
+		present = [True]*len(layout)
+	names = [criterion for criterion, shift, width, zones in layout]
+	zones = [','.join('%g' % zone for zone in layout_zones) for criterion, shift, width, layout_zones in layout]
+
+	if path.lower().endswith(('.fits', '.fit', '.fts')):
+		from astropy.io import fits
+
+		hdr = fits.Header()
+		hdr['validbit'] = VALID_BIT
+		hdr['ncrit'] = len(layout)
+		for ii, (criterion, shift, width, layout_zones) in enumerate(layout):
+			hdr['crit%d' % ii] = criterion
+			hdr['shift%d' % ii] = shift
+			hdr['width%d' % ii] = width
+			hdr['zones%d' % ii] = zones[ii]
+			hdr['packed%d' % ii] = present[ii]
+		for key, value in header.items():
+			hdr[key] = value
+		fits.PrimaryHDU(data=packed, header=hdr).writeto(path, overwrite=True)
+	else:
+		np.savez_compressed(path, packed=packed, criteria=np.array(names), shifts=np.array([layout_item[1] for layout_item in layout]),
+							widths=np.array([layout_item[2] for layout_item in layout]), zones=np.array(zones), present=np.array(present, dtype=bool),
+							valid_bit=VALID_BIT, header_keys=np.array(list(header.keys()), dtype=str),
+							header_values=np.array([str(value) for value in header.values()], dtype=str))
+
+
+def load_packed_visibility(path):
+	""" Read a file of save_packed_visibility().
+
+	:returns:
+		The packed raster, the bit layout of the criteria it holds (see packed_layout()) and the extra header
+		values (as strings for .npz files).
+	"""
+	if path.lower().endswith(('.fits', '.fit', '.fts')):
+		from astropy.io import fits
+
+		with fits.open(path) as hdul:
+			hdr = hdul[0].header
+			packed = hdul[0].data.copy()
+			layout = []
+			present = []
+			for ii in range(hdr['ncrit']):
+				layout.append((hdr['crit%d' % ii], hdr['shift%d' % ii], hdr['width%d' % ii], tuple(float(zone) for zone in hdr['zones%d' % ii].split(','))))
+				present.append(bool(hdr.get('packed%d' % ii, True)))
+			layout_keys = set(['VALIDBIT', 'NCRIT'] + ['%s%d' % (key, ii) for ii in range(len(layout)) for key in ('CRIT', 'SHIFT', 'WIDTH', 'ZONES', 'PACKED')])
+			header = {key.lower(): hdr[key] for key in hdr if key not in layout_keys and key not in ('SIMPLE', 'BITPIX', 'EXTEND', 'BZERO', 'BSCALE')
+						and not key.startswith('NAXIS')}
+	else:
+		with np.load(path) as data:
+			packed = data['packed']
+			layout = [(str(criterion), int(shift), int(width), tuple(float(zone) for zone in str(zones).split(',')))
+						for criterion, shift, width, zones in zip(data['criteria'], data['shifts'], data['widths'], data['zones'])]
+			# files written before the flags hold every criterion of their layout
+			present = [bool(flag) for flag in data['present']] if 'present' in data.files else [True]*len(layout)
+			header = dict(zip([str(key) for key in data['header_keys']], [str(value) for value in data['header_values']]))
+	layout = [layout_item for layout_item, flag in zip(layout, present) if flag]
+	return packed, layout, header
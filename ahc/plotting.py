@@ -15,6 +15,17 @@ __all__ = ["plot_map_moon_alt", "plot_map_moon_arcv", "plot_map_moon_elong", "pl
 			"plot_visibility_map_danjon", "plot_visibility_map_IQG"]
 
 
+def _plot_curves(ax, curves):
+	# visibility curves of hilal.calc_visibility_curves() on top of a map, one line style per level
+	if curves is None:
+		return
+	if not isinstance(curves, dict):
+		curves = {None: curves}
+	for linestyle, polylines in zip(['-', '--', ':', '-.'], curves.values()):
+		for polyline in polylines:
+			ax.plot(polyline[:,0], polyline[:,1], color='black', linestyle=linestyle, linewidth=1.5, zorder=2)
+
+
 def plot_map_moon_alt(map_moon_alt, hijri_year, hijri_month, yy, mm, dd):
 	hijri_months = list_hijri_months()
 
@@ -258,7 +269,7 @@ def plot_map_moon_age_utc_localsunset(map_moon_age_utc0, hijri_year, hijri_month
 	plt.savefig(name_plot)
 
 
-def plot_visibility_map_odeh(data_map, hijri_year, hijri_month, yy, mm, dd):
+def plot_visibility_map_odeh(data_map, hijri_year, hijri_month, yy, mm, dd, curves=None):
 	from matplotlib.colors import ListedColormap
 
 	hijri_months = list_hijri_months()
@@ -313,13 +324,15 @@ def plot_visibility_map_odeh(data_map, hijri_year, hijri_month, yy, mm, dd):
 	ax.text(0.9, 0.05, "Not visible", horizontalalignment='left', fontweight='bold', 
 				verticalalignment='center', transform = ax.transAxes, fontsize=11, color=cmap(3))
 
+	_plot_curves(ax, curves)
+
 	plt.subplots_adjust(left=0.05, right=0.95, bottom=0.05, top=0.9)
 
 	name_plot = 'map_odeh_%s_%d_%d%d%d.png' % (hijri_months[int(hijri_month)-1],hijri_year,dd,mm,yy)
 	plt.savefig(name_plot)
 
 
-def plot_visibility_map_mabims(data_map, hijri_year, hijri_month, yy, mm, dd):
+def plot_visibility_map_mabims(data_map, hijri_year, hijri_month, yy, mm, dd, curves=None):
 	from matplotlib.colors import ListedColormap
 
 	hijri_months = list_hijri_months()
@@ -361,13 +374,15 @@ def plot_visibility_map_mabims(data_map, hijri_year, hijri_month, yy, mm, dd):
 	ax.text(0.9, 0.045, "Not visible", horizontalalignment='left', fontweight='bold', 
 				verticalalignment='center', transform = ax.transAxes, fontsize=11, color="red")
 
+	_plot_curves(ax, curves)
+
 	plt.subplots_adjust(left=0.05, right=0.95, bottom=0.05, top=0.9)
 
 	name_plot = 'map_mabims_%s_%d_%d%d%d.png' % (hijri_months[int(hijri_month)-1],hijri_year,dd,mm,yy)
 	plt.savefig(name_plot)
 
 
-def plot_visibility_map_wujudul_hilal(data_map, hijri_year, hijri_month, yy, mm, dd):
+def plot_visibility_map_wujudul_hilal(data_map, hijri_year, hijri_month, yy, mm, dd, curves=None):
 	from matplotlib.colors import ListedColormap
 
 	hijri_months = list_hijri_months()
@@ -409,13 +424,15 @@ def plot_visibility_map_wujudul_hilal(data_map, hijri_year, hijri_month, yy, mm,
 	ax.text(0.9, 0.045, "Not qualified", horizontalalignment='left', fontweight='bold', 
 				verticalalignment='center', transform = ax.transAxes, fontsize=11, color="red")
 
+	_plot_curves(ax, curves)
+
 	plt.subplots_adjust(left=0.05, right=0.95, bottom=0.05, top=0.9)
 
 	name_plot = 'map_wh_%s_%d_%d%d%d.png' % (hijri_months[int(hijri_month)-1],hijri_year,dd,mm,yy)
 	plt.savefig(name_plot)
 
 
-def plot_visibility_map_turkey(data_map, hijri_year, hijri_month, yy, mm, dd, map_utc_midnight, fajr_utc_NZ, ijtima_utc):
+def plot_visibility_map_turkey(data_map, hijri_year, hijri_month, yy, mm, dd, map_utc_midnight, fajr_utc_NZ, ijtima_utc, curves=None):
 	from matplotlib.colors import ListedColormap
 
 	hijri_months = list_hijri_months()
@@ -467,13 +484,15 @@ def plot_visibility_map_turkey(data_map, hijri_year, hijri_month, yy, mm, dd, ma
 	ax.text(0.9, 0.045, "Not visible", horizontalalignment='left', fontweight='bold', 
 				verticalalignment='center', transform = ax.transAxes, fontsize=11, color="red")
 
+	_plot_curves(ax, curves)
+
 	plt.subplots_adjust(left=0.05, right=0.95, bottom=0.05, top=0.9)
 
 	name_plot = 'map_turkey_%s_%d_%d%d%d.png' % (hijri_months[int(hijri_month)-1],hijri_year,dd,mm,yy)
 	plt.savefig(name_plot)
 
 
-def plot_visibility_map_danjon(data_map, hijri_year, hijri_month, yy, mm, dd):
+def plot_visibility_map_danjon(data_map, hijri_year, hijri_month, yy, mm, dd, curves=None):
 	from matplotlib.colors import ListedColormap
 
 	hijri_months = list_hijri_months()
@@ -515,12 +534,14 @@ def plot_visibility_map_danjon(data_map, hijri_year, hijri_month, yy, mm, dd):
 	ax.text(0.9, 0.045, "Not visible", horizontalalignment='left', fontweight='bold', 
 				verticalalignment='center', transform = ax.transAxes, fontsize=11, color="red")
 
+	_plot_curves(ax, curves)
+
 	plt.subplots_adjust(left=0.05, right=0.95, bottom=0.05, top=0.9)
 
 	name_plot = 'map_danjon_%s_%d_%d%d%d.png' % (hijri_months[int(hijri_month)-1],hijri_year,dd,mm,yy)
 	plt.savefig(name_plot)
 
-def plot_visibility_map_IQG(data_map, hijri_year, hijri_month, yy, mm, dd):
+def plot_visibility_map_IQG(data_map, hijri_year, hijri_month, yy, mm, dd, curves=None):
 	from matplotlib.colors import ListedColormap
 
 	hijri_months = list_hijri_months()
@@ -562,6 +583,8 @@ def plot_visibility_map_IQG(data_map, hijri_year, hijri_month, yy, mm, dd):
 	ax.text(0.9, 0.045, "Not qualified", horizontalalignment='left', fontweight='bold', 
 				verticalalignment='center', transform = ax.transAxes, fontsize=11, color="red")
 
+	_plot_curves(ax, curves)
+
 	plt.subplots_adjust(left=0.05, right=0.95, bottom=0.05, top=0.9)
 
 	name_plot = 'map_IQG_%s_%d_%d%d%d.png' % (hijri_months[int(hijri_month)-1],hijri_year,dd,mm,yy)
@@ -0,0 +1,222 @@
+import numpy as np
+from datetime import datetime
+from datetime import timedelta
+from pytz import timezone
+
+from .sunmoon import *
+from .resultcache import cached_result
+from .fastephem import precision_engine
+from .ephemtable import horizon_coordinates
+
+__all__ = ["sun_altitude_time_utc", "solar_transit_tt", "sun_altitude_crossing_tt", "prayer_times_tt", "prayer_times_utc",
+			"prayer_names", "solar_event_names", "solar_events_range", "tt_to_utc_datetimes"]
+
+# Ephemeris data is shared by the whole package and loaded on first use
+from .ephemeris import ts, ephem
+
+# Earth's rotation rate relative to the mean Sun, in degree per day
+EARTH_ROTATION_DEG_PER_DAY = 360.9856235
+
+# Half of a solar day: the Sun goes from transit to anti-transit in this time
+HALF_DAY = 0.5
+
+
+def prayer_names():
+	return ['fajr', 'sunrise', 'dhuhr', 'asr', 'sunset', 'maghrib', 'isha']
+
+
+def solar_event_names():
+	# same events as prayer_names() but the meridian transit is called by its astronomical name
+	return ['fajr', 'sunrise', 'transit', 'asr', 'sunset', 'maghrib', 'isha']
+
+
+def _sun_terrestrial(engine, location, jd_tt):
+	# topocentric Sun in the terrestrial frame from a fast_sun_moon engine
+	return engine.topocentric('Sun', jd_tt, as_observer(location).topos.itrs_xyz.km)
+
+
+def sun_altitude_time_utc(location, jd_tt, precision="kernel"):
+	""" Apparent altitude of the Sun, without refraction, for an array of TT Julian dates. """
+	engine = precision_engine(precision)
+	if engine is not None:
+		site = as_observer(location)
+		return horizon_coordinates(_sun_terrestrial(engine, site, jd_tt), site.latitude.degrees, site.longitude.degrees)[0]
+
+	sun_pos = as_observer(location).vector.at(ts.tt_jd(jd_tt)).observe(ephem['Sun']).apparent()
+	altitude, azimuth, distance = sun_pos.altaz()
+	return altitude.degrees
+
+
+def solar_transit_tt(location, jd_guess, tolerance_seconds=0.1, max_iterations=10, precision="kernel"):
+	""" Meridian transit of the Sun nearest to every guess, solved with Newton steps on the hour angle. """
+	jd = np.array(jd_guess, dtype=float, ndmin=1)
+	longitude = location.longitude.degrees
+	engine = precision_engine(precision)
+
+	active = np.arange(len(jd))
+	for ii in range(max_iterations):
+		if len(active) == 0:
+			break
+		if engine is None:
+			t = ts.tt_jd(jd[active])
+			ra, dec, distance = as_observer(location).vector.at(t).observe(ephem['Sun']).apparent().radec(epoch='date')
+			hour_angle = ((t.gast - ra.hours)*15.0 + longitude + 180.0) % 360.0 - 180.0
+		else:
+			# the terrestrial longitude of the Sun gives the hour angle directly
+			v = _sun_terrestrial(engine, location, jd[active])
+			hour_angle = (longitude - np.degrees(np.arctan2(v[:,1], v[:,0])) + 180.0) % 360.0 - 180.0
+		step = hour_angle/EARTH_ROTATION_DEG_PER_DAY
+		jd[active] = jd[active] - step
+		active = active[np.abs(step)*86400.0 > tolerance_seconds]
+
+	return jd
+
+
+def sun_altitude_crossing_tt(location, jd_start, jd_end, altitude_degrees, tolerance_seconds=0.1, max_iterations=30, precision="kernel"):
+	""" Time at which the Sun crosses the given altitude inside every [jd_start, jd_end] bracket.
+
+	The altitude of the Sun has to be monotonic inside each bracket, which holds between a transit and
+	the next anti-transit (setting) or between an anti-transit and the next transit (rising). All brackets
+	are refined together with the Illinois variant of regula falsi, so each iteration is one vectorized
+	evaluation of the Sun position. Brackets that do not contain a crossing, e.g. when the Sun never goes
+	down to -18 degree at high latitude, give NaN instead of searching forever.
+	"""
+	a, b, target = np.broadcast_arrays(np.array(jd_start, dtype=float, ndmin=1), np.array(jd_end, dtype=float, ndmin=1), altitude_degrees)
+	a, b, target = a.copy(), b.copy(), target.astype(float)
+
+	fa = sun_altitude_time_utc(location, a, precision=precision) - target
+	fb = sun_altitude_time_utc(location, b, precision=precision) - target
+	crossing = np.full(len(a), float('nan'))
+
+	active = np.flatnonzero(np.sign(fa) != np.sign(fb))
+	for ii in range(max_iterations):
+		if len(active) == 0:
+			break
+		a1, b1, fa1, fb1 = a[active], b[active], fa[active], fb[active]
+		c = (a1*fb1 - b1*fa1)/(fb1 - fa1)
+		fc = sun_altitude_time_utc(location, c, precision=precision) - target[active]
+
+		# time error estimated from the local slope of the altitude
+		slope = np.abs((fb1 - fa1)/(b1 - a1))
+		done = np.abs(fc) <= slope*tolerance_seconds/86400.0
+		crossing[active[done]] = c[done]
+
+		# Illinois step: the new point replaces the end point on its side and the value of the kept end point is halved
+		same_side = np.sign(fc) == np.sign(fa1)
+		a[active] = np.where(same_side, c, a1)
+		fa[active] = np.where(same_side, fc, 0.5*fa1)
+		b[active] = np.where(same_side, b1, c)
+		fb[active] = np.where(same_side, 0.5*fb1, fc)
+
+		active = active[~done]
+
+	return crossing
+
+
+def prayer_times_tt(location, jd_noon, asr_method="shafi", fajr_sun_altitude=-18.0, isha_sun_altitude=-18.0, maghrib_sun_altitude=-1.066,
+					temperature_C=10.0, pressure_mbar=1030.0, radius_degrees=0.2665, tolerance_seconds=0.1, precision="kernel"):
+	""" Prayer times of the days whose local noon is close to jd_noon (array of TT Julian dates).
+
+	precision="fast" follows the Sun with the analytic series of fastephem.fast_sun_moon instead of the
+	kernel, e.g. for long exploratory tables; see fastephem.fast_precision_report() for the error in time.
+
+	:returns:
+		Dictionary of arrays of TT Julian dates with the keys given by prayer_names(), NaN when the event
+		does not happen on that day.
+	"""
+	location = as_observer(location)
+	dhuhr = solar_transit_tt(location, jd_noon, precision=precision)
+
+	# the Sun rises from the previous anti-transit up to the transit and sets from the transit to the next anti-transit
+	morning = dhuhr - HALF_DAY
+	evening = dhuhr + HALF_DAY
+
+	# same horizon as sunrise_sunset_utc(): dip of the horizon due to elevation plus refraction
+	horizon_degrees = location.horizon_degrees(temperature_C, pressure_mbar) - radius_degrees
+
+	# Asr starts when the shadow is as long as the object (Shafi) or twice as long (Hanafi) plus the shadow at noon
+	shadow_ratio = 1 if asr_method == "shafi" else 2
+	sun_alt_dhuhr = sun_altitude_time_utc(location, dhuhr, precision=precision)
+	asr_altitude = np.degrees(np.arctan(1/(shadow_ratio + np.tan(np.radians(90 - sun_alt_dhuhr)))))
+
+	times = {}
+	times['fajr'] = sun_altitude_crossing_tt(location, morning, dhuhr, fajr_sun_altitude, tolerance_seconds=tolerance_seconds, precision=precision)
+	times['sunrise'] = sun_altitude_crossing_tt(location, morning, dhuhr, horizon_degrees, tolerance_seconds=tolerance_seconds, precision=precision)
+	times['dhuhr'] = dhuhr
+	times['asr'] = sun_altitude_crossing_tt(location, dhuhr, evening, asr_altitude, tolerance_seconds=tolerance_seconds, precision=precision)
+	times['sunset'] = sun_altitude_crossing_tt(location, dhuhr, evening, horizon_degrees, tolerance_seconds=tolerance_seconds, precision=precision)
+	# Maghrib when the whole Sun is below the horizon (-1.066°) because of the Sun's apparent radius (~0.2665°) and refraction (~0.566°)
+	times['maghrib'] = sun_altitude_crossing_tt(location, dhuhr, evening, maghrib_sun_altitude, tolerance_seconds=tolerance_seconds, precision=precision)
+	times['isha'] = sun_altitude_crossing_tt(location, dhuhr, evening, isha_sun_altitude, tolerance_seconds=tolerance_seconds, precision=precision)
+
+	return times
+
+
+def tt_to_utc_datetimes(jd_tt):
+	""" Convert an array of TT Julian dates to a list of UTC datetimes, None where the date is NaN. """
+	jd_tt = np.array(jd_tt, dtype=float, ndmin=1)
+	utc_datetimes = [None]*len(jd_tt)
+	idx = np.flatnonzero(np.isfinite(jd_tt))
+	if len(idx) > 0:
+		for ii, utc_datetime in zip(idx, ts.tt_jd(jd_tt[idx]).utc_datetime()):
+			utc_datetimes[ii] = utc_datetime
+	return utc_datetimes
+
+
+def _noon_tt(location, dates, time_zone_str=None):
+	# civil noon of every date in the time zone, or local mean noon when there is no time zone
+	if time_zone_str is None:
+		return ts.utc([date.year for date in dates], [date.month for date in dates], [date.day for date in dates], 12).tt - location.longitude.degrees/360.0
+	time_zone = timezone(time_zone_str)
+	return ts.from_datetimes([time_zone.localize(datetime(date.year, date.month, date.day, 12)) for date in dates]).tt
+
+
+@cached_result
+def solar_events_range(location, start, end, time_zone_str=None, asr_method="shafi", fajr_sun_altitude=-18.0, isha_sun_altitude=-18.0,
+						maghrib_sun_altitude=-1.066, temperature_C=10.0, pressure_mbar=1030.0, precision="kernel"):
+	""" Solar events of every civil day from start to end (dates, both included).
+
+	Every event is solved once for the whole span, so a yearly timetable costs a few vectorized root
+	searches instead of one search per event and per day. Results are kept in the result cache.
+
+	:returns:
+		Dictionary with 'date', the list of dates, and for every name in solar_event_names() an array of UTC
+		datetimes aligned with it, None when the event does not happen on that day.
+	"""
+	ndays = (end - start).days + 1
+	dates = [start + timedelta(days=ii) for ii in range(ndays)]
+
+	times = prayer_times_tt(location, _noon_tt(location, dates, time_zone_str), asr_method=asr_method, fajr_sun_altitude=fajr_sun_altitude,
+							isha_sun_altitude=isha_sun_altitude, maghrib_sun_altitude=maghrib_sun_altitude, temperature_C=temperature_C,
+							pressure_mbar=pressure_mbar, precision=precision)
+	times['transit'] = times.pop('dhuhr')
+
+	events = {'date': dates}
+	for name in solar_event_names():
+		events[name] = np.array(tt_to_utc_datetimes(times[name]), dtype=object)
+
+	return events
+
+
+def prayer_times_utc(location, year, month, day, time_zone_str=None, ndays=1, asr_method="shafi", fajr_sun_altitude=-18.0, isha_sun_altitude=-18.0,
+					maghrib_sun_altitude=-1.066, temperature_C=10.0, pressure_mbar=1030.0, precision="kernel"):
+	""" Prayer times for ndays consecutive days starting at the given date, solved in one batch.
+
+	The day is the civil day in time_zone_str, or the local mean solar day of the location when no time
+	zone is given.
+
+	:returns:
+		Dictionary of lists of UTC datetimes (None when the event does not happen) with the keys given by prayer_names().
+	"""
+	start = datetime(year, month, day).date()
+	events = solar_events_range(location, start, start + timedelta(days=ndays - 1), time_zone_str, asr_method=asr_method,
+								fajr_sun_altitude=fajr_sun_altitude, isha_sun_altitude=isha_sun_altitude,
+								maghrib_sun_altitude=maghrib_sun_altitude, temperature_C=temperature_C, pressure_mbar=pressure_mbar,
+								precision=precision)
+	events['dhuhr'] = events['transit']
+
+	prayer_times = {}
+	for name in prayer_names():
+		prayer_times[name] = list(events[name])
+
+	return prayer_times
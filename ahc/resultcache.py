@@ -0,0 +1,187 @@
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import inspect
+import functools
+import numpy as np
+from datetime import date, datetime
+
+__all__ = ["cached_result", "set_cache_enabled", "cache_enabled", "clear_result_cache", "result_cache_path", "kernel_fingerprint", "code_fingerprint"]
+
+from .ephemeris import database_path, ephemeris_name
+
+# On-disk store of computed results, next to the kernels. Results are keyed by the function, its arguments,
+# the name and SHA-256 of the kernel and the SHA-256 of the sources of the package, so neither a new kernel
+# nor a new version of ahc returns results computed before.
+RESULT_CACHE_FILE = 'result_cache.sqlite'
+
+# Size of the stored results above which the least recently used ones are evicted
+RESULT_CACHE_MAX_BYTES = 64*1024*1024
+
+global _enabled, _connection, _fingerprint, _code_fingerprint
+_enabled = os.environ.get('AHC_NO_CACHE') is None
+_connection = None
+_fingerprint = None
+_code_fingerprint = None
+
+
+def result_cache_path():
+	return database_path(RESULT_CACHE_FILE)
+
+
+def set_cache_enabled(enabled=True):
+	""" Turn the result cache on or off for this process, e.g. for a --no-cache option. """
+	global _enabled
+	_enabled = enabled
+
+
+def cache_enabled():
+	return _enabled
+
+
+def _connect():
+	global _connection
+	if _connection is None:
+		connection = sqlite3.connect(result_cache_path(), timeout=10.0)
+		connection.execute("PRAGMA journal_mode=WAL")
+		connection.execute("PRAGMA synchronous=NORMAL")
+		connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_used REAL)")
+		connection.execute("CREATE TABLE IF NOT EXISTS kernels (name TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT)")
+		connection.commit()
+		_connection = connection
+	return _connection
+
+
+def kernel_fingerprint():
+	""" Name and SHA-256 of the kernel in use. The hash is stored with the file size and time, so the kernel is only read again when it changes. """
+	global _fingerprint
+	if _fingerprint is None:
+		name = ephemeris_name()
+		stat = os.stat(database_path(name))
+		connection = _connect()
+		row = connection.execute("SELECT sha256 FROM kernels WHERE name=? AND size=? AND mtime_ns=?", (name, stat.st_size, stat.st_mtime_ns)).fetchone()
+		if row is None:
+			sha256 = hashlib.sha256()
+			with open(database_path(name), 'rb') as f:
+				for chunk in iter(lambda: f.read(1 << 20), b''):
+					sha256.update(chunk)
+			row = (sha256.hexdigest(),)
+			connection.execute("INSERT OR REPLACE INTO kernels VALUES (?, ?, ?, ?)", (name, stat.st_size, stat.st_mtime_ns, row[0]))
+			connection.commit()
+		_fingerprint = (name, row[0])
+	return _fingerprint
+
+
+def code_fingerprint():
+	""" SHA-256 of the Python sources of the package, read once per process. """
+	global _code_fingerprint
+	if _code_fingerprint is None:
+		sha256 = hashlib.sha256()
+		package_dir = os.path.dirname(os.path.abspath(__file__))
+		for name in sorted(os.listdir(package_dir)):
+			if name.endswith('.py'):
+				sha256.update(name.encode())
+				with open(os.path.join(package_dir, name), 'rb') as f:
+					sha256.update(f.read())
+		_code_fingerprint = sha256.hexdigest()
+	return _code_fingerprint
+
+
+def _key_value(value):
+	# stable text for an argument: sites by their position, dates in ISO format, containers element by element
+	if hasattr(value, 'latitude') and hasattr(value, 'longitude') and hasattr(value, 'elevation'):
+		return ('site', repr(float(value.latitude.degrees)), repr(float(value.longitude.degrees)), repr(float(value.elevation.m)))
+	if isinstance(value, (datetime, date)):
+		return value.isoformat()
+	if isinstance(value, np.ndarray):
+		# the repr of a large array is cut with "...", its bytes are not
+		value = np.ascontiguousarray(value)
+		return ('ndarray', str(value.dtype), value.shape, hashlib.sha256(value.tobytes()).hexdigest())
+	if isinstance(value, (list, tuple)):
+		return tuple(_key_value(v) for v in value)
+	if isinstance(value, dict):
+		return tuple((k, _key_value(value[k])) for k in sorted(value))
+	if isinstance(value, float):
+		return repr(value)
+	return repr(value)
+
+
+def _evict(connection, max_bytes):
+	total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+	if total <= max_bytes:
+		return
+	keys = []
+	for key, size in connection.execute("SELECT key, size FROM results ORDER BY last_used"):
+		keys.append((key,))
+		total -= size
+		if total <= max_bytes:
+			break
+	connection.executemany("DELETE FROM results WHERE key=?", keys)
+
+
+def cached_result(func=None, version=0):
+	""" Keep the results of func on disk, see RESULT_CACHE_FILE. The cache is bypassed when it is turned off or cannot be used.
+
+	Used as @cached_result or @cached_result(version=1): a new version drops the results of func stored before,
+	e.g. when it depends on data outside the package.
+	"""
+	if func is None:
+		return functools.partial(cached_result, version=version)
+
+	signature = inspect.signature(func)
+	name = func.__module__ + '.' + func.__qualname__
+
+	@functools.wraps(func)
+	def wrapper(*args, **kwargs):
+		if not _enabled:
+			return func(*args, **kwargs)
+
+		try:
+			bound = signature.bind(*args, **kwargs)
+			bound.apply_defaults()
+			key = hashlib.sha256(repr((name, version, code_fingerprint(), kernel_fingerprint(), _key_value(bound.arguments))).encode()).hexdigest()
+
+			connection = _connect()
+			row = connection.execute("SELECT value FROM results WHERE key=?", (key,)).fetchone()
+			if row is not None:
+				try:
+					result = pickle.loads(row[0])
+				except Exception:
+					# a corrupt row, or one that the classes of this version cannot read: computed again below
+					connection.execute("DELETE FROM results WHERE key=?", (key,))
+					connection.commit()
+				else:
+					connection.execute("UPDATE results SET last_used=? WHERE key=?", (time.time(), key))
+					connection.commit()
+					return result
+		except (sqlite3.Error, OSError):
+			return func(*args, **kwargs)
+
+		result = func(*args, **kwargs)
+
+		try:
+			value = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+			connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (key, value, len(value), time.time()))
+			_evict(connection, RESULT_CACHE_MAX_BYTES)
+			connection.commit()
+		except (sqlite3.Error, OSError):
+			pass
+
+		return result
+
+	wrapper.uncached = func
+	return wrapper
+
+
+def clear_result_cache():
+	""" Remove every stored result, e.g. after a new kernel is installed. """
+	global _connection, _fingerprint
+	if _connection is not None:
+		_connection.close()
+	_connection = None
+	_fingerprint = None
+	for suffix in ('', '-wal', '-shm'):
+		if os.path.exists(result_cache_path() + suffix):
+			os.remove(result_cache_path() + suffix)
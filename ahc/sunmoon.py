@@ -5,23 +5,35 @@ from datetime import datetime
 from datetime import timedelta
 from pytz import timezone
 from skyfield.units import Angle
+from skyfield.earthlib import refraction, refract
+from skyfield.toposlib import iers2010
+from functools import lru_cache
+from skyfield.timelib import Time
+from pytz import utc
 import os
+from collections import namedtuple
 
 __all__ = ["list_hijri_months", "hijri_month", "set_location", "convert_utc_to_localtime", "convert_localtime_to_utc", "sunrise_sunset_utc",
 			"sunrise_sunset_local", "sun_position_time_utc", "sun_position_time_local", "moon_position_time_utc", "moon_position_time_local", 
 			"moon_elongation_time_utc", "moon_elongation_time_local", "moon_illumination_width_utc", "moon_illumination_width_local",
 			"find_new_moon_dates", "ref_hijri_ijtima", "newmoon_hijri_month_utc", "newmoon_hijri_month_local_time", "refraction_horizon_degree", 
 			"moonrise_moonset_utc", "moonrise_moonset_local", "print_angle", "print_timedelta", "print_timedelta_tz", "fajr_time_utc", 
-			"fajr_time_local", "calc_timedelta_seconds"]
+			"fajr_time_local", "calc_timedelta_seconds", "lunation_catalogue", "build_lunation_catalogue", "utc_times", "sun_position_times_utc",
+			"moon_position_times_utc", "moon_elongation_times_utc", "moon_illumination_width_times_utc", "moon_parallax_pymeeus",
+			"sun_moon_record", "sun_moon_state", "moon_horizontal_parallax", "moon_parallax", "observer", "get_observer", "as_observer"]
 
-global ts, ephem
-# Load ephemeris data
-ts = api.load.timescale()
+# Ephemeris data is shared by the whole package and loaded on first use
+from .ephemeris import ts, ephem, ephemeris_name, database_path
+from .fastephem import precision_engine
+from .ephemtable import angle_between_degrees
+
+# Equatorial radius of the Earth (IERS 2010) in km, and ratio of the Moon's semi-diameter to its horizontal parallax
+EARTH_EQUATORIAL_RADIUS_KM = 6378.1366
+MOON_EARTH_RADIUS_RATIO = 0.27254
+
+# Number of observing sites kept by get_observer()
+OBSERVER_CACHE_SIZE = 256
 
-# Find the latest .bsp file
-bsp_files = [f for f in os.listdir('database') if f.endswith('.bsp')]
-latest_bsp = max(bsp_files) if bsp_files else 'de421.bsp'  # Fallback to de421.bsp if none found
-ephem = api.load_file(f'database/{latest_bsp}')
 
 def list_hijri_months(print_list=False):
 	hijri_months = ['Muharram', 'Shafar', 'Rabiul Awwal', 'Rabiuts Tsani', 'Jumadil Ula', 'Jumadil Akhir', 'Rajab', 'Syaban', 'Ramadhan', 'Syawal', 'Dzulqadah', 'Dzulhijjah']
@@ -36,19 +48,64 @@ def hijri_month(idx):
 	hijri_months = list_hijri_months()
 	return hijri_months[int(idx)-1]
 
-def set_location(latitude, longitude, elevation):
-	if latitude > 0:
-		lat_str = '%lf N' % latitude 
-	else:
-		lat_str = '%lf S' % (-1.0*latitude) 
+class observer:
+	""" Observing site built once: its geographic position, the earth + topos vector used to observe from
+	it and the apparent horizon for every temperature/pressure pair asked so far.
 
-	if longitude > 0:
-		long_str = '%lf E' % longitude
-	else:
-		long_str = '%lf W' % (-1.0*longitude)
+	Every function taking a location accepts an observer or a skyfield Topos; get one with set_location()
+	or get_observer(), which hand out the same object for the same site.
+	"""
+	__slots__ = ('topos', 'dip_degrees', '_vector', '_horizons')
+
+	def __init__(self, topos):
+		self.topos = topos
+		# dip of the horizon due to the elevation
+		earth_radius_m = EARTH_EQUATORIAL_RADIUS_KM*1000.0
+		self.dip_degrees = -np.degrees(np.arccos(earth_radius_m/(earth_radius_m + topos.elevation.m)))
+		self._vector = None
+		self._horizons = {}
+
+	@property
+	def latitude(self):
+		return self.topos.latitude
+
+	@property
+	def longitude(self):
+		return self.topos.longitude
+
+	@property
+	def elevation(self):
+		return self.topos.elevation
+
+	@property
+	def vector(self):
+		""" earth + topos, the position of the site in the solar system. """
+		if self._vector is None:
+			self._vector = ephem['Earth'] + self.topos
+		return self._vector
+
+	def horizon_degrees(self, temperature_C=10.0, pressure_mbar=1030.0):
+		""" Apparent horizon in degree: dip due to the elevation minus the refraction at the horizon. """
+		key = (temperature_C, pressure_mbar)
+		if key not in self._horizons:
+			self._horizons[key] = self.dip_degrees - refraction_horizon_degree(temperature_C, pressure_mbar)
+		return self._horizons[key]
+
+	def __repr__(self):
+		return '<observer %.6f %.6f %.1f m>' % (self.latitude.degrees, self.longitude.degrees, self.elevation.m)
+
+
+@lru_cache(maxsize=OBSERVER_CACHE_SIZE)
+def get_observer(latitude, longitude, elevation=0.0):
+	return observer(iers2010.latlon(latitude, longitude, elevation_m=elevation))
 
-	location = api.Topos(lat_str, long_str, elevation_m=elevation)
-	return location
+
+def as_observer(location):
+	return location if isinstance(location, observer) else observer(location)
+
+
+def set_location(latitude, longitude, elevation):
+	return get_observer(float(latitude), float(longitude), float(elevation))
 
 
 def convert_utc_to_localtime(time_zone_str, utc_datetime=None, year=None, month=None, day=None, hour=None, minute=None, second=None):
@@ -81,27 +138,20 @@ def convert_localtime_to_utc(time_zone_str, local_datetime=None, year=None, mont
 
 
 def refraction_horizon_degree(temperature_C, pressure_mbar):
-	from skyfield.earthlib import refraction
-
 	r = refraction(0.0, temperature_C=temperature_C, pressure_mbar=pressure_mbar)  # in degree
 	return r 
 
 
 def sunrise_sunset_utc(location, year=None, month=None, day=None, temperature_C=10.0, pressure_mbar=1030.0, radius_degrees=0.2665):
 
-	# get corection due to elevation
-	elev = location.elevation
-	altitude_m = elev.m
-	earth_radius_m = 6378136.6
-	side_over_hypotenuse = earth_radius_m/(earth_radius_m + altitude_m)
-	h = Angle(radians = -np.arccos(side_over_hypotenuse))
-
-	horizon_degrees = h.degrees - refraction_horizon_degree(temperature_C, pressure_mbar)
+	# horizon corrected for the elevation and the refraction, computed once per site and atmosphere
+	site = as_observer(location)
+	horizon_degrees = site.horizon_degrees(temperature_C, pressure_mbar)
 
 	t0 = ts.utc(year, month, day, 0)
 	t1 = ts.utc(t0.utc_datetime() + timedelta(days=2))
 
-	t, y = almanac.find_discrete(t0, t1, almanac.risings_and_settings(ephem, ephem['Sun'], location, 
+	t, y = almanac.find_discrete(t0, t1, almanac.risings_and_settings(ephem, ephem['Sun'], site.topos, 
 													horizon_degrees=horizon_degrees, radius_degrees=radius_degrees))
 	#print (t.utc_datetime())
 	sunrise = None
@@ -141,21 +191,16 @@ def sunrise_sunset_local(location, time_zone_str, year=None, month=None, day=Non
 
 def fajr_time_utc(location, year=None, month=None, day=None, temperature_C=10.0, pressure_mbar=1030.0, fajr_sun_altitude=-18.0):
 
-	# get corection due to elevation
-	elev = location.elevation
-	altitude_m = elev.m
-	earth_radius_m = 6378136.6
-	side_over_hypotenuse = earth_radius_m/(earth_radius_m + altitude_m)
-	h = Angle(radians = -np.arccos(side_over_hypotenuse))
-
-	horizon_degrees = h.degrees - refraction_horizon_degree(temperature_C, pressure_mbar)
+	# horizon corrected for the elevation and the refraction, computed once per site and atmosphere
+	site = as_observer(location)
+	horizon_degrees = site.horizon_degrees(temperature_C, pressure_mbar)
 
 	radius_degrees = horizon_degrees -1*fajr_sun_altitude
 
 	t0 = ts.utc(year, month, day, 0)
 	t1 = ts.utc(t0.utc_datetime() + timedelta(days=1))
 
-	t, y = almanac.find_discrete(t0, t1, almanac.risings_and_settings(ephem, ephem['Sun'], location, horizon_degrees=horizon_degrees, radius_degrees=radius_degrees))
+	t, y = almanac.find_discrete(t0, t1, almanac.risings_and_settings(ephem, ephem['Sun'], site.topos, horizon_degrees=horizon_degrees, radius_degrees=radius_degrees))
 	fajr_time = None
 	for time, is_sunrise in zip(t, y):
 		if is_sunrise:
@@ -165,7 +210,7 @@ def fajr_time_utc(location, year=None, month=None, day=None, temperature_C=10.0,
 		t0 = ts.utc(year, month, day, 0)
 		t1 = ts.utc(t0.utc_datetime() + timedelta(days=2))
 
-		t, y = almanac.find_discrete(t0, t1, almanac.risings_and_settings(ephem, ephem['Sun'], location, horizon_degrees=horizon_degrees, radius_degrees=radius_degrees))
+		t, y = almanac.find_discrete(t0, t1, almanac.risings_and_settings(ephem, ephem['Sun'], site.topos, horizon_degrees=horizon_degrees, radius_degrees=radius_degrees))
 		for time, is_sunrise in zip(t, y):
 			if is_sunrise:
 				fajr_time = time.utc_datetime()
@@ -175,14 +220,9 @@ def fajr_time_utc(location, year=None, month=None, day=None, temperature_C=10.0,
 
 def fajr_time_local(location, time_zone_str, year=None, month=None, day=None, temperature_C=10.0, pressure_mbar=1030.0, fajr_sun_altitude=-18.0):
 
-	# get corection due to elevation
-	elev = location.elevation
-	altitude_m = elev.m
-	earth_radius_m = 6378136.6
-	side_over_hypotenuse = earth_radius_m/(earth_radius_m + altitude_m)
-	h = Angle(radians = -np.arccos(side_over_hypotenuse))
-
-	horizon_degrees = h.degrees - refraction_horizon_degree(temperature_C, pressure_mbar)
+	# horizon corrected for the elevation and the refraction, computed once per site and atmosphere
+	site = as_observer(location)
+	horizon_degrees = site.horizon_degrees(temperature_C, pressure_mbar)
 
 	#t0 = ts.utc(year, month, day, 0)
 	#t1 = ts.utc(t0.utc_datetime() + timedelta(days=1))
@@ -193,7 +233,7 @@ def fajr_time_local(location, time_zone_str, year=None, month=None, day=None, te
 	t0 = ts.utc(tinit.utc_datetime() - timedelta(days=1))
 	t1 = ts.utc(tinit.utc_datetime() + timedelta(days=1))
 
-	t, y = almanac.find_discrete(t0, t1, almanac.risings_and_settings(ephem, ephem['Sun'], location, horizon_degrees=horizon_degrees, radius_degrees=radius_degrees))
+	t, y = almanac.find_discrete(t0, t1, almanac.risings_and_settings(ephem, ephem['Sun'], site.topos, horizon_degrees=horizon_degrees, radius_degrees=radius_degrees))
 	fajr_time = None
 	for time, is_sunrise in zip(t, y):
 		if is_sunrise:
@@ -207,20 +247,15 @@ def fajr_time_local(location, time_zone_str, year=None, month=None, day=None, te
 
 def moonrise_moonset_utc(location, year=None, month=None, day=None, temperature_C=10.0, pressure_mbar=1030.0, radius_degrees=0.2575):
 	
-	# get corection due to elevation
-	elev = location.elevation
-	altitude_m = elev.m
-	earth_radius_m = 6378136.6
-	side_over_hypotenuse = earth_radius_m/(earth_radius_m + altitude_m)
-	h = Angle(radians = -np.arccos(side_over_hypotenuse))
-
-	horizon_degrees = h.degrees - refraction_horizon_degree(temperature_C, pressure_mbar)
+	# horizon corrected for the elevation and the refraction, computed once per site and atmosphere
+	site = as_observer(location)
+	horizon_degrees = site.horizon_degrees(temperature_C, pressure_mbar)
 
 	tinit = ts.utc(year, month, day, 0)
 	t0 = ts.utc(tinit.utc_datetime() - timedelta(days=1))
 	t1 = ts.utc(tinit.utc_datetime() + timedelta(days=3))
 
-	t, y = almanac.find_discrete(t0, t1, almanac.risings_and_settings(ephem, ephem['Moon'], location, 
+	t, y = almanac.find_discrete(t0, t1, almanac.risings_and_settings(ephem, ephem['Moon'], site.topos, 
 													horizon_degrees=horizon_degrees, radius_degrees=radius_degrees))
 	#print (t.utc_datetime())
 	moonrise = None
@@ -263,12 +298,11 @@ def moonrise_moonset_local(location, time_zone_str, year=None, month=None, day=N
 
 def sun_position_time_utc(location, utc_datetime=None, year=None, month=None, day=None, hour=None, minute=None, second=None, temperature_C=10.0, pressure_mbar=1030.0):
 	sun = ephem["Sun"]
-	earth = ephem["Earth"]
 
 	if utc_datetime is None:
-		sun_pos = (earth + location).at(ts.utc(year, month=month, day=day, hour=hour, minute=minute, second=second)).observe(sun).apparent()
+		sun_pos = as_observer(location).vector.at(ts.utc(year, month=month, day=day, hour=hour, minute=minute, second=second)).observe(sun).apparent()
 	else:
-		sun_pos = (earth + location).at(ts.from_datetime(utc_datetime)).observe(sun).apparent()
+		sun_pos = as_observer(location).vector.at(ts.from_datetime(utc_datetime)).observe(sun).apparent()
 
 	altitude, azimuth, distance = sun_pos.altaz(temperature_C=temperature_C, pressure_mbar=pressure_mbar)
 
@@ -287,12 +321,11 @@ def sun_position_time_local(location, time_zone_str, local_datetime=None, year=N
 
 def moon_position_time_utc(location, utc_datetime=None, year=None, month=None, day=None, hour=None, minute=None, second=None, temperature_C=10.0, pressure_mbar=1030.0):
 	moon = ephem["Moon"]
-	earth = ephem["Earth"]
 
 	if utc_datetime is None:
-		moon_pos = (earth + location).at(ts.utc(year, month=month, day=day, hour=hour, minute=minute, second=second)).observe(moon).apparent()
+		moon_pos = as_observer(location).vector.at(ts.utc(year, month=month, day=day, hour=hour, minute=minute, second=second)).observe(moon).apparent()
 	else:
-		moon_pos = (earth + location).at(ts.from_datetime(utc_datetime)).observe(moon).apparent()
+		moon_pos = as_observer(location).vector.at(ts.from_datetime(utc_datetime)).observe(moon).apparent()
 
 	altitude, azimuth, distance = moon_pos.altaz(temperature_C=temperature_C, pressure_mbar=pressure_mbar)
 
@@ -319,15 +352,15 @@ def moon_elongation_time_utc(location=None, utc_datetime=None, year=None, month=
 			m = earth.at(ts.utc(year, month=month, day=day, hour=hour, minute=minute, second=second)).observe(moon).apparent()
 			s = earth.at(ts.utc(year, month=month, day=day, hour=hour, minute=minute, second=second)).observe(sun).apparent()
 		else:
-			m = (earth + location).at(ts.utc(year, month=month, day=day, hour=hour, minute=minute, second=second)).observe(moon).apparent()
-			s = (earth + location).at(ts.utc(year, month=month, day=day, hour=hour, minute=minute, second=second)).observe(sun).apparent()
+			m = as_observer(location).vector.at(ts.utc(year, month=month, day=day, hour=hour, minute=minute, second=second)).observe(moon).apparent()
+			s = as_observer(location).vector.at(ts.utc(year, month=month, day=day, hour=hour, minute=minute, second=second)).observe(sun).apparent()
 	else:
 		if location is None:
 			m = earth.at(ts.from_datetime(utc_datetime)).observe(moon).apparent()
 			s = earth.at(ts.from_datetime(utc_datetime)).observe(sun).apparent()
 		else:
-			m = (earth + location).at(ts.from_datetime(utc_datetime)).observe(moon).apparent()
-			s = (earth + location).at(ts.from_datetime(utc_datetime)).observe(sun).apparent()
+			m = as_observer(location).vector.at(ts.from_datetime(utc_datetime)).observe(moon).apparent()
+			s = as_observer(location).vector.at(ts.from_datetime(utc_datetime)).observe(sun).apparent()
 
 	return s.separation_from(m).degrees
 
@@ -341,54 +374,199 @@ def moon_elongation_time_local(time_zone_str, location=None, local_datetime=None
 	return moon_elong
 
 
-def moon_illumination_width_utc(location=None, utc_datetime=None, year=None, month=None, day=None, hour=None, minute=None, second=None):
-
-	from pymeeus.Epoch import Epoch
-	from pymeeus.Moon import Moon
-
-	earth = ephem["Earth"]
-	moon = ephem["Moon"]
-	sun = ephem["Sun"]
+def moon_illumination_width_utc(location=None, utc_datetime=None, year=None, month=None, day=None, hour=None, minute=None, second=None, parallax_method="ephemeris"):
 
 	if utc_datetime is None:
-		if location is None:
-			m = earth.at(ts.utc(year, month=month, day=day, hour=hour, minute=minute, second=second)).observe(moon).apparent()
-			s = earth.at(ts.utc(year, month=month, day=day, hour=hour, minute=minute, second=second)).observe(sun).apparent()
-		else:
-			m = (earth + location).at(ts.utc(year, month=month, day=day, hour=hour, minute=minute, second=second)).observe(moon).apparent()
-			s = (earth + location).at(ts.utc(year, month=month, day=day, hour=hour, minute=minute, second=second)).observe(sun).apparent()
+		t = ts.utc(year, month=month, day=day, hour=hour, minute=minute, second=second)
 	else:
-		if location is None:
-			m = earth.at(ts.from_datetime(utc_datetime)).observe(moon).apparent()
-			s = earth.at(ts.from_datetime(utc_datetime)).observe(sun).apparent()
-		else:
-			m = (earth + location).at(ts.from_datetime(utc_datetime)).observe(moon).apparent()
-			s = (earth + location).at(ts.from_datetime(utc_datetime)).observe(sun).apparent()
+		t = ts.from_datetime(utc_datetime)
 
-		year, month, day = utc_datetime.year, utc_datetime.month, utc_datetime.day 
+	s, m = _observe_sun_moon(location, t)
 
 	elongation = s.separation_from(m).degrees
-	illumination = m.fraction_illuminated(sun)*100   # in percent
+	illumination = m.fraction_illuminated(ephem["Sun"])*100   # in percent
 
 	# get horizontal parallax
-	epoch = Epoch(year, month, day)
-	Lambda, Beta, Delta, parallax = Moon.apparent_ecliptical_pos(epoch)  # parallax in degree
-	SD = 0.27254*parallax*60.0    # in arcmin
+	parallax = moon_parallax(t, parallax_method=parallax_method, distance_km=None if location is not None else m.distance().km)
+	SD = MOON_EARTH_RADIUS_RATIO*parallax*60.0    # in arcmin
 	width = SD*(1.0 - np.cos(elongation*np.pi/180.0))/60.0   # in degree
 
 	return illumination, width, parallax, SD/60.0
 
 
-def moon_illumination_width_local(time_zone_str, location=None, local_datetime=None, year=None, month=None, day=None, hour=None, minute=None, second=None):
+def moon_illumination_width_local(time_zone_str, location=None, local_datetime=None, year=None, month=None, day=None, hour=None, minute=None, second=None,
+								parallax_method="ephemeris"):
 
 	utc_datetime = convert_localtime_to_utc(time_zone_str, local_datetime=local_datetime, 
 						year=year, month=month, day=day, hour=hour, minute=minute, second=second)
 
-	illumination, width, parallax, SD = moon_illumination_width_utc(location=location, utc_datetime=utc_datetime)
+	illumination, width, parallax, SD = moon_illumination_width_utc(location=location, utc_datetime=utc_datetime, parallax_method=parallax_method)
 
 	return illumination, width, parallax, SD
 
 
+def utc_times(utc_datetimes):
+	""" One skyfield Time for a sequence of UTC instants.
+
+	Accepts a Time (returned as is), an array of numpy datetime64 or a sequence of datetimes; naive
+	datetimes are taken as UTC. For example a series every 10 s is
+	utc_times(np.arange(np.datetime64('2025-03-01T11:00'), np.datetime64('2025-03-01T12:00'), np.timedelta64(10, 's'))).
+	"""
+	if isinstance(utc_datetimes, Time):
+		return utc_datetimes
+
+	instants = np.asarray(utc_datetimes)
+	if np.issubdtype(instants.dtype, np.datetime64):
+		# days and seconds apart so that no precision is lost on long series
+		microseconds = instants.astype('datetime64[us]').astype(np.int64)
+		days, microseconds = np.divmod(microseconds, 86400*1000000)
+		return ts.utc(1970, 1, 1 + days, 0, 0, microseconds/1e6)
+
+	return ts.from_datetimes([d if d.tzinfo is not None else d.replace(tzinfo=utc) for d in instants.ravel()])
+
+
+def _fast_position_times_utc(engine, body, location, utc_datetimes, temperature_C, pressure_mbar):
+	site = as_observer(location)
+	altitude, azimuth, distance, v = engine.altaz(body, utc_times(utc_datetimes).tt, site.latitude.degrees, site.longitude.degrees, site.elevation.m)
+	return refract(altitude, temperature_C, pressure_mbar), azimuth, distance
+
+
+def sun_position_times_utc(location, utc_datetimes, temperature_C=10.0, pressure_mbar=1030.0, precision="kernel"):
+	""" Same as sun_position_time_utc() for a whole series of UTC instants, see utc_times(); returns arrays.
+
+	precision="fast" takes the Sun from the analytic series of fastephem.fast_sun_moon instead of the kernel.
+	"""
+	engine = precision_engine(precision)
+	if engine is not None:
+		return _fast_position_times_utc(engine, 'Sun', location, utc_datetimes, temperature_C, pressure_mbar)
+
+	sun_pos = as_observer(location).vector.at(utc_times(utc_datetimes)).observe(ephem["Sun"]).apparent()
+	altitude, azimuth, distance = sun_pos.altaz(temperature_C=temperature_C, pressure_mbar=pressure_mbar)
+
+	return altitude.degrees, azimuth.degrees, distance.km
+
+
+def moon_position_times_utc(location, utc_datetimes, temperature_C=10.0, pressure_mbar=1030.0, precision="kernel"):
+	""" Same as moon_position_time_utc() for a whole series of UTC instants, see utc_times(); returns arrays.
+
+	precision="fast" takes the Moon from the analytic series of fastephem.fast_sun_moon instead of the kernel.
+	"""
+	engine = precision_engine(precision)
+	if engine is not None:
+		return _fast_position_times_utc(engine, 'Moon', location, utc_datetimes, temperature_C, pressure_mbar)
+
+	moon_pos = as_observer(location).vector.at(utc_times(utc_datetimes)).observe(ephem["Moon"]).apparent()
+	altitude, azimuth, distance = moon_pos.altaz(temperature_C=temperature_C, pressure_mbar=pressure_mbar)
+
+	return altitude.degrees, azimuth.degrees, distance.km
+
+
+def _observe_sun_moon(location, t):
+	position = (ephem["Earth"] if location is None else as_observer(location).vector).at(t)
+	return position.observe(ephem["Sun"]).apparent(), position.observe(ephem["Moon"]).apparent()
+
+
+def moon_elongation_times_utc(utc_datetimes, location=None, precision="kernel"):
+	""" Same as moon_elongation_time_utc() for a whole series of UTC instants, see utc_times(); returns an array. """
+	engine = precision_engine(precision)
+	if engine is not None:
+		jd = utc_times(utc_datetimes).tt
+		if location is None:
+			return angle_between_degrees(engine.geocentric('Sun', jd), engine.geocentric('Moon', jd))
+		site = as_observer(location).topos.itrs_xyz.km
+		rotation = engine.earth_rotation(jd)
+		return angle_between_degrees(engine.topocentric('Sun', jd, site, rotation), engine.topocentric('Moon', jd, site, rotation))
+
+	s, m = _observe_sun_moon(location, utc_times(utc_datetimes))
+	return s.separation_from(m).degrees
+
+
+def moon_parallax_pymeeus(t):
+	""" Horizontal parallax of the Moon in degree, from pymeeus at 0h of the UTC date of every instant of t.
+
+	Computed once per distinct date, as moon_illumination_width_utc() does for a single instant.
+	"""
+	from pymeeus.Epoch import Epoch
+	from pymeeus.Moon import Moon
+
+	year, month, day = t.utc.year, t.utc.month, t.utc.day
+	dates, inverse = np.unique(np.stack([np.ravel(year), np.ravel(month), np.ravel(day)], axis=1).astype(int), axis=0, return_inverse=True)
+	parallax_dates = np.array([Moon.apparent_ecliptical_pos(Epoch(int(y), int(mo), int(d)))[3] for y, mo, d in dates], dtype=float)
+	return parallax_dates[inverse.ravel()].reshape(np.shape(year))[()]
+
+
+def moon_horizontal_parallax(distance_km):
+	""" Horizontal parallax in degree of a body at the given geocentric distance. """
+	return np.degrees(np.arcsin(EARTH_EQUATORIAL_RADIUS_KM/distance_km))
+
+
+def moon_parallax(t, parallax_method="ephemeris", distance_km=None):
+	""" Horizontal parallax of the Moon in degree at every instant of t.
+
+	parallax_method "ephemeris" takes the geocentric Earth-Moon distance of the loaded kernel at the
+	exact instant, vectorized over t (distance_km can be given when the geocentric Moon has already been
+	observed). "pymeeus" uses pymeeus at 0h of the UTC date, as older versions did, e.g. to cross-check.
+	"""
+	if parallax_method == "pymeeus":
+		return moon_parallax_pymeeus(t)
+	if parallax_method != "ephemeris":
+		raise ValueError("Unknown parallax_method '%s', use 'ephemeris' or 'pymeeus'" % parallax_method)
+
+	if distance_km is None:
+		distance_km = _observe_sun_moon(None, t)[1].distance().km
+	return moon_horizontal_parallax(distance_km)
+
+
+def moon_illumination_width_times_utc(utc_datetimes, location=None, parallax_method="ephemeris"):
+	""" Same as moon_illumination_width_utc() for a whole series of UTC instants, see utc_times(); returns arrays. """
+	t = utc_times(utc_datetimes)
+	s, m = _observe_sun_moon(location, t)
+
+	elongation = s.separation_from(m).degrees
+	illumination = m.fraction_illuminated(ephem["Sun"])*100   # in percent
+
+	parallax = moon_parallax(t, parallax_method=parallax_method, distance_km=None if location is not None else m.distance().km)
+	SD = MOON_EARTH_RADIUS_RATIO*parallax*60.0    # in arcmin
+	width = SD*(1.0 - np.cos(elongation*np.pi/180.0))/60.0   # in degree
+
+	return illumination, width, parallax, SD/60.0
+
+
+sun_moon_record = namedtuple('sun_moon_record', ['sun_alt', 'sun_az', 'sun_dist', 'moon_alt', 'moon_az', 'moon_dist', 'elong', 'elong_geo',
+												'arcv', 'illumination', 'width', 'parallax', 'SD'])
+
+
+def sun_moon_state(location, t, temperature_C=10.0, pressure_mbar=1030.0, parallax_method="ephemeris"):
+	""" Everything about the Sun and the Moon seen from location at t, observing each body once.
+
+	:param t:
+		A UTC datetime, or a series of UTC instants as accepted by utc_times().
+
+	:returns:
+		sun_moon_record of altitudes and azimuths (degree, with refraction), distances (km), topocentric
+		and geocentric elongation, arc of vision (moon_alt - sun_alt), illumination (percent), crescent
+		width, horizontal parallax and semi-diameter (degree, see moon_parallax() for parallax_method).
+		Fields are floats for a single datetime and arrays for a series.
+	"""
+	t = ts.from_datetime(t) if isinstance(t, datetime) else utc_times(t)
+
+	s, m = _observe_sun_moon(location, t)
+	s_geo, m_geo = _observe_sun_moon(None, t)
+
+	sun_alt, sun_az, sun_dist = s.altaz(temperature_C=temperature_C, pressure_mbar=pressure_mbar)
+	moon_alt, moon_az, moon_dist = m.altaz(temperature_C=temperature_C, pressure_mbar=pressure_mbar)
+
+	elong = s.separation_from(m).degrees
+	illumination = m.fraction_illuminated(ephem["Sun"])*100   # in percent
+
+	parallax = moon_parallax(t, parallax_method=parallax_method, distance_km=m_geo.distance().km)
+	SD = MOON_EARTH_RADIUS_RATIO*parallax
+	width = SD*(1.0 - np.cos(elong*np.pi/180.0))
+
+	return sun_moon_record(sun_alt.degrees, sun_az.degrees, sun_dist.km, moon_alt.degrees, moon_az.degrees, moon_dist.km, elong,
+							s_geo.separation_from(m_geo).degrees, moon_alt.degrees - sun_alt.degrees, illumination, width, parallax, SD)
+
+
 def find_new_moon_dates(start_year, start_month, start_day, end_year, end_month, end_day):
 	t0 = ts.utc(start_year, start_month, start_day)
 	t1 = ts.utc(end_year, end_month, end_day)
@@ -407,12 +585,73 @@ def find_new_moon_dates(start_year, start_month, start_day, end_year, end_month,
 
 	return new_moon_datetime
 
+# 2022-07-28 --> Muharram 1444
+REF_HIJRI_MONTH, REF_HIJRI_YEAR = 1, 1444
+REF_HIJRI_DATE = (2022, 7, 28)
+
+_lunation_catalogue = None
+
 def ref_hijri_ijtima():
-	# 2022-07-28 --> Muharram 1444
-	hijri_m, hijri_y = 1, 1444
-	utc_datetime = find_new_moon_dates(2022, 7, 28, 2022, 7, 30)
+	hijri_m, hijri_y = REF_HIJRI_MONTH, REF_HIJRI_YEAR
+	utc_datetime = find_new_moon_dates(REF_HIJRI_DATE[0], REF_HIJRI_DATE[1], REF_HIJRI_DATE[2], REF_HIJRI_DATE[0], REF_HIJRI_DATE[1], REF_HIJRI_DATE[2]+2)
 	return hijri_m, hijri_y, utc_datetime[0]
 
+def lunation_catalogue_path():
+	# one catalogue per kernel file: a reduced kernel covers fewer years than its source
+	return database_path('%s_newmoon.npy' % ephemeris_name()[:-len('.bsp')])
+
+def build_lunation_catalogue(path=None, chunk_years=50):
+	""" Search every new moon over the time span of the loaded kernel and store them as TT Julian dates
+	in a .npy file, so that the catalogue is built only once per ephemeris file.
+	"""
+	import sys
+
+	if path is None:
+		path = lunation_catalogue_path()
+
+	start_jd = max([segment.spk_segment.start_jd for segment in ephem.segments]) + 1.0
+	end_jd = min([segment.spk_segment.end_jd for segment in ephem.segments]) - 1.0
+	chunk_days = chunk_years*365.25
+	edges = list(np.arange(start_jd, end_jd, chunk_days)) + [end_jd]
+
+	new_moon_tt = []
+	for ii in range(len(edges)-1):
+		t, y = almanac.find_discrete(ts.tt_jd(edges[ii]), ts.tt_jd(edges[ii+1]), almanac.moon_phases(ephem))
+		new_moon_tt.append(t.tt[y == 0])
+
+		sys.stdout.write('\r')
+		sys.stdout.write('building new moon catalogue: %d%%' % ((ii+1)*100/(len(edges)-1)))
+		sys.stdout.flush()
+	print ('')
+
+	new_moon_tt = np.unique(np.concatenate(new_moon_tt))
+	path_tmp = path + '.tmp.npy'
+	np.save(path_tmp, new_moon_tt.astype(np.float64))
+	os.replace(path_tmp, path)
+	return path
+
+def lunation_catalogue():
+	""" Return the memory-mapped new moon catalogue (TT Julian dates) of the loaded kernel and the index of
+	the new moon of the reference Hijri month. The catalogue is built on first use.
+	"""
+	global _lunation_catalogue
+
+	if _lunation_catalogue is None:
+		path = lunation_catalogue_path()
+		if not os.path.exists(path):
+			build_lunation_catalogue(path)
+		new_moon_tt = np.load(path, mmap_mode='r')
+		ref_tt = ts.utc(*REF_HIJRI_DATE).tt
+		ref_idx = int(np.searchsorted(new_moon_tt, ref_tt))
+		# the lunations are counted from the new moon of the reference Hijri month, which has to be in the catalogue:
+		# without it the count would start from another new moon and every month would be wrong
+		if ref_idx >= len(new_moon_tt) or abs(new_moon_tt[ref_idx] - ref_tt) >= 1.0:
+			raise ValueError('The new moon of the reference Hijri month (%04d-%02d-%02d) is not in the catalogue of %s, '
+							'the kernel does not cover it' % (REF_HIJRI_DATE + (ephemeris_name(),)))
+		_lunation_catalogue = (new_moon_tt, ref_idx)
+
+	return _lunation_catalogue
+
 def newmoon_hijri_month_utc(hijri_year, hijri_month):
 	""" Function to find the date of new moon associated with given Hijri month and year
 	:param hijri_year:
@@ -420,39 +659,15 @@ def newmoon_hijri_month_utc(hijri_year, hijri_month):
 	:param hijri_month:
 		Month number start from 1.
 	"""
-	ref_hijri_m, ref_hijri_y, ref_utc_datetime = ref_hijri_ijtima()
-
-	if hijri_year > ref_hijri_y:
-		stat_forward = 1
-	elif hijri_year < ref_hijri_y:
-		stat_forward = -1
-	else:
-		if hijri_month > ref_hijri_m:
-			stat_forward = 1
-		elif hijri_month < ref_hijri_m:
-			stat_forward = -1
-		else:
-			stat_forward = 0
+	new_moon_tt, ref_idx = lunation_catalogue()
 
-	if stat_forward == 0:
-		return ref_utc_datetime
-	elif stat_forward == 1:
-		day_minus1 = datetime(ref_utc_datetime.year,ref_utc_datetime.month,ref_utc_datetime.day,0,0,0) - timedelta(days=1)
-		new_moon_datetimes = find_new_moon_dates(day_minus1.year, day_minus1.month, day_minus1.day, ref_utc_datetime.year+2*(hijri_year-ref_hijri_y+2), 12, 30)
-
-		idx = np.arange(0,len(new_moon_datetimes))
-		idx1 = np.where((idx%12==hijri_month-1) & ((idx/12).astype(int)==hijri_year-ref_hijri_y))
-		utc_datetime = new_moon_datetimes[idx1[0][0]]
-		return utc_datetime
-
-	else:
-		day_plus1 = datetime(ref_utc_datetime.year,ref_utc_datetime.month,ref_utc_datetime.day,0,0,0) + timedelta(days=1)
-		new_moon_datetimes = find_new_moon_dates(ref_utc_datetime.year-2*(ref_hijri_y-hijri_year+2), 1, 1, day_plus1.year, day_plus1.month, day_plus1.day)
+	# lunation number counted from the reference Hijri month
+	lunation = int(round((hijri_year - REF_HIJRI_YEAR)*12 + (hijri_month - REF_HIJRI_MONTH)))
+	idx = ref_idx + lunation
+	if idx < 0 or idx >= len(new_moon_tt):
+		raise ValueError('Hijri month %d of %d is outside of the time span covered by %s' % (hijri_month, hijri_year, ephemeris_name()))
 
-		idx = np.arange(1,len(new_moon_datetimes)+1) - len(new_moon_datetimes)
-		idx1 = np.where((idx%12==hijri_month-1) & ((idx/12).astype(int)-1==hijri_year-ref_hijri_y))
-		utc_datetime = new_moon_datetimes[idx1[0][0]]
-		return utc_datetime
+	return ts.tt_jd(float(new_moon_tt[idx])).utc_datetime()
 
 def newmoon_hijri_month_local_time(hijri_year, hijri_month, time_zone_str):
 	utc_datetime = newmoon_hijri_month_utc(hijri_year, hijri_month)
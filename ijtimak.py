@@ -1,6 +1,7 @@
 import argparse
 import json
 from ahc.anakbulan import crescent_data
+from ahc.resultcache import set_cache_enabled
 
 # Load predefined locations from location.txt
 LOCATIONS_FILE = "database/location.txt"
@@ -33,8 +34,10 @@ def main():
     parser.add_argument("--elevation", type=float, help="Elevation dalam meter")
     parser.add_argument("--time_zone", type=str, default="Asia/Kuala_Lumpur", help="Time zone (default: Asia/Kuala_Lumpur)")
     parser.add_argument("--loc_name", type=str, help="Nama lokasi (default: Pantai Minyak Beku)")
+    parser.add_argument("--no-cache", action="store_true", help="Kira semula tanpa menggunakan cache keputusan")
     
     args = parser.parse_args()
+    set_cache_enabled(not args.no_cache)
     
     # Use predefined location if selected
     if args.location and args.location in LOCATIONS:
@@ -4,6 +4,7 @@ import hashlib
 import re
 import sys
 import time
+import argparse
 from colorama import init, Fore
 
 # Initialize colorama (for Windows compatibility)
@@ -30,6 +31,13 @@ def color_text(text, color_code):
     colors = {"31": Fore.RED, "33": Fore.YELLOW, "32": Fore.GREEN}
     return colors.get(color_code, "") + text
 
+def invalidate_result_cache():
+    """Remove the cached crescent and prayer time results, they were computed with the previous kernel."""
+    cache_path = os.path.join(db_folder, "result_cache.sqlite")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(cache_path + suffix):
+            os.remove(cache_path + suffix)
+
 def download_file(url, file_path):
     response = requests.get(url, stream=True)
     total_size = int(response.headers.get('content-length', 0))
@@ -64,8 +72,10 @@ def download_file(url, file_path):
                     sys.stdout.write(f"\rDownloading... [{progress * 100:.0f}%] {bar} {speed:.2f} KB/s")
                     sys.stdout.flush()
         print(f"\n{file_path} downloaded successfully.")
+        return True
     else:
         print("Failed to download the file.")
+        return False
 
 def update_location_file():
     github_raw_url = "https://raw.githubusercontent.com/duokino/astrokalkulator/main/database/location.txt"
@@ -85,10 +95,21 @@ def update_location_file():
         print("Local file is up to date.")
 
 def get_latest_local_file():
-    """Get the latest .bsp file from the local database folder."""
-    bsp_files = [f for f in os.listdir(db_folder) if f.endswith('.bsp')]
+    """Get the latest .bsp file from the local database folder, not counting the reduced copies."""
+    bsp_files = [f for f in os.listdir(db_folder) if re.fullmatch(r'de\d+\.bsp', f)]
     return max(bsp_files) if bsp_files else None
 
+def build_reduced_kernel(name=None, start_year=None, end_year=None):
+    """Write the Sun/Earth/Moon-only copy of a kernel, which ahc then loads instead of the full one.
+    It only covers start_year to end_year, dates outside of them fail until the copy is deleted."""
+    from ahc.ephemeris import build_reduced_kernel, REDUCED_YEARS
+    try:
+        path = build_reduced_kernel(name, start_year or REDUCED_YEARS[0], end_year or REDUCED_YEARS[1])
+    except ValueError as error:
+        print(f"Error: {error}")
+        return
+    print(f"Reduced kernel written to {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MB).")
+
 def check_for_bsp_update():
     url = "https://naif.jpl.nasa.gov/pub/naif/generic_kernels/spk/planets/"
     response = requests.get(url)
@@ -106,13 +127,24 @@ def check_for_bsp_update():
             print("")
             
             if user_input.lower() in ['yes', 'y']:
-                download_file(url + latest_file, os.path.join(db_folder, latest_file))
+                if download_file(url + latest_file, os.path.join(db_folder, latest_file)):
+                    invalidate_result_cache()
         else:
             print("\nNo newer BSP version available. You already have the latest.")
     else:
         print("\nFailed to fetch data from NAIF server.")
 
 def main():
+    parser = argparse.ArgumentParser(description="Update the kernel and location.txt in the database folder.")
+    parser.add_argument("--reduce", action="store_true", help="Only write the reduced Sun/Earth/Moon copy of the newest local kernel, used instead of it from then on (limits the years, see --start-year/--end-year)")
+    parser.add_argument("--start-year", type=int, help="First year kept in the reduced kernel (default 1800, at most 2022: the Hijri months are counted from July 2022)")
+    parser.add_argument("--end-year", type=int, help="Last year kept in the reduced kernel (default 2300, at least 2022)")
+    args = parser.parse_args()
+
+    if args.reduce:
+        build_reduced_kernel(get_latest_local_file(), args.start_year, args.end_year)
+        return
+
     check_for_bsp_update()
     update_location_file()
 
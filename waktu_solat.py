@@ -1,10 +1,9 @@
 import json
-import math
 import argparse
 from datetime import datetime, timedelta
-from ahc.sunmoon import set_location, fajr_time_utc, sunrise_sunset_utc, convert_utc_to_localtime
-from skyfield import api, almanac
-import os
+from ahc.sunmoon import set_location, convert_utc_to_localtime
+from ahc.prayertimes import prayer_times_utc, solar_events_range
+from ahc.resultcache import set_cache_enabled
 
 def load_locations(file_path):
     try:
@@ -14,62 +13,32 @@ def load_locations(file_path):
         print("Error: location.txt file not found.")
         return {}
 
-def get_sun_altitude(ephem, location, t):
-    observer = (ephem["Earth"] + location).at(t)
-    sun = observer.observe(ephem["Sun"]).apparent()
-    altitude, _, _ = sun.altaz()
-    return altitude.degrees
+def format_local_time(time_zone, utc_datetime, round_up=False):
+    if utc_datetime is None:
+        return "--:--"
+    # Asar, Maghrib and Isyak were always given as the first whole minute after the Sun crossed the altitude
+    if round_up and (utc_datetime.second > 0 or utc_datetime.microsecond > 0):
+        utc_datetime = utc_datetime.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    return convert_utc_to_localtime(time_zone, utc_datetime).strftime("%I:%M %p")
+
+def format_prayer_times(time_zone, times, index=0):
+    return {
+        "Subuh": format_local_time(time_zone, times["fajr"][index]),
+        "Syuruk": format_local_time(time_zone, times["sunrise"][index]),
+        "Zohor": format_local_time(time_zone, times["dhuhr"][index]),
+        "Asar": format_local_time(time_zone, times["asr"][index], round_up=True),
+        "Maghrib": format_local_time(time_zone, times["maghrib"][index], round_up=True),
+        "Isyak": format_local_time(time_zone, times["isha"][index], round_up=True)
+    }
 
 def get_prayer_times(year, month, day, latitude, longitude, elevation, time_zone, asr_method="shafi"):
-    # Load ephemeris data
-    ts = api.load.timescale()
-    
-    # Find the latest .bsp file
-    bsp_files = [f for f in os.listdir('database') if f.endswith('.bsp')]
-    latest_bsp = max(bsp_files) if bsp_files else 'de421.bsp'  # Fallback to de421.bsp if none found
-    ephem = api.load_file(f'database/{latest_bsp}')
-    
     location = set_location(latitude, longitude, elevation)
 
-    fajr_utc = fajr_time_utc(location, year, month, day)
-    sunrise_utc, sunset_utc = sunrise_sunset_utc(location, year, month, day)
+    # All prayer times are solved to the second by bracketing the Sun altitude crossings, see ahc/prayertimes.py
+    # Maghrib is when the whole sun is below the horizon (-1.066°) because Sun's apparent radius (~0.2665°) and refraction effect (~0.566° at horizon)
+    times = prayer_times_utc(location, year, month, day, time_zone, asr_method=asr_method)
 
-    t0 = ts.utc(year, month, day)
-    t1 = ts.utc(year, month, day, 23, 59, 59)
-    t, _ = almanac.find_discrete(t0, t1, almanac.meridian_transits(ephem, ephem['Sun'], location))
-    dhuhr_utc = t[0].utc_datetime()
-    
-    shadow_ratio = 1 if asr_method == "shafi" else 2
-    
-    t_dhuhr = ts.utc(dhuhr_utc.year, dhuhr_utc.month, dhuhr_utc.day, dhuhr_utc.hour, dhuhr_utc.minute)
-    sun_alt_dhuhr = get_sun_altitude(ephem, location, t_dhuhr)
-    
-    asr_altitude = math.degrees(math.atan(1 / (shadow_ratio + math.tan(math.radians(90 - sun_alt_dhuhr)))))
-    
-    t_asr = ts.utc(dhuhr_utc.year, dhuhr_utc.month, dhuhr_utc.day, dhuhr_utc.hour + 1)
-    while get_sun_altitude(ephem, location, t_asr) > asr_altitude:
-        t_asr = ts.utc(t_asr.utc_datetime() + timedelta(minutes=1))
-    asr_utc = t_asr.utc_datetime()
-    
-    # Adjust Maghrib time to when the whole sun is below the horizon (-1.066°) because Sun's apparent radius (~0.2665°) and refraction effect (~0.566° at horizon)
-    t_maghrib = ts.utc(sunset_utc.year, sunset_utc.month, sunset_utc.day, sunset_utc.hour, sunset_utc.minute)
-    while get_sun_altitude(ephem, location, t_maghrib) > -1.066:
-        t_maghrib = ts.utc(t_maghrib.utc_datetime() + timedelta(minutes=1))
-    maghrib_utc = t_maghrib.utc_datetime()
-    
-    t_isha = ts.utc(maghrib_utc.year, maghrib_utc.month, maghrib_utc.day, maghrib_utc.hour)
-    while get_sun_altitude(ephem, location, t_isha) > -18:
-        t_isha = ts.utc(t_isha.utc_datetime() + timedelta(minutes=1))
-    isyak_utc = t_isha.utc_datetime()
-    
-    return {
-        "Subuh": convert_utc_to_localtime(time_zone, fajr_utc).strftime("%I:%M %p"),
-        "Syuruk": convert_utc_to_localtime(time_zone, sunrise_utc).strftime("%I:%M %p"),
-        "Zohor": convert_utc_to_localtime(time_zone, dhuhr_utc).strftime("%I:%M %p"),
-        "Asar": convert_utc_to_localtime(time_zone, asr_utc).strftime("%I:%M %p"),
-        "Maghrib": convert_utc_to_localtime(time_zone, maghrib_utc).strftime("%I:%M %p"),
-        "Isyak": convert_utc_to_localtime(time_zone, isyak_utc).strftime("%I:%M %p")
-    }
+    return format_prayer_times(time_zone, times)
 
 malay_months_abbr = {
     "January": "Jan", "February": "Feb", "March": "Mac", "April": "Apr", "May": "Mei", "June": "Jun",
@@ -86,8 +55,13 @@ def generate_monthly_prayer_times(year, month, latitude, longitude, elevation, t
     print("  Tarikh     Subuh       Syuruk      Zohor        Asar       Maghrib     Isyak")
     print("-" * 82)
     
+    # The whole month is solved in one pass, one aligned entry per day
+    location = set_location(latitude, longitude, elevation)
+    events = solar_events_range(location, datetime(year, month, 1).date(), datetime(year, month, days_in_month).date(), time_zone)
+    events["dhuhr"] = events["transit"]
+
     for day in range(1, days_in_month + 1):
-        prayer_times = get_prayer_times(year, month, day, latitude, longitude, elevation, time_zone)
+        prayer_times = format_prayer_times(time_zone, events, day - 1)
         print(f"  {day:2d} {month_name}  {prayer_times['Subuh']:>10}  {prayer_times['Syuruk']:>10}  {prayer_times['Zohor']:>10}  {prayer_times['Asar']:>10}  {prayer_times['Maghrib']:>10}  {prayer_times['Isyak']:>10}")
     print("=" * 82)
 
@@ -100,8 +74,10 @@ parser.add_argument("--latitude", type=float, help="Latitud lokasi")
 parser.add_argument("--longitude", type=float, help="Longitude lokasi")
 parser.add_argument("--elevation", type=float, help="Elevation dalam meter")
 parser.add_argument("--timezone", default="Asia/Kuala_Lumpur", type=str, help="Time zone (contoh Asia/Kuala_Lumpur)")
+parser.add_argument("--no-cache", action="store_true", help="Kira semula tanpa menggunakan cache keputusan")
 
 args = parser.parse_args()
+set_cache_enabled(not args.no_cache)
 locations = load_locations("database/location.txt")
 
 if args.latitude and args.longitude and args.timezone:
@@ -1,11 +1,10 @@
 import argparse
 import json
-import math
 import textwrap
-from ahc.sunmoon import set_location, fajr_time_utc, sunrise_sunset_utc, convert_utc_to_localtime
-from skyfield import api, almanac
+from ahc.sunmoon import set_location, convert_utc_to_localtime
+from ahc.prayertimes import prayer_times_utc
+from ahc.resultcache import set_cache_enabled
 from datetime import timedelta, datetime
-import os
 
 def load_locations(file_path):
     """Load predefined locations from a file."""
@@ -18,24 +17,20 @@ def load_locations(file_path):
 
 def format_time(dt):
     """Format time as 12-hour format (e.g., 7:35 PM), compatible with Windows & Unix."""
+    if dt is None:
+        return "--:--"
     return dt.strftime("%I:%M %p").lstrip("0")
 
-def get_sun_altitude(ephem, location, t):
-    """Calculate the sun's altitude at a given time."""
-    observer = (ephem["Earth"] + location).at(t)
-    sun = observer.observe(ephem["Sun"]).apparent()
-    altitude, _, _ = sun.altaz()
-    return altitude.degrees
+def round_up_minute(utc_datetime):
+    """Round up to the next whole minute, as the old minute-by-minute search did for Asar, Maghrib and Isyak."""
+    if utc_datetime is None or (utc_datetime.second == 0 and utc_datetime.microsecond == 0):
+        return utc_datetime
+    return utc_datetime.replace(second=0, microsecond=0) + timedelta(minutes=1)
 
-def get_prayer_times(year, month, day, latitude, longitude, elevation, time_zone, loc_name, asr_method="shafi"):
-    # Load ephemeris data
-    ts = api.load.timescale()
+def to_local(time_zone, utc_datetime):
+    return None if utc_datetime is None else convert_utc_to_localtime(time_zone, utc_datetime)
 
-    # Find the latest .bsp file
-    bsp_files = [f for f in os.listdir('database') if f.endswith('.bsp')]
-    latest_bsp = max(bsp_files) if bsp_files else 'de421.bsp'  # Fallback to de421.bsp if none found
-    ephem = api.load_file(f'database/{latest_bsp}')
-    
+def get_prayer_times(year, month, day, latitude, longitude, elevation, time_zone, loc_name, asr_method="shafi"):
     # Set location
     location = set_location(latitude, longitude, elevation)
     
@@ -47,54 +42,18 @@ def get_prayer_times(year, month, day, latitude, longitude, elevation, time_zone
     day_name = malay_days[datetime(year, month, day).strftime("%A")]
     month_name = malay_months[datetime(year, month, day).strftime("%B")]
     
-    # 1. Get Fajr Time (UTC)
-    fajr_utc = fajr_time_utc(location, year, month, day)
-    
-    # 2. Get Sunrise and Sunset (UTC)
-    sunrise_utc, sunset_utc = sunrise_sunset_utc(location, year, month, day)
-    
-    # 3. Get Solar Noon (Dhuhr)
-    t0 = ts.utc(year, month, day)
-    t1 = ts.utc(year, month, day, 23, 59, 59)
-    t, y = almanac.find_discrete(t0, t1, almanac.meridian_transits(ephem, ephem['Sun'], location))
-    dhuhr_utc = t[0].utc_datetime()
-    
-    # 4. Calculate Asr (Using correct shadow length formula)
-    shadow_ratio = 1 if asr_method == "shafi" else 2  # Shafi (1x shadow), Hanafi (2x shadow)
-    
-    # Get Sun altitude at Dhuhr
-    t_dhuhr = ts.utc(dhuhr_utc.year, dhuhr_utc.month, dhuhr_utc.day, dhuhr_utc.hour, dhuhr_utc.minute)
-    sun_alt_dhuhr = get_sun_altitude(ephem, location, t_dhuhr)
-    
-    # Compute required Asr altitude using tangent formula
-    asr_altitude = math.degrees(math.atan(1 / (shadow_ratio + math.tan(math.radians(90 - sun_alt_dhuhr)))))
-    
-    # Find Asr time by iterating every 1 minute after Dhuhr
-    t_asr = ts.utc(dhuhr_utc.year, dhuhr_utc.month, dhuhr_utc.day, dhuhr_utc.hour + 1)
-    while get_sun_altitude(ephem, location, t_asr) > asr_altitude:
-        t_asr = ts.utc(t_asr.utc_datetime() + timedelta(minutes=1))
-    asr_utc = t_asr.utc_datetime()
-    
-    # 5. Maghrib (Same as Sunset)
-    # Adjust Maghrib time to when the whole sun is below the horizon (-1.066°) because Sun's apparent radius (~0.2665°) and refraction effect (~0.566° at horizon)
-    t_maghrib = ts.utc(sunset_utc.year, sunset_utc.month, sunset_utc.day, sunset_utc.hour, sunset_utc.minute)
-    while get_sun_altitude(ephem, location, t_maghrib) > -1.066:
-        t_maghrib = ts.utc(t_maghrib.utc_datetime() + timedelta(minutes=1))
-    maghrib_utc = t_maghrib.utc_datetime()
-    
-    # 6. Calculate Isha (when Sun is -18° below horizon, step by 1 minute)
-    t_isha = ts.utc(maghrib_utc.year, maghrib_utc.month, maghrib_utc.day, maghrib_utc.hour)
-    while get_sun_altitude(ephem, location, t_isha) > -18:
-        t_isha = ts.utc(t_isha.utc_datetime() + timedelta(minutes=1))
-    isha_utc = t_isha.utc_datetime()
+    # 1-6. Solve every prayer time to the second by bracketing the Sun altitude crossings (see ahc/prayertimes.py)
+    # Maghrib is when the whole sun is below the horizon (-1.066°) because Sun's apparent radius (~0.2665°) and refraction effect (~0.566° at horizon)
+    # Asr uses the shadow length formula: Shafi (1x shadow), Hanafi (2x shadow)
+    times = prayer_times_utc(location, year, month, day, time_zone, asr_method=asr_method)
     
     # Convert to local time
-    fajr_local = convert_utc_to_localtime(time_zone, fajr_utc)
-    sunrise_local = convert_utc_to_localtime(time_zone, sunrise_utc)
-    dhuhr_local = convert_utc_to_localtime(time_zone, dhuhr_utc)
-    asr_local = convert_utc_to_localtime(time_zone, asr_utc)
-    maghrib_local = convert_utc_to_localtime(time_zone, maghrib_utc)
-    isha_local = convert_utc_to_localtime(time_zone, isha_utc)
+    fajr_local = to_local(time_zone, times["fajr"][0])
+    sunrise_local = to_local(time_zone, times["sunrise"][0])
+    dhuhr_local = to_local(time_zone, times["dhuhr"][0])
+    asr_local = to_local(time_zone, round_up_minute(times["asr"][0]))
+    maghrib_local = to_local(time_zone, round_up_minute(times["maghrib"][0]))
+    isha_local = to_local(time_zone, round_up_minute(times["isha"][0]))
     
     # Print formatted prayer times
     wrapped_loc_name = textwrap.wrap(loc_name, width=25)
@@ -121,8 +80,10 @@ parser.add_argument("--latitude", type=float, help="Latitud lokasi")
 parser.add_argument("--longitude", type=float, help="Longitud lokasi")
 parser.add_argument("--elevation", type=float, help="Elevation dalam meter")
 parser.add_argument("--timezone", type=str, default="Asia/Kuala_Lumpur", help="Time zone (contoh Asia/Kuala_Lumpur)")
+parser.add_argument("--no-cache", action="store_true", help="Kira semula tanpa menggunakan cache keputusan")
 
 args = parser.parse_args()
+set_cache_enabled(not args.no_cache)
 
 locations = load_locations("database/location.txt")
 